@@ -0,0 +1,17 @@
+"""
+In-process benchmarks for CompactVault.
+
+Run from the repository root:
+
+    python -m benchmarks run --scale tiny --out results.json
+    python -m benchmarks compare old.json new.json
+
+Benchmarks drive CompactVaultManager directly (no HTTP), against a
+synthetic vault generated deterministically from a VaultSpec.
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
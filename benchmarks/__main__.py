@@ -0,0 +1,121 @@
+"""Command line entry point: python -m benchmarks {run,compare,cdc} ..."""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.synthetic import VaultSpec, parse_size_mix
+
+
+def in_scratch_dir(fn):
+    """Runs fn in a private working directory, since server keeps upload parts under ./upload_temp."""
+    workdir = tempfile.mkdtemp(prefix='cv-bench-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        return fn()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='CompactVault in-process benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='generate (or reuse) a synthetic vault and benchmark it')
+    run.add_argument('--scale', choices=sorted(VaultSpec.PRESETS), default='tiny')
+    run.add_argument('--assets', type=int, help='override the preset asset count')
+    run.add_argument('--projects', type=int)
+    run.add_argument('--collections-per-project', type=int)
+    run.add_argument('--depth', type=int, help='maximum collection nesting depth')
+    run.add_argument('--size-mix', help="file size mix, e.g. '4K:50,64K:30,1M:20'")
+    run.add_argument('--duplicate-ratio', type=float)
+    run.add_argument('--text-ratio', type=float)
+    run.add_argument('--seed', type=int)
+    run.add_argument('--vault', help='vault path; reused when it was generated from the same spec '
+                                     '(default: a throwaway vault in a temporary directory)')
+    run.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='concurrent ingest threads')
+    run.add_argument('--reps', type=int, default=20, help='repetitions per latency measurement')
+    run.add_argument('--cdc-mb', type=int, default=64, help='megabytes pushed through the chunker')
+    run.add_argument('--phases', help='comma-separated subset of cdc,ingest,listing,range_reads,full_reads,export')
+    run.add_argument('--out', help='write the JSON results here (default: stdout)')
+
+    cmp = sub.add_parser('compare', help='compare two result files')
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=0.0, help='only show changes of at least this many percent')
+
+    cdc = sub.add_parser('cdc', help='evaluate chunker configurations over a corpus and edited copies of it')
+    cdc.add_argument('corpus', help='directory of sample files')
+    cdc.add_argument('--config', action='append', dest='configs',
+                     help="'ingest', 'optimal' or 'min=64K,max=1M,sentinel=42fe[,impl=module:Class]'; repeatable")
+    cdc.add_argument('--mutations', default='insert,delete,append,prepend,reencode')
+    cdc.add_argument('--seed', type=int, default=1)
+    cdc.add_argument('--max-file-size', default='256M', help='skip larger files')
+    cdc.add_argument('--out', help='also write the JSON results here')
+
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == 'compare':
+        from benchmarks.suite import compare
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        for key, a, b, change in compare(old, new):
+            if change is not None and abs(change) < args.threshold:
+                continue
+            shown = 'n/a' if change is None else f'{change:+.1f}%'
+            print(f'{key:70s} {a:>14.3f} {b:>14.3f} {shown:>9s}')
+        return 0
+
+    out = os.path.abspath(args.out) if args.out else None
+
+    if args.command == 'cdc':
+        from benchmarks.synthetic import parse_size
+        corpus = os.path.abspath(args.corpus)
+
+        def evaluate_corpus() -> dict:
+            from benchmarks.cdc import ChunkerConfig, evaluate, format_table
+            configs = [ChunkerConfig.parse(c) for c in (args.configs or ['ingest', 'optimal'])]
+            results = evaluate(corpus, configs, tuple(args.mutations.split(',')), args.seed, parse_size(args.max_file_size))
+            print(format_table(results))
+            return results
+
+        results = in_scratch_dir(evaluate_corpus)
+        if out:
+            with open(out, 'w') as f:
+                f.write(json.dumps(results, indent=2) + '\n')
+        return 0
+
+    spec = VaultSpec.preset(
+        args.scale, assets=args.assets, projects=args.projects, collections_per_project=args.collections_per_project,
+        depth=args.depth, size_mix=parse_size_mix(args.size_mix) if args.size_mix else None,
+        duplicate_ratio=args.duplicate_ratio, text_ratio=args.text_ratio, seed=args.seed)
+    vault = os.path.abspath(args.vault) if args.vault else None
+    phases = args.phases.split(',') if args.phases else None
+
+    def run() -> dict:
+        from benchmarks.suite import run_suite
+        # Without --vault the vault lives in the scratch directory and goes with it.
+        return run_suite(spec, vault or os.path.abspath(f'bench-{args.scale}.vault'), workers=args.workers,
+                         reps=args.reps, cdc_mb=args.cdc_mb, phases=phases)
+
+    doc = in_scratch_dir(run)
+    text = json.dumps(doc, indent=2)
+    if out:
+        with open(out, 'w') as f:
+            f.write(text + '\n')
+        print(f'results written to {out}')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Chunker evaluation over a corpus directory and deterministic mutations of it.
+
+For every chunker configuration this reports throughput, the chunk size
+distribution, how many cut points survive an edit (boundary stability),
+how much of an edited file is covered by chunks of the original, and the
+dedup ratio of storing each file alongside all its edited versions.
+Results are split by data class (text/binary, classified the way ingest
+does), so parameters can be chosen per data type.
+"""
+import hashlib
+import importlib
+import io
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import server
+from benchmarks.synthetic import KB, MB, parse_size
+
+UPLOAD_PIECE = 5 * MB
+MUTATIONS = ('insert', 'delete', 'append', 'prepend', 'reencode')
+
+
+class ChunkerConfig:
+    """
+    A named chunker configuration. `params` maps a file (header bytes and
+    size) to (min, max, sentinel), so adaptive schemes such as the ingest
+    heuristic are evaluated exactly as ingest would apply them.
+    """
+
+    def __init__(self, name: str, params: Callable[[bytes, int, str], Tuple[int, int, bytes]],
+                 factory: Callable[..., Any] = server.OptimizedCDC) -> None:
+        self.name = name
+        self.params = params
+        self.factory = factory
+
+    def chunker(self, header: bytes, size: int, path: str) -> Any:
+        min_size, max_size, sentinel = self.params(header, size, path)
+        return self.factory(min_size=min_size, max_size=max_size, sentinel=sentinel)
+
+    @classmethod
+    def parse(cls, text: str) -> 'ChunkerConfig':
+        """
+        'ingest' (the heuristic in create_asset_from_chunks), 'optimal'
+        (OptimizedCDC.get_optimal_params), or fixed settings such as
+        'min=64K,max=1M,sentinel=42fe[,impl=package.module:Class]'.
+        """
+        if text == 'ingest':
+            return cls('ingest', lambda header, size, path: server.OptimizedCDC.ingest_params(
+                header, max(1, -(-size // UPLOAD_PIECE))))
+        if text == 'optimal':
+            return cls('optimal', lambda header, size, path: server.OptimizedCDC.get_optimal_params(path))
+        fields = dict(part.split('=', 1) for part in text.split(','))
+        min_size = parse_size(fields.get('min', '4K'))
+        max_size = parse_size(fields.get('max', '1M'))
+        sentinel = bytes.fromhex(fields.get('sentinel', '42fe'))
+        factory: Callable[..., Any] = server.OptimizedCDC
+        if 'impl' in fields:
+            module, _, attr = fields['impl'].partition(':')
+            factory = getattr(importlib.import_module(module), attr)
+        return cls(text, lambda header, size, path: (min_size, max_size, sentinel), factory)
+
+
+class _Unseekable(io.RawIOBase):
+    """In-memory stream without seek, so chunkers take the same streaming path as ingest."""
+
+    def __init__(self, data: bytes) -> None:
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        n = min(len(b), len(self.view) - self.pos)
+        b[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def classify(header: bytes) -> str:
+    """Same text test the ingest heuristic applies to the first upload piece."""
+    return 'text' if all(b < 128 for b in header[:100]) else 'binary'
+
+
+def chunk_bytes(chunker: Any, data: bytes) -> List[bytes]:
+    return list(chunker.chunk_file(io.BufferedReader(_Unseekable(data), buffer_size=1 << 20)))
+
+
+def cut_points(chunks: List[bytes]) -> List[int]:
+    """Offsets where each chunk ends, excluding the end of the file."""
+    points, pos = [], 0
+    for chunk in chunks[:-1]:
+        pos += len(chunk)
+        points.append(pos)
+    return points
+
+
+def mutate(data: bytes, kind: str, rng: random.Random) -> Tuple[bytes, Optional[Callable[[int], Optional[int]]]]:
+    """
+    Applies one edit and returns the new bytes plus a map from original
+    offsets to edited offsets (None where the offset was deleted, or no
+    map at all when the edit rewrites the whole file).
+    """
+    size = len(data)
+    if kind == 'insert':
+        at, n = rng.randrange(size + 1), rng.randint(1, 4 * KB)
+        return data[:at] + rng.randbytes(n) + data[at:], lambda c: c if c <= at else c + n
+    if kind == 'delete':
+        at = rng.randrange(size)
+        n = min(size - at, rng.randint(1, 4 * KB))
+        return data[:at] + data[at + n:], lambda c: c if c <= at else (c - n if c >= at + n else None)
+    if kind == 'append':
+        return data + rng.randbytes(rng.randint(1, 64 * KB)), lambda c: c
+    if kind == 'prepend':
+        n = rng.randint(1, 4 * KB)
+        return rng.randbytes(n) + data, lambda c: c + n
+    if kind == 'reencode':
+        # Same content, different byte representation: LF -> CRLF line endings.
+        return data.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n'), None
+    raise ValueError(f'unknown mutation {kind}')
+
+
+def iter_corpus(corpus: str, max_file_bytes: int) -> Iterator[Tuple[str, bytes]]:
+    for root, dirs, files in os.walk(corpus):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                if os.path.getsize(path) > max_file_bytes or not os.path.isfile(path):
+                    continue
+                with open(path, 'rb') as f:
+                    yield path, f.read()
+            except OSError:
+                continue
+
+
+def _distribution(sizes: List[int], max_sizes: List[int]) -> Dict[str, Any]:
+    if not sizes:
+        return {'chunks': 0}
+    ordered = sorted(sizes)
+
+    def pct(p: float) -> int:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    forced = sum(1 for s, m in zip(sizes, max_sizes) if s == m)
+    return {'chunks': len(sizes), 'mean': round(sum(sizes) / len(sizes)), 'min': ordered[0], 'p10': pct(0.10),
+            'p50': pct(0.50), 'p90': pct(0.90), 'max': ordered[-1], 'forced_cut_fraction': round(forced / len(sizes), 4)}
+
+
+class _ClassTotals:
+    """Accumulators for one (configuration, data class) pair."""
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.sizes: List[int] = []
+        self.max_sizes: List[int] = []
+        self.stability: Dict[str, List[int]] = {m: [0, 0] for m in MUTATIONS}  # kept, total cuts
+        self.reuse: Dict[str, List[int]] = {m: [0, 0] for m in MUTATIONS}  # reused bytes, edited bytes
+        self.logical = 0
+        self.unique: Dict[bytes, int] = {}
+
+    def store(self, chunks: List[bytes]) -> None:
+        for chunk in chunks:
+            self.logical += len(chunk)
+            self.unique.setdefault(hashlib.blake2b(chunk, digest_size=16).digest(), len(chunk))
+
+    def report(self) -> Dict[str, Any]:
+        unique_bytes = sum(self.unique.values())
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'mb_per_s': round(self.bytes / MB / self.seconds, 1) if self.seconds else None,
+            'chunk_sizes': _distribution(self.sizes, self.max_sizes),
+            'boundary_stability': {m: round(k / t, 4) if t else None for m, (k, t) in self.stability.items()},
+            'chunk_reuse': {m: round(r / t, 4) if t else None for m, (r, t) in self.reuse.items()},
+            'dedup_ratio': round(self.logical / unique_bytes, 3) if unique_bytes else None,
+        }
+
+
+def evaluate(corpus: str, configs: List[ChunkerConfig], mutations: Tuple[str, ...] = MUTATIONS,
+             seed: int = 1, max_file_bytes: int = 256 * MB) -> Dict[str, Any]:
+    """Runs every configuration over the corpus and its mutated versions."""
+    totals: Dict[str, Dict[str, _ClassTotals]] = {c.name: {} for c in configs}
+    for path, data in iter_corpus(corpus, max_file_bytes):
+        if not data:
+            continue
+        data_class = classify(data[:1024])
+        # Every configuration sees the same edits of a file. Re-encoding
+        # line endings is only meaningful for text.
+        edits = [(kind,) + mutate(data, kind, random.Random(f'{seed}:{path}:{kind}'))
+                 for kind in mutations if kind != 'reencode' or data_class == 'text']
+        for config in configs:
+            acc = totals[config.name].setdefault(data_class, _ClassTotals())
+            chunker = config.chunker(data[:1024], len(data), path)
+
+            started = time.perf_counter()
+            original = chunk_bytes(chunker, data)
+            acc.seconds += time.perf_counter() - started
+            acc.files += 1
+            acc.bytes += len(data)
+            acc.sizes.extend(len(c) for c in original)
+            acc.max_sizes.extend([chunker.max_size] * len(original))
+            acc.store(original)
+
+            original_cuts = cut_points(original)
+            original_hashes = {hashlib.blake2b(c, digest_size=16).digest() for c in original}
+            for kind, edited, offset_map in edits:
+                # Ingest re-derives parameters per upload, so edited files do too.
+                edited_chunker = config.chunker(edited[:1024], len(edited), path)
+                edited_chunks = chunk_bytes(edited_chunker, edited)
+                acc.store(edited_chunks)
+                reused = sum(len(c) for c in edited_chunks if hashlib.blake2b(c, digest_size=16).digest() in original_hashes)
+                acc.reuse[kind][0] += reused
+                acc.reuse[kind][1] += len(edited)
+                if offset_map is not None and original_cuts:
+                    edited_cuts = set(cut_points(edited_chunks))
+                    kept = sum(1 for c in original_cuts if offset_map(c) in edited_cuts)
+                    acc.stability[kind][0] += kept
+                    acc.stability[kind][1] += len(original_cuts)
+
+    results: Dict[str, Any] = {'corpus': os.path.abspath(corpus), 'seed': seed, 'mutations': list(mutations), 'configs': {}}
+    for name, by_class in totals.items():
+        results['configs'][name] = {data_class: acc.report() for data_class, acc in sorted(by_class.items())}
+
+    # Per data class, the configuration that deduplicates edited versions best.
+    best: Dict[str, Any] = {}
+    for name, by_class in results['configs'].items():
+        for data_class, report in by_class.items():
+            ratio = report['dedup_ratio'] or 0
+            if data_class not in best or ratio > best[data_class]['dedup_ratio']:
+                best[data_class] = {'config': name, 'dedup_ratio': ratio, 'mb_per_s': report['mb_per_s']}
+    results['best_dedup'] = best
+    return results
+
+
+def format_table(results: Dict[str, Any]) -> str:
+    lines = [f"{'config':40s} {'class':7s} {'MB/s':>8s} {'p50 KB':>8s} {'forced':>7s} {'dedup':>6s} "
+             + ' '.join(f'{m[:7]:>7s}' for m in results['mutations'])]
+    for name, by_class in results['configs'].items():
+        for data_class, r in by_class.items():
+            reuse = ' '.join(f"{'-':>7s}" if r['chunk_reuse'][m] is None else f"{r['chunk_reuse'][m]:7.3f}"
+                             for m in results['mutations'])
+            sizes = r['chunk_sizes']
+            lines.append(f"{name[:40]:40s} {data_class:7s} {r['mb_per_s'] or 0:8.1f} {sizes.get('p50', 0) / KB:8.1f} "
+                         f"{sizes.get('forced_cut_fraction', 0):7.3f} {r['dedup_ratio'] or 0:6.2f} {reuse}")
+    lines.append('(mutation columns: fraction of each edited file covered by chunks of the original)')
+    return '\n'.join(lines)
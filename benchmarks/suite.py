@@ -0,0 +1,319 @@
+"""Benchmark phases run against a CompactVaultManager and their machine-readable results."""
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import server
+from benchmarks import REPO_ROOT
+from benchmarks.synthetic import MB, LatencySample, VaultSpec, generate_vault, payload
+
+RESULTS_VERSION = 1
+
+
+def peak_rss_kb() -> int:
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+class NullSink:
+    """Write-only sink that counts bytes, standing in for a client socket."""
+
+    def __init__(self) -> None:
+        self.written = 0
+
+    def write(self, data: Any) -> int:
+        self.written += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def _timed(fn: Callable[[], Any], reps: int, sample: LatencySample) -> None:
+    for _ in range(reps):
+        started = time.perf_counter()
+        fn()
+        sample.add(time.perf_counter() - started)
+
+
+def bench_cdc(megabytes: int) -> Dict[str, Any]:
+    """
+    Checks OptimizedCDC.chunk_file against its documented envelope: small
+    files as a completed upload ingests them, the streaming path for large
+    files, and peak memory while chunking.
+    """
+    results: Dict[str, Any] = {}
+    # Ingest reads parts through ChainedFileWrapper, which is not seekable, so
+    # chunk_file's in-memory fast path never applies there. Time what runs:
+    # the ingest chunker parameters, plus hashing and compression per chunk.
+    small = payload(7, 900 * 1024, text=False)
+    min_sz, max_sz, sentinel = server.OptimizedCDC.ingest_params(small[:1024], 1)
+    reps = max(1, (megabytes * MB) // len(small))
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(small)
+        path = f.name
+    try:
+        chunks = 0
+        started = time.perf_counter()
+        for _ in range(reps):
+            with server.ChainedFileWrapper([path]) as stream:
+                for _ in server.ChunkEncoder(server.OptimizedCDC(min_size=min_sz, max_size=max_sz, sentinel=sentinel), stream):
+                    chunks += 1
+        elapsed = time.perf_counter() - started
+    finally:
+        os.remove(path)
+    results['small_file_ingest'] = {'kb': len(small) // 1024, 'files': reps, 'chunks': chunks,
+                                    'mb_per_s': round(reps * len(small) / MB / elapsed, 1)}
+
+    for kind, text in (('binary', False), ('text', True)):
+        sentinel = b'\xFF\xFE' if text else b'\x42\xFE'
+        streaming = server.OptimizedCDC(min_size=65536, max_size=1048576, sentinel=sentinel)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            for i in range(megabytes):
+                f.write(payload(1000 + i, MB, text))
+            path = f.name
+        try:
+            chunks = 0
+            started = time.perf_counter()
+            # ChainedFileWrapper is what ingest feeds the chunker; it is not
+            # seekable, so this measures the streaming path.
+            stream = server.ChainedFileWrapper([path])
+            for _ in streaming.chunk_file(stream):
+                chunks += 1
+            stream.close()
+            elapsed = time.perf_counter() - started
+
+            tracemalloc.start()
+            stream = server.ChainedFileWrapper([path])
+            for _ in streaming.chunk_file(stream):
+                pass
+            stream.close()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            os.remove(path)
+        results[f'stream_{kind}'] = {
+            'mb': megabytes, 'mb_per_s': round(megabytes / elapsed, 1), 'chunks': chunks,
+            'mean_chunk_kb': round(megabytes * 1024 / max(chunks, 1), 1),
+            'peak_traced_mb': round(peak / MB, 2),
+        }
+    return results
+
+
+def _largest_collection(manager: 'server.CompactVaultManager') -> Tuple[Optional[int], int]:
+    with manager._get_read_conn() as conn:
+        row = conn.execute("SELECT collection_id, COUNT(*) AS n FROM assets GROUP BY collection_id ORDER BY n DESC LIMIT 1").fetchone()
+    return (row['collection_id'], row['n']) if row else (None, 0)
+
+
+def bench_listing(manager: 'server.CompactVaultManager', reps: int) -> Dict[str, Any]:
+    """Latency of the asset listing query for each sort/filter combination, at the first and a deep page."""
+    cid, total = _largest_collection(manager)
+    if cid is None:
+        return {}
+    results: Dict[str, Any] = {'collection_id': cid, 'collection_assets': total}
+    deep = max(0, total // 2)
+    cases = []
+    for sort_by in ('filename', 'size'):
+        for order in ('asc', 'desc'):
+            cases.append((f'sort_{sort_by}_{order}', dict(sort_by=sort_by, sort_order=order)))
+    cases.append(('filter_type', dict(filter_by_type='txt')))
+    cases.append(('filter_query', dict(query='00')))
+    for name, kwargs in cases:
+        for page, offset in (('first', 0), ('deep', deep)):
+            sample = LatencySample()
+            _timed(lambda: manager.get_assets_for_collection(cid, offset=offset, limit=50, **kwargs), reps, sample)
+            results[f'{name}/{page}'] = sample.summary()
+    return results
+
+
+def _sample_assets(manager: 'server.CompactVaultManager', count: int, min_size: int, seed: int) -> List[Tuple[int, int]]:
+    with manager._get_read_conn() as conn:
+        rows = conn.execute(
+            "SELECT id, json_extract(manifest, '$.total_size') AS size FROM assets "
+            "WHERE json_extract(manifest, '$.total_size') >= ? ORDER BY id", (min_size,)).fetchall()
+    ids = [(r['id'], r['size']) for r in rows]
+    random.Random(seed).shuffle(ids)
+    return ids[:count]
+
+
+def bench_range_reads(manager: 'server.CompactVaultManager', reps: int, seed: int) -> Dict[str, Any]:
+    """Latency of random inclusive byte ranges, as seek-heavy media players issue them."""
+    results: Dict[str, Any] = {}
+    rng = random.Random(seed)
+    for label, length in (('64k', 64 * 1024), ('1m', MB)):
+        assets = _sample_assets(manager, reps, length, seed)
+        if not assets:
+            continue
+        sample = LatencySample()
+        first_byte = LatencySample()
+        for aid, size in assets:
+            start = rng.randrange(0, size - length + 1)
+            meta = manager.get_asset_metadata(aid)
+            offsets = manager.chunk_offsets(meta['manifest'])
+            began = time.perf_counter()
+            first = True
+            for part in manager.stream_asset_range(aid, start, start + length - 1, meta['manifest'], offsets):
+                if first:
+                    first_byte.add(time.perf_counter() - began)
+                    first = False
+            sample.add(time.perf_counter() - began)
+        results[label] = {'total': sample.summary(), 'first_byte': first_byte.summary()}
+    return results
+
+
+def bench_full_reads(manager: 'server.CompactVaultManager', count: int, seed: int) -> Dict[str, Any]:
+    """Sequential whole-asset streaming throughput over a sample of assets of at least 1 MB."""
+    assets = _sample_assets(manager, count, MB, seed) or _sample_assets(manager, count, 0, seed)
+    total = 0
+    started = time.perf_counter()
+    for aid, _ in assets:
+        for part in manager.stream_asset_data(aid):
+            total += len(part)
+    elapsed = time.perf_counter() - started
+    return {'assets': len(assets), 'bytes': total, 'mb_per_s': round(total / MB / elapsed, 2) if elapsed else None}
+
+
+def bench_export(manager: 'server.CompactVaultManager') -> Dict[str, Any]:
+    """Zip and tar export throughput of the largest project into a null sink."""
+    with manager._get_read_conn() as conn:
+        row = conn.execute(
+            "SELECT c.project_id, COUNT(*) AS n FROM assets a JOIN collections c ON c.id = a.collection_id "
+            "GROUP BY c.project_id ORDER BY n DESC LIMIT 1").fetchone()
+    if not row:
+        return {}
+    project_id = row['project_id']
+    results: Dict[str, Any] = {'project_id': project_id}
+
+    started = time.perf_counter()
+    entries = manager.resolve_export_entries_for_project(project_id)
+    results['resolve_seconds'] = round(time.perf_counter() - started, 3)
+    results['files'] = len(entries)
+    results['bytes'] = sum(size for _, _, size in entries)
+
+    for fmt in ('zip', 'tar', 'tar.gz'):
+        sink = NullSink()
+        started = time.perf_counter()
+        pipeline = server.ExportPipeline(manager, entries, label=f'benchmark {fmt}')
+        if fmt == 'zip':
+            pipeline.write_zip(sink)
+        else:
+            pipeline.write_tar(sink, None if fmt == 'tar' else fmt)
+        elapsed = time.perf_counter() - started
+        results[fmt] = {'seconds': round(elapsed, 3), 'output_bytes': sink.written,
+                        'mb_per_s': round(results['bytes'] / MB / elapsed, 2) if elapsed else None}
+
+    started = time.perf_counter()
+    layout = manager.get_zip_layout('project', project_id)
+    results['zip_layout_seconds'] = round(time.perf_counter() - started, 3)
+    if layout is not None:
+        sink = NullSink()
+        started = time.perf_counter()
+        for part in layout.iter_full(manager, 'benchmark zip layout'):
+            sink.write(part)
+        elapsed = time.perf_counter() - started
+        results['zip_layout_stream'] = {'seconds': round(elapsed, 3), 'output_bytes': sink.written,
+                                        'mb_per_s': round(results['bytes'] / MB / elapsed, 2) if elapsed else None}
+    return results
+
+
+def run_suite(spec: VaultSpec, vault_path: str, workers: int = 4, reps: int = 20, cdc_mb: int = 64,
+              phases: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Runs the selected phases (all by default) and returns a results document.
+    An existing vault generated from the same spec is reused, which skips
+    the ingest phase; that keeps the large scales practical to rerun.
+    """
+    phases = phases or ['cdc', 'ingest', 'listing', 'range_reads', 'full_reads', 'export']
+    doc: Dict[str, Any] = {'version': RESULTS_VERSION, 'environment': environment(), 'spec': spec.to_dict(),
+                           'vault': os.path.abspath(vault_path), 'results': {}, 'peak_rss_kb': {}}
+
+    def record(name: str, fn: Callable[[], Any]) -> None:
+        print(f'[{name}]', flush=True)
+        started = time.perf_counter()
+        doc['results'][name] = fn()
+        doc['results'][name + '_seconds'] = round(time.perf_counter() - started, 3)
+        doc['peak_rss_kb'][name] = peak_rss_kb()
+
+    if 'cdc' in phases:
+        record('cdc', lambda: bench_cdc(cdc_mb))
+
+    manager = server.CompactVaultManager(vault_path)
+    try:
+        with manager._get_read_conn() as conn:
+            row = conn.execute("SELECT value FROM vault_properties WHERE key = 'benchmark_spec'").fetchone()
+            has_assets = conn.execute("SELECT 1 FROM assets LIMIT 1").fetchone() is not None
+        existing = row['value'] if row else None
+        if existing != spec.fingerprint():
+            if has_assets:
+                raise ValueError(f'{vault_path} holds data not generated from this spec; use a fresh --vault path')
+            if 'ingest' not in phases:
+                phases = ['ingest'] + phases
+        else:
+            phases = [p for p in phases if p != 'ingest']
+            doc['reused_vault'] = True
+
+        if 'ingest' in phases:
+            record('ingest', lambda: generate_vault(manager, spec, workers))
+            with manager.lock:
+                manager.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES ('benchmark_spec', ?)",
+                                     (spec.fingerprint(),))
+                manager.conn.commit()
+        if 'listing' in phases:
+            record('listing', lambda: bench_listing(manager, reps))
+        if 'range_reads' in phases:
+            record('range_reads', lambda: bench_range_reads(manager, reps, spec.seed))
+        if 'full_reads' in phases:
+            record('full_reads', lambda: bench_full_reads(manager, reps, spec.seed))
+        if 'export' in phases:
+            record('export', lambda: bench_export(manager))
+    finally:
+        manager.close()
+    doc['vault_bytes'] = os.path.getsize(vault_path)
+    return doc
+
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f'{prefix}.{k}' if prefix else str(k), v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[Tuple[str, float, float, Optional[float]]]:
+    """(metric, old, new, percent change) for every numeric result present in both documents."""
+    a: Dict[str, float] = {}
+    b: Dict[str, float] = {}
+    _flatten('', {'results': old.get('results', {}), 'peak_rss_kb': old.get('peak_rss_kb', {})}, a)
+    _flatten('', {'results': new.get('results', {}), 'peak_rss_kb': new.get('peak_rss_kb', {})}, b)
+    rows = []
+    for key in sorted(a.keys() & b.keys()):
+        change = (b[key] - a[key]) / a[key] * 100 if a[key] else None
+        rows.append((key, a[key], b[key], change))
+    return rows
@@ -0,0 +1,229 @@
+"""Deterministic synthetic vault generation."""
+import concurrent.futures
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import server
+
+KB = 1024
+MB = 1024 * 1024
+
+TEXT_FORMATS = ('txt', 'md', 'json', 'csv')
+BINARY_FORMATS = ('bin', 'png', 'mp4', 'pdf')
+WORDS = ('vault', 'chunk', 'archive', 'manifest', 'asset', 'collection', 'project', 'render', 'texture',
+         'sample', 'frame', 'layer', 'index', 'delta', 'stream', 'block', 'hash', 'record', 'scene', 'model')
+
+# Upload pieces are written like the SPA sends them.
+UPLOAD_PIECE = 5 * MB
+
+
+def parse_size(text: str) -> int:
+    """Parses '512', '4K', '1.5M' or '2G' into bytes."""
+    text = text.strip().upper()
+    for suffix, factor in (('G', 1024 * MB), ('M', MB), ('K', KB)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def parse_size_mix(text: str) -> Tuple[Tuple[int, float], ...]:
+    """Parses '4K:50,64K:30,1M:20' into ((size, weight), ...)."""
+    mix = []
+    for part in text.split(','):
+        size, _, weight = part.partition(':')
+        mix.append((parse_size(size), float(weight or 1)))
+    return tuple(mix)
+
+
+class VaultSpec:
+    """Shape of a synthetic vault. Equal specs generate byte-identical content."""
+
+    PRESETS: Dict[str, Dict[str, Any]] = {
+        'tiny': {'assets': 1_000, 'projects': 2, 'collections_per_project': 8, 'depth': 2,
+                 'size_mix': ((2 * KB, 50), (16 * KB, 30), (256 * KB, 15), (4 * MB, 5))},
+        'small': {'assets': 10_000, 'projects': 4, 'collections_per_project': 16, 'depth': 3,
+                  'size_mix': ((2 * KB, 55), (16 * KB, 30), (256 * KB, 14), (8 * MB, 1))},
+        'medium': {'assets': 100_000, 'projects': 8, 'collections_per_project': 32, 'depth': 3,
+                   'size_mix': ((1 * KB, 60), (8 * KB, 30), (64 * KB, 9.9), (16 * MB, 0.1))},
+        'large': {'assets': 1_000_000, 'projects': 16, 'collections_per_project': 64, 'depth': 4,
+                  'size_mix': ((512, 60), (4 * KB, 35), (32 * KB, 5))},
+        'huge': {'assets': 10_000_000, 'projects': 32, 'collections_per_project': 128, 'depth': 4,
+                 'size_mix': ((256, 70), (2 * KB, 28), (16 * KB, 2))},
+    }
+
+    def __init__(self, assets: int = 1_000, projects: int = 2, collections_per_project: int = 8, depth: int = 2,
+                 size_mix: Tuple[Tuple[int, float], ...] = ((2 * KB, 50), (16 * KB, 30), (256 * KB, 15), (4 * MB, 5)),
+                 duplicate_ratio: float = 0.2, text_ratio: float = 0.5, seed: int = 1) -> None:
+        self.assets = assets
+        self.projects = projects
+        self.collections_per_project = collections_per_project
+        self.depth = depth
+        self.size_mix = tuple((int(s), float(w)) for s, w in size_mix)
+        self.duplicate_ratio = duplicate_ratio
+        self.text_ratio = text_ratio
+        self.seed = seed
+
+    @classmethod
+    def preset(cls, name: str, **overrides: Any) -> 'VaultSpec':
+        params = dict(cls.PRESETS[name])
+        params.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**params)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'assets': self.assets, 'projects': self.projects,
+            'collections_per_project': self.collections_per_project, 'depth': self.depth,
+            'size_mix': [list(m) for m in self.size_mix], 'duplicate_ratio': self.duplicate_ratio,
+            'text_ratio': self.text_ratio, 'seed': self.seed,
+        }
+
+    def fingerprint(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+def payload(seed: int, size: int, text: bool) -> bytes:
+    """Deterministic content: random bytes, or word-salad text that compresses like prose."""
+    rng = random.Random(seed)
+    if not text:
+        return rng.randbytes(size)
+    out = bytearray()
+    while len(out) < size:
+        line = ' '.join(rng.choices(WORDS, k=12)) + f' {rng.randrange(1_000_000)}\n'
+        out.extend(line.encode('ascii'))
+    return bytes(out[:size])
+
+
+class LatencySample:
+    """Reservoir of at most `limit` observations, so huge runs keep bounded memory."""
+
+    def __init__(self, limit: int = 10_000, seed: int = 0) -> None:
+        self.limit = limit
+        self.values: List[float] = []
+        self.count = 0
+        self.total = 0.0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def add(self, value: float) -> None:
+        with self.lock:
+            self.count += 1
+            self.total += value
+            if len(self.values) < self.limit:
+                self.values.append(value)
+            else:
+                j = self.rng.randrange(self.count)
+                if j < self.limit:
+                    self.values[j] = value
+
+    def summary(self, scale: float = 1000.0) -> Dict[str, Any]:
+        """Percentiles in milliseconds by default."""
+        if not self.values:
+            return {'count': 0}
+        ordered = sorted(self.values)
+
+        def pct(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * scale, 3)
+
+        return {'count': self.count, 'mean': round(self.total / self.count * scale, 3),
+                'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99), 'max': round(ordered[-1] * scale, 3)}
+
+
+def _build_collections(manager: 'server.CompactVaultManager', spec: VaultSpec, rng: random.Random) -> List[int]:
+    """Creates projects and a random collection forest of bounded depth in each."""
+    collection_ids: List[int] = []
+    for p in range(spec.projects):
+        project_id = manager.create_project(f'Bench project {p:03d}', 'benchmark', f'seed {spec.seed}')
+        levels: List[List[int]] = [[] for _ in range(spec.depth)]
+        for c in range(spec.collections_per_project):
+            depth = 0 if not levels[0] else rng.randrange(spec.depth)
+            while depth and not levels[depth - 1]:
+                depth -= 1
+            parent = rng.choice(levels[depth - 1]) if depth else None
+            cid = manager.create_collection(project_id, f'collection {p:03d}.{c:04d}', 'collection', parent)
+            levels[depth].append(cid)
+            collection_ids.append(cid)
+    return collection_ids
+
+
+def generate_vault(manager: 'server.CompactVaultManager', spec: VaultSpec, workers: int = 4,
+                   progress_every: float = 10.0) -> Dict[str, Any]:
+    """
+    Fills an empty vault through the real ingest path (create_asset_from_chunks)
+    and returns ingest throughput figures. Duplicates re-send the content of an
+    earlier asset under a new name, so they exercise chunk-level dedup.
+    """
+    rng = random.Random(spec.seed)
+    collection_ids = _build_collections(manager, spec, rng)
+    sizes = [s for s, _ in spec.size_mix]
+    weights = [w for _, w in spec.size_mix]
+    originals: List[Tuple[int, int, bool]] = []  # bounded reservoir of (seed, size, text)
+
+    latencies = LatencySample(seed=spec.seed)
+    logical_bytes = 0
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    errors: List[str] = []
+
+    def ingest(cid: int, paths: List[str], filename: str) -> None:
+        started = time.perf_counter()
+        try:
+            manager.create_asset_from_chunks(cid, '', paths, filename)
+            latencies.add(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(f'{filename}: {e}')
+        finally:
+            in_flight.release()
+
+    started = time.perf_counter()
+    last_report = started
+    os.makedirs(server.UPLOAD_TEMP_DIR, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for i in range(spec.assets):
+            if originals and rng.random() < spec.duplicate_ratio:
+                seed, size, text = rng.choice(originals)
+            else:
+                base = rng.choices(sizes, weights)[0]
+                size = max(1, int(base * rng.uniform(0.75, 1.25)))
+                text = rng.random() < spec.text_ratio
+                seed = spec.seed * 1_000_003 + i
+                if len(originals) < 4096:
+                    originals.append((seed, size, text))
+                else:
+                    originals[rng.randrange(4096)] = (seed, size, text)
+            fmt = rng.choice(TEXT_FORMATS if text else BINARY_FORMATS)
+            filename = f'{"doc" if text else "blob"}_{i:08d}.{fmt}'
+            data = payload(seed, size, text)
+            logical_bytes += size
+
+            upload_dir = os.path.join(server.UPLOAD_TEMP_DIR, f'bench_{i:08d}')
+            os.makedirs(upload_dir)
+            paths = []
+            for n, offset in enumerate(range(0, size, UPLOAD_PIECE)):
+                path = os.path.join(upload_dir, str(n))
+                with open(path, 'wb') as f:
+                    f.write(data[offset:offset + UPLOAD_PIECE])
+                paths.append(path)
+
+            in_flight.acquire()
+            pool.submit(ingest, rng.choice(collection_ids), paths, filename)
+
+            now = time.perf_counter()
+            if progress_every and now - last_report >= progress_every:
+                last_report = now
+                print(f'  ingest: {i + 1}/{spec.assets} assets, {(i + 1) / (now - started):.0f} assets/s', flush=True)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'assets': spec.assets,
+        'collections': len(collection_ids),
+        'logical_bytes': logical_bytes,
+        'seconds': round(elapsed, 3),
+        'assets_per_s': round(spec.assets / elapsed, 2),
+        'mb_per_s': round(logical_bytes / MB / elapsed, 2),
+        'latency_ms': latencies.summary(),
+        'errors': errors[:20],
+        'error_count': len(errors),
+    }
@@ -9,7 +9,7 @@ import zipfile
 import re
 import hashlib
 import mimetypes
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, quote, unquote
 import logging
 import signal
 import sys
@@ -24,9 +24,27 @@ import threading
 import time
 import base64
 import io
-from collections import defaultdict
+import codecs
+import bisect
+import struct
+import datetime
+import email.utils
+from collections import defaultdict, deque, OrderedDict
+import concurrent.futures
+import mmap
+import uuid
+import getpass
+import argparse
+import tarfile
+import bz2
+import lzma
+import itertools
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
 from socketserver import ThreadingMixIn
-from typing import Any, Dict, List, Optional, Tuple, Iterator
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Iterator
 
 class OptimizedCDC:
     """Production-ready CDC with all optimizations."""
@@ -105,6 +123,21 @@ class OptimizedCDC:
         if buffer:
             yield memoryview(buffer).tobytes()
     
+    @staticmethod
+    def ingest_params(header: bytes, piece_count: int) -> Tuple[int, int, bytes]:
+        """Parameters used at ingest, from the first upload piece's header and the piece count."""
+        # Simple heuristic for chunking parameters without reading whole file size
+        # Assuming if there are many chunks, it's a big file
+        if piece_count > 2:
+            min_sz, max_sz = 65536, 1048576 # 1MB chunks
+        else:
+            min_sz, max_sz = 4096, 262144
+
+        sentinel = b'\x42\xFE'
+        if all(b < 128 for b in header[:100]):
+            sentinel = b'\xFF\xFE'
+        return (min_sz, max_sz, sentinel)
+
     @staticmethod
     def get_optimal_params(file_path: str) -> Tuple[int, int, bytes]:
         """Generate optimal parameters based on file analysis."""
@@ -131,6 +164,166 @@ class OptimizedCDC:
         except Exception:
             return (4096, 1048576, b'\x42\xFE')  # Defaults
 
+class ChunkEncoder:
+    """
+    Chunks a stream and yields (hash, size, compressed) per chunk,
+    accumulating the whole-file CRC-32 (for zip export), SHA-256 (for the
+    duplicate-file index) and the first PREVIEW_MAX_BYTES (for the text
+    preview) as it goes. A digest the caller already computed is taken as is.
+    """
+
+    __slots__ = ('cdc', 'stream', 'crc', 'sha256', 'known_digest', 'head', 'on_chunk')
+
+    def __init__(self, cdc: OptimizedCDC, stream: io.IOBase, on_chunk: Optional[Callable[[int], None]] = None,
+                 digest: Optional[str] = None) -> None:
+        self.cdc = cdc
+        self.stream = stream
+        self.crc = 0
+        self.known_digest = digest
+        self.sha256 = None if digest else hashlib.sha256()
+        self.head = bytearray()
+        self.on_chunk = on_chunk
+
+    @property
+    def digest(self) -> str:
+        return self.known_digest or self.sha256.hexdigest()
+
+    def __iter__(self) -> Iterator[Tuple[str, int, bytes]]:
+        for chunk_data in self.cdc.chunk_file(self.stream):
+            self.crc = zlib.crc32(chunk_data, self.crc)
+            if self.sha256:
+                self.sha256.update(chunk_data)
+            if len(self.head) < PREVIEW_MAX_BYTES:
+                self.head += chunk_data[:PREVIEW_MAX_BYTES - len(self.head)]
+            if self.on_chunk:
+                self.on_chunk(len(chunk_data))
+            # OPTIMIZATION: Lower compression level for speed (1=Fastest, 9=Best)
+            yield hashlib.blake2b(chunk_data).hexdigest(), len(chunk_data), zlib.compress(chunk_data, level=1)
+
+
+def sha256_files(paths: List[str]) -> str:
+    """Hex SHA-256 of files read back to back (the parts of an upload)."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1048576)
+                if not block:
+                    break
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Manifest format 2: chunks are the leaves of a Merkle tree (RFC 6962 shape,
+# BLAKE2b-256 with 0x00/0x01 leaf/node prefixes) whose root is stored in the
+# manifest. Format 1 manifests link each block to the hash of the previous
+# block's JSON instead ('previous_hash') and have no stored root.
+MANIFEST_VERSION = 2
+
+
+def merkle_leaf(chunk_hash: str, size: int) -> bytes:
+    return hashlib.blake2b(b'\x00' + bytes.fromhex(chunk_hash) + size.to_bytes(8, 'big'), digest_size=32).digest()
+
+
+def _merkle_node(left: bytes, right: bytes) -> bytes:
+    return hashlib.blake2b(b'\x01' + left + right, digest_size=32).digest()
+
+
+def _merkle_split(n: int) -> int:
+    """Size of the left subtree over n > 1 leaves: the largest power of two below n."""
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """Root over leaf hashes. Pairing bottom-up and carrying an odd last node builds the RFC 6962 tree."""
+    if not leaves:
+        return hashlib.blake2b(b'', digest_size=32).digest()
+    level = list(leaves)
+    while len(level) > 1:
+        paired = [_merkle_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def manifest_leaves(manifest: Dict[str, Any]) -> List[bytes]:
+    return [merkle_leaf(b['chunk_hash'], b['size']) for b in manifest['chain']]
+
+
+def merkle_range_proof(leaves: List[bytes], lo: int, hi: int) -> List[bytes]:
+    """
+    Hashes of the subtrees entirely outside leaves[lo:hi], in left-to-right
+    order: with the leaves in the range they rebuild the root. A contiguous
+    range needs at most two per tree level.
+    """
+    proof: List[bytes] = []
+
+    def walk(a: int, b: int) -> None:
+        if b <= lo or hi <= a:
+            proof.append(merkle_root(leaves[a:b]))
+        elif b - a > 1:
+            k = _merkle_split(b - a)
+            walk(a, a + k)
+            walk(a + k, b)
+
+    walk(0, len(leaves))
+    return proof
+
+
+def merkle_root_from_range(count: int, lo: int, hi: int, range_leaves: List[bytes], proof: List[bytes]) -> bytes:
+    """Rebuilds the root of a count-leaf tree from leaves[lo:hi] and merkle_range_proof(); ValueError if they do not fit."""
+    if not 0 <= lo < hi <= count or len(range_leaves) != hi - lo:
+        raise ValueError('range does not match the leaves supplied')
+    leaf_iter, proof_iter = iter(range_leaves), iter(proof)
+
+    def walk(a: int, b: int) -> bytes:
+        if b <= lo or hi <= a:
+            return next(proof_iter)
+        if b - a == 1:
+            return next(leaf_iter)
+        k = _merkle_split(b - a)
+        return _merkle_node(walk(a, a + k), walk(a + k, b))
+
+    try:
+        root = walk(0, count)
+    except StopIteration:
+        raise ValueError('proof is too short') from None
+    if next(proof_iter, None) is not None:
+        raise ValueError('proof is too long')
+    return root
+
+
+PREVIEW_MAX_BYTES = 32 * 1024
+
+
+def build_text_preview(head: bytes, total_size: int, fmt: Optional[str]) -> Tuple[str, int, bool, str]:
+    """
+    Turns the first PREVIEW_MAX_BYTES of a text asset into the preview
+    shown by the UI: (text, line count, truncated, encoding guess). Line
+    endings are normalised to LF, and complete JSON is pretty-printed.
+    """
+    head = bytes(head[:PREVIEW_MAX_BYTES])
+    truncated = total_size > len(head)
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    elif head.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    else:
+        try:
+            head.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError as e:
+            # A multi-byte character cut by the truncation is still UTF-8.
+            encoding = 'utf-8' if truncated and e.start >= len(head) - 3 and e.reason == 'unexpected end of data' else 'latin-1'
+    text = head.decode(encoding, errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+    if fmt == 'json' and not truncated:
+        try: text = json.dumps(json.loads(text), indent=2)
+        except ValueError: pass
+    line_count = text.count('\n') + (1 if text and not text.endswith('\n') else 0)
+    return text, line_count, truncated, encoding
+
+
 class ThreadedHTTPServer(ThreadingMixIn, http.server.HTTPServer):
     pass
 
@@ -151,6 +344,7 @@ HTML_TEMPLATE = '''
   <header class="topbar">
     <div class="brand">CompactVault</div>
     <div class="actions">
+      <a href="/vaults" class="small" title="Switch to or unlock another vault">Vaults</a>
       <button id="vacuum-btn" class="small">Vacuum</button>
       <button id="theme-toggle" class="small" aria-label="Toggle theme">🌓</button>
     </div>
@@ -180,6 +374,7 @@ HTML_TEMPLATE = '''
       </div>
       <div id="assets-controls" class="controls">
         <button id="upload-files" class="small" aria-label="Upload files">Upload</button>
+        <label class="small" title="Store the files inside zip and tar uploads instead of the archive"><input id="expand-archives" type="checkbox"> Expand archives</label>
         <input id="search-assets" placeholder="Search assets..." class="small">
         <select id="filter-by-type" class="small" aria-label="Filter by type">
           <option value="">All Types</option>
@@ -206,7 +401,7 @@ HTML_TEMPLATE = '''
   </main>
 
   <div id="toast" class="toast hidden" role="alert"></div>
-  <input id="file-input" type="file" multiple style="display:none" accept=".png,.jpg,.jpeg,.gif,.svg,.webp,.mp3,.wav,.ogg,.m4a,.flac,.mp4,.mov,.webm,.mkv,.avi,.flv,.gltf,.glb,.epub,.pdf,.zip,.rar,.7z" />
+  <input id="file-input" type="file" multiple style="display:none" accept=".png,.jpg,.jpeg,.gif,.svg,.webp,.mp3,.wav,.ogg,.m4a,.flac,.mp4,.mov,.webm,.mkv,.avi,.flv,.gltf,.glb,.epub,.pdf,.zip,.rar,.7z,.tar,.tgz,.gz,.tbz2,.bz2,.txz,.xz" />
   <div id="progress-container" class="progress-container hidden">
     <p id="progress-title">Uploading...</p>
     <small id="progress-subtitle"></small>
@@ -659,7 +854,8 @@ document.addEventListener('DOMContentLoaded', () => {
   // API helper with error handling
   const api = async (path, opts = {}) => {
     try {
-      const r = await fetch("/api" + path, opts);
+      // Relative, so a UI served under /v/<vault>/ talks to that vault.
+      const r = await fetch("api" + path, opts);
       if (!r.ok) {
         const err = await r.json().catch(() => ({message: r.statusText}));
         throw new Error(err.message);
@@ -734,7 +930,7 @@ document.addEventListener('DOMContentLoaded', () => {
         downloadBtn.textContent = "Download";
         downloadBtn.onclick = (ev) => {
             ev.stopPropagation();
-            downloadAsset(`/api/projects/${p.id}/download`, `${p.name}.zip`);
+            downloadAsset(`api/projects/${p.id}/download`, `${p.name}.zip`);
         };
         li.appendChild(downloadBtn);
 
@@ -787,7 +983,7 @@ document.addEventListener('DOMContentLoaded', () => {
     downloadBtn.textContent = "Download";
     downloadBtn.onclick = (ev) => {
         ev.stopPropagation();
-        downloadAsset(`/api/collections/${item.id}/download`, `${item.name}.zip`);
+        downloadAsset(`api/collections/${item.id}/download`, `${item.name}.zip`);
     };
     li.appendChild(downloadBtn);
 
@@ -1042,12 +1238,12 @@ document.addEventListener('DOMContentLoaded', () => {
       const down = document.createElement("button");
       down.className = "btn";
       down.textContent = "Download";
-      down.onclick = () => downloadAsset(`/api/assets/${asset_id}`, res.filename);
+      down.onclick = () => downloadAsset(`api/assets/${asset_id}`, res.filename);
       btns.appendChild(down);
 
       const dragLink = document.createElement("a");
       dragLink.className = "btn";
-      dragLink.href = `/api/assets/${asset_id}`;
+      dragLink.href = `api/assets/${asset_id}`;
       if (res.type === "video" || res.type === "audio") {
         dragLink.textContent = "Drag to Player";
       } else if (res.type === "image") {
@@ -1071,20 +1267,20 @@ document.addEventListener('DOMContentLoaded', () => {
       } else if (res.type === "image") {
         const img = document.createElement("img");
         img.style.maxWidth = "100%";
-        img.src = `/api/assets/${asset_id}`;
+        img.src = `api/assets/${asset_id}`;
         img.alt = res.filename;
         surface.appendChild(img);
       } else if (res.type === "audio") {
         const a = document.createElement("audio");
         a.controls = true;
-        a.src = `/api/assets/${asset_id}`;
+        a.src = `api/assets/${asset_id}`;
         a.title = res.filename;
         surface.appendChild(a);
       } else if (res.type === "video") {
         const v = document.createElement("video");
         v.controls = true;
         v.style.maxWidth = "100%";
-        v.src = `/api/assets/${asset_id}`;
+        v.src = `api/assets/${asset_id}`;
         v.title = res.filename;
         surface.appendChild(v);
       } else {
@@ -1109,48 +1305,258 @@ document.addEventListener('DOMContentLoaded', () => {
     return text;
   }
 
-  // Upload file in chunks
-  async function uploadFileInChunks(file, collection_id, path_prefix = '', on_progress) {
-    const CHUNK_SIZE = 5 * 1024 * 1024; // 5MB
-    const upload_id = 'uid-' + Date.now() + '-' + Math.random().toString(36).substr(2, 9);
-    const total_chunks = Math.ceil(file.size / CHUNK_SIZE);
+  // POST that waits out ingest backpressure (429/503) for as long as the server's Retry-After asks
+  async function postWithBackoff(url, options) {
+    for (let attempt = 0; ; attempt++) {
+      const response = await fetch(url, Object.assign({method: 'POST'}, options));
+      if ((response.status !== 429 && response.status !== 503) || attempt >= 20) return response;
+      const wait = parseInt(response.headers.get('Retry-After') || '5', 10);
+      await new Promise(resolve => setTimeout(resolve, Math.max(1, wait) * 1000));
+    }
+  }
+
+  // Hex SHA-256 of an ArrayBuffer, or null where WebCrypto is unavailable (non-secure origins)
+  async function sha256Hex(buffer) {
+    if (!(window.crypto && crypto.subtle)) return null;
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  // Stable id for a file in a target location, so re-dropping it after a failure or reload resumes it.
+  // The page path names the vault, so the same drop into another hosted vault gets its own id.
+  async function uploadIdFor(file, collection_id, path_prefix) {
+    const key = [location.pathname, collection_id, path_prefix, file.name, file.size, file.lastModified].join('|');
+    const hex = await sha256Hex(new TextEncoder().encode(key));
+    if (hex) return 'up-' + hex.slice(0, 40);
+    let h1 = 0x811c9dc5, h2 = 0x01000193;
+    for (let i = 0; i < key.length; i++) {
+      h1 = Math.imul(h1 ^ key.charCodeAt(i), 16777619);
+      h2 = Math.imul(h2 ^ key.charCodeAt(i), 2246822519);
+    }
+    return 'up-' + (h1 >>> 0).toString(16) + (h2 >>> 0).toString(16) + '-' + file.size;
+  }
 
-    for (let i = 0; i < total_chunks; i++) {
-      const start = i * CHUNK_SIZE;
-      const end = Math.min(start + CHUNK_SIZE, file.size);
-      const chunk = file.slice(start, end);
+  const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
 
-      const url = `/api/upload/chunk?upload_id=${upload_id}&chunk_index=${i}`;
+  // Server-side chunking works in 5MB pieces; parts are whole multiples of it.
+  const PART_UNIT = 5 * 1024 * 1024;
 
-      const response = await fetch(url, {
-        method: 'POST',
-        body: chunk,
-        headers: {
-          'Content-Type': 'application/octet-stream'
+  // Files up to this size are hashed before upload when the vault holds a file
+  // of the same size; an identical one is then stored by reference and nothing is sent.
+  const CLONE_HASH_LIMIT = 128 * 1024 * 1024;
+
+  async function cloneIfPresent(file, collection_id, path_prefix, scheduler) {
+    if (file.size === 0 || file.size > CLONE_HASH_LIMIT || !(window.crypto && crypto.subtle)) return false;
+    const candidates = await fetch(`api/assets/lookup?size=${file.size}`);
+    if (!candidates.ok) return false;
+    // Hashing holds the whole file in memory, so it takes a slot like a part upload does.
+    await scheduler.acquire();
+    let digest;
+    try {
+      digest = await sha256Hex(await file.arrayBuffer());
+    } finally {
+      scheduler.release();
+    }
+    if (!digest) return false;
+    const r = await fetch('api/assets/clone', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({digest, size: file.size, collection_id, path_prefix, filename: file.name})
+    });
+    return r.ok;
+  }
+
+  // Shared by every file of an upload batch. Bounds the parts in flight and
+  // adapts that bound, and the part size of new files, to measured throughput.
+  function createPartScheduler() {
+    return {
+      limit: 3, max: 6, active: 0, waiters: [],
+      rate: 0, bestRate: 0, windowBytes: 0, windowStart: performance.now(),
+      async acquire() {
+        while (this.active >= this.limit) await new Promise(resolve => this.waiters.push(resolve));
+        this.active++;
+      },
+      release() {
+        this.active--;
+        this.wake();
+      },
+      wake() {
+        this.waiters.splice(0).forEach(resolve => resolve());
+      },
+      // Parts of about four seconds each at the current per-connection rate (5MB to 30MB).
+      partSize() {
+        const perConnection = this.rate / Math.max(1, this.limit);
+        return PART_UNIT * Math.min(6, Math.max(1, Math.floor(perConnection * 4 / PART_UNIT)));
+      },
+      // Every few seconds: add a connection while that still raises throughput, drop one when it falls.
+      completed(bytes) {
+        this.windowBytes += bytes;
+        const elapsed = (performance.now() - this.windowStart) / 1000;
+        if (elapsed < 3) return;
+        const rate = this.windowBytes / elapsed;
+        this.rate = this.rate ? 0.5 * this.rate + 0.5 * rate : rate;
+        if (rate > this.bestRate * 1.1 && this.limit < this.max) {
+          this.limit++;
+        } else if (rate < this.bestRate * 0.7 && this.limit > 1) {
+          this.limit--;
         }
+        this.bestRate = Math.max(this.bestRate * 0.9, rate);
+        this.windowBytes = 0;
+        this.windowStart = performance.now();
+        this.wake();
+      },
+      failed() {
+        this.limit = Math.max(1, Math.floor(this.limit / 2));
+      }
+    };
+  }
+
+  // Upload file in parts; resolves to the server's ingest job id (null when the
+  // vault already held the file and it was stored by reference). Parts go
+  // up concurrently through the shared scheduler, failed parts are retried
+  // with backoff, parts the server already holds are skipped, and after a
+  // server restart the upload re-reads its session and carries on.
+  async function uploadFileInChunks(file, collection_id, path_prefix = '', on_progress, scheduler = createPartScheduler(),
+                                    expand = false) {
+    const MAX_RETRIES = 8;
+    if (!expand && await cloneIfPresent(file, collection_id, path_prefix, scheduler)) {
+      if (on_progress) on_progress(file.size);
+      return null;
+    }
+    const upload_id = await uploadIdFor(file, collection_id, path_prefix);
+
+    const openSession = async () => {
+      const session = await api('/upload/sessions', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({upload_id, filename: file.name, collection_id, path_prefix, size: file.size,
+                              chunk_size: scheduler.partSize()})
       });
+      const have = new Set();
+      for (const [a, b] of session.received) for (let i = a; i <= b; i++) have.add(i);
+      return {chunk_size: session.chunk_size, total: Math.max(1, Math.ceil(file.size / session.chunk_size)), have};
+    };
+
+    const sendPart = async (i, chunk_size) => {
+      const chunk = file.slice(i * chunk_size, Math.min((i + 1) * chunk_size, file.size));
+      for (let attempt = 0; ; attempt++) {
+        await scheduler.acquire();
+        try {
+          const body = await chunk.arrayBuffer();
+          const headers = {'Content-Type': 'application/octet-stream'};
+          const checksum = await sha256Hex(body);
+          if (checksum) headers['X-Content-SHA256'] = checksum;
+          const response = await postWithBackoff(`api/upload/chunk?upload_id=${upload_id}&chunk_index=${i}`, {body, headers});
+          if (!response.ok) {
+            const err = await response.json().catch(() => ({message: response.statusText}));
+            throw Object.assign(new Error(`Upload failed for chunk ${i} of ${file.name}: ${err.message}`),
+                                {retryable: response.status >= 500 || response.status === 422});
+          }
+          scheduler.completed(chunk.size);
+          if (on_progress) on_progress(chunk.size);
+          return;
+        } catch (e) {
+          if (!(e.retryable || e instanceof TypeError) || attempt >= 4) throw e;
+          scheduler.failed();
+        } finally {
+          scheduler.release();
+        }
+        await sleep(Math.min(30000, 500 * 2 ** attempt));
+      }
+    };
 
-      if (!response.ok) {
-        const err = await response.json().catch(() => ({message: response.statusText}));
-        throw new Error(`Upload failed for chunk ${i} of ${file.name}: ${err.message}`);
+    let failures = 0;
+    for (;;) {
+      try {
+        const {chunk_size, total, have} = await openSession();
+        if (on_progress && failures === 0) {
+          let resumed = 0;
+          for (const i of have) resumed += Math.min(chunk_size, file.size - i * chunk_size);
+          if (resumed) on_progress(resumed);
+        }
+        const queue = [];
+        for (let i = 0; i < total; i++) if (!have.has(i)) queue.push(i);
+        const runner = async () => {
+          while (queue.length) await sendPart(queue.shift(), chunk_size);
+        };
+        await Promise.all(Array.from({length: Math.min(scheduler.max, queue.length)}, runner));
+
+        // All chunks uploaded, now send complete request
+        const r = await postWithBackoff('api/upload/complete', {
+          headers: {'Content-Type': 'application/json'},
+          body: JSON.stringify({
+            upload_id: upload_id,
+            filename: file.name,
+            collection_id: collection_id,
+            path_prefix: path_prefix,
+            expand: expand
+          })
+        });
+        if (r.status === 409) throw Object.assign(new Error(`Chunks of ${file.name} went missing`), {retryable: true});
+        if (!r.ok) {
+          const err = await r.json().catch(() => ({message: r.statusText}));
+          throw new Error(`Failed to complete upload for ${file.name}: ${err.message}`);
+        }
+        return (await r.json()).job_id;
+      } catch (e) {
+        // fetch() rejects with a TypeError when the connection itself fails.
+        if (!(e.retryable || e instanceof TypeError) || ++failures > MAX_RETRIES) throw e;
+        await sleep(Math.min(30000, 1000 * 2 ** failures));
       }
-      if (on_progress) on_progress(chunk.size);
     }
+  }
 
-    // All chunks uploaded, now send complete request
-    const r = await fetch('/api/upload/complete', {
-      method: 'POST',
-      headers: {'Content-Type': 'application/json'},
-      body: JSON.stringify({
-        upload_id: upload_id,
-        filename: file.name,
-        collection_id: collection_id,
-        path_prefix: path_prefix
-      })
-    });
-    if (!r.ok) {
-      const err = await r.json().catch(() => ({message: r.statusText}));
-      throw new Error(`Failed to complete upload for ${file.name}: ${err.message}`);
+  // Small files go up many per request to /api/upload/batch, framed as
+  // [u32 header length][header JSON][content]; the Blob is assembled lazily
+  // from the File objects, so nothing is read into memory here.
+  const BATCH_FILE_LIMIT = 1024 * 1024;
+  const BATCH_MAX_FILES = 500;
+  const BATCH_MAX_BYTES = 16 * 1024 * 1024;
+  const ARCHIVE_SUFFIXES = ['.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz'];
+  const isArchive = name => ARCHIVE_SUFFIXES.some(suffix => name.toLowerCase().endsWith(suffix));
+
+  function batchSmallFiles(files) {
+    const batches = [];
+    let current = [], bytes = 0;
+    for (const f of files) {
+      if (current.length >= BATCH_MAX_FILES || bytes + f.file.size > BATCH_MAX_BYTES) {
+        batches.push(current);
+        current = [];
+        bytes = 0;
+      }
+      current.push(f);
+      bytes += f.file.size;
+    }
+    if (current.length) batches.push(current);
+    return batches;
+  }
+
+  async function uploadBatch(batch, collection_id, on_progress) {
+    const encoder = new TextEncoder();
+    const parts = [];
+    for (const {file, path} of batch) {
+      const header = encoder.encode(JSON.stringify({name: file.name, path: path, size: file.size}));
+      const length = new Uint8Array(4);
+      new DataView(length.buffer).setUint32(0, header.length);
+      parts.push(length, header, file);
+    }
+    const body = new Blob(parts);
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const r = await postWithBackoff(`api/upload/batch?collection_id=${collection_id}`, {
+          body, headers: {'Content-Type': 'application/octet-stream'}
+        });
+        if (!r.ok) {
+          const err = await r.json().catch(() => ({message: r.statusText}));
+          throw Object.assign(new Error(`Batch upload of ${batch.length} files failed: ${err.message}`), {retryable: r.status >= 500});
+        }
+        if (on_progress) on_progress(batch.reduce((acc, f) => acc + f.file.size, 0));
+        return;
+      } catch (e) {
+        // A batch commits all or nothing, so resending it is safe.
+        if (!(e.retryable || e instanceof TypeError) || attempt >= 4) throw e;
+        await sleep(Math.min(30000, 1000 * 2 ** attempt));
+      }
     }
   }
 
@@ -1203,6 +1609,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     toast('Starting upload... Please do not refresh while chunks are uploading.', 'warning');
 
+    const job_ids = [];
     try {
       let total_size = filesToUpload.reduce((acc, f) => acc + f.file.size, 0);
       let uploaded_size = 0;
@@ -1216,10 +1623,24 @@ document.addEventListener('DOMContentLoaded', () => {
         Progress.update((uploaded_size / total_size) * 100);
       };
 
+      // Files run side by side; the scheduler bounds the parts actually in flight.
       const concurrency = 8;
+      const scheduler = createPartScheduler();
+      const collection_id = state.selection.collection;
+      // Archives to expand always take the chunked path; only it can ask the server to unpack.
+      const expand = el("expand-archives").checked;
+      const chunked = f => f.file.size > BATCH_FILE_LIMIT || (expand && isArchive(f.file.name));
+      const tasks = [
+        ...batchSmallFiles(filesToUpload.filter(f => !chunked(f)))
+          .map(batch => () => uploadBatch(batch, collection_id, update_progress)),
+        ...filesToUpload.filter(chunked)
+          .map(({file, path}) => () => uploadFileInChunks(file, collection_id, path, update_progress, scheduler,
+                                                          expand && isArchive(file.name))
+            .then(job_id => { if (job_id) job_ids.push(job_id); }))
+      ];
       const promises = new Set();
-      for (const { file, path } of filesToUpload) {
-        const promise = uploadFileInChunks(file, state.selection.collection, path, update_progress);
+      for (const task of tasks) {
+        const promise = task();
         promises.add(promise);
         promise.then(() => promises.delete(promise));
         if (promises.size >= concurrency) {
@@ -1239,39 +1660,38 @@ document.addEventListener('DOMContentLoaded', () => {
     Progress.setIndeterminate(true);
     toast('Upload complete! Now processing file...', 'success');
 
-    // Poll for changes
-    let attempts = 0;
-    const maxAttempts = 60;
-    const pollInterval = 5000; // 5 seconds
-    const initialTotal = state.total; // Capture the total before polling starts
-
+    // Poll the ingest jobs until every upload has landed or failed
+    if (job_ids.length === 0) {
+      // Only batched files: they are already committed.
+      Progress.hide();
+      loadAssets(state.selection.collection, state.page);
+      return;
+    }
+    const collection_id = state.selection.collection;
+    const jobs = new Map(job_ids.map(id => [id, {total_bytes: 0, processed_bytes: 0, state: 'queued'}]));
     const poll = setInterval(async () => {
-      attempts++;
       try {
-          if (!state.selection.collection) {
-              clearInterval(poll);
-              Progress.hide();
-              return;
-          }
-          // The loadAssets call will update the view and the state.total.
-          // We check page 1 for simplicity to see if any new asset has been added.
-          const newAssets = await loadAssets(state.selection.collection, 1); 
-
-          // Compare the new total from the server with the total we had when we started.
-          if (newAssets.total > initialTotal || attempts > maxAttempts) {
-              clearInterval(poll);
-              Progress.hide();
-              // A full refresh of assets for the user's current page to ensure the view is correct,
-              // especially if they were not on page 1.
-              if (state.page !== 1) {
-                  loadAssets(state.selection.collection, state.page);
-              }
-          }
-      } catch (e) {
+        // Only unfinished jobs are re-polled, a bounded batch at a time.
+        const pending_ids = job_ids.filter(id => ['queued', 'running'].includes(jobs.get(id).state)).slice(0, 500);
+        const r = await api(`/jobs?ids=${pending_ids.join(',')}`);
+        for (const j of r.jobs) jobs.set(j.id, j);
+        const all = Array.from(jobs.values());
+        const total = all.reduce((acc, j) => acc + j.total_bytes, 0);
+        const done = all.reduce((acc, j) => acc + j.processed_bytes, 0);
+        Progress.setIndeterminate(false);
+        Progress.update(total ? (done / total) * 100 : 100);
+        if (all.every(j => j.state === 'done' || j.state === 'failed')) {
           clearInterval(poll);
           Progress.hide();
+          const failed = all.filter(j => j.state === 'failed');
+          if (failed.length) toast(`${failed.length} file(s) failed to ingest: ${failed[0].filename}: ${failed[0].error}`, 'error');
+          if (state.selection.collection === collection_id) loadAssets(collection_id, state.page);
+        }
+      } catch (e) {
+        clearInterval(poll);
+        Progress.hide();
       }
-    }, pollInterval);
+    }, 1000);
   }
 
   // Event listeners
@@ -1393,21 +1813,51 @@ document.addEventListener('DOMContentLoaded', () => {
 
 # endregion
 
+# Upload parts persist across restarts so interrupted uploads can resume;
+# UploadSessions expires what nobody resumed within UPLOAD_SESSION_TTL.
 UPLOAD_TEMP_DIR = 'upload_temp'
-if os.path.exists(UPLOAD_TEMP_DIR):
-    shutil.rmtree(UPLOAD_TEMP_DIR)
 os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+UPLOAD_SESSION_TTL = float(os.environ.get('COMPACTVAULT_UPLOAD_TTL_HOURS', '48')) * 3600.0
 
 DEFAULT_DB = "default.vault"
 
+# Size of the pieces the SPA uploads (CHUNK_SIZE in the frontend). Chunk
+# boundaries depend on how the chunker's reads are split, so local imports
+# replay the same piece layout to deduplicate against uploaded copies.
+UPLOAD_PIECE_SIZE = 5 * 1024 * 1024
+
+# /api/upload/batch limits: per request and per file within it.
+BATCH_MAX_BYTES = 64 * 1048576
+BATCH_MAX_FILE_BYTES = 4 * 1048576
+
+# Ingest threads, shared by every vault the server has open.
+INGEST_WORKERS = int(os.environ.get('COMPACTVAULT_INGEST_WORKERS', str(os.cpu_count() or 4)))
+# Unlocked vaults nobody has used for this long are closed (and reopened on the next request).
+VAULT_IDLE_SECONDS = float(os.environ.get('COMPACTVAULT_VAULT_IDLE_MINUTES', '30')) * 60.0
+# Verify-on-read: re-hash chunks as they are served. Verified hashes are
+# remembered (up to COMPACTVAULT_VERIFIED_CHUNKS of them) so hot chunks are hashed once.
+VERIFY_READS = os.environ.get('COMPACTVAULT_VERIFY_READS', '0').lower() in ('1', 'true', 'yes', 'on')
+VERIFIED_CHUNK_CACHE = int(os.environ.get('COMPACTVAULT_VERIFIED_CHUNKS', '65536'))
+# Ingest admission limits: queued jobs, and bytes uploaded but not yet ingested.
+MAX_QUEUED_INGEST_JOBS = int(os.environ.get('COMPACTVAULT_MAX_QUEUED_JOBS', '2000'))
+MAX_PENDING_INGEST_BYTES = int(os.environ.get('COMPACTVAULT_MAX_PENDING_MB', '8192')) * 1048576
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class ChainedFileWrapper(io.RawIOBase):
+    """
+    Reads upload parts as one stream. Reads stop at every UPLOAD_PIECE_SIZE
+    boundary of the logical stream and nowhere else, so chunking (which
+    depends on read boundaries) is the same whatever part size the client
+    chose, and the same as a PieceReader over the original file.
+    """
+
     def __init__(self, paths):
         self.paths = paths
         self.current_idx = 0
         self.current_f = None
+        self.pos = 0
         self._open_next()
 
     def _open_next(self):
@@ -1420,18 +1870,15 @@ class ChainedFileWrapper(io.RawIOBase):
             self.current_f = None
 
     def readinto(self, b):
-        if not self.current_f:
-            return 0
-        
-        data = self.current_f.read(len(b))
-        if not data:
-            self._open_next()
-            if not self.current_f:
-                return 0
-            return self.readinto(b)
-        
-        n = len(data)
-        b[:n] = data
+        view = memoryview(b)[:UPLOAD_PIECE_SIZE - self.pos % UPLOAD_PIECE_SIZE]
+        n = 0
+        while n < len(view) and self.current_f:
+            got = self.current_f.readinto(view[n:])
+            if not got:
+                self._open_next()
+                continue
+            n += got
+        self.pos += n
         return n
     
     def close(self):
@@ -1442,147 +1889,1508 @@ class ChainedFileWrapper(io.RawIOBase):
     def readable(self):
         return True
 
-# region CompactVaultManager
 
-def natural_sort_key(s):
+class BufferReader(io.RawIOBase):
+    """An in-memory file read the way ChainedFileWrapper reads its parts (no seeking, reads split at piece boundaries)."""
+
+    def __init__(self, data: bytes) -> None:
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        n = min(len(b), len(self.view) - self.pos, UPLOAD_PIECE_SIZE - self.pos % UPLOAD_PIECE_SIZE)
+        b[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+class EncodedFile:
+    """A small file chunked, hashed and compressed up front, outside the write lock, ready for _insert_asset."""
+
+    __slots__ = ('path_prefix', 'filename', 'size', 'records', 'crc', 'digest', 'head')
+
+    def __init__(self, path_prefix: str, filename: str, data: bytes) -> None:
+        self.path_prefix = path_prefix
+        self.filename = filename
+        self.size = len(data)
+        min_sz, max_sz, sentinel = OptimizedCDC.ingest_params(data[:1024], max(1, -(-len(data) // UPLOAD_PIECE_SIZE)))
+        encoder = ChunkEncoder(OptimizedCDC(min_size=min_sz, max_size=max_sz, sentinel=sentinel), BufferReader(data))
+        self.records = list(encoder)
+        self.crc = encoder.crc
+        self.digest = encoder.digest
+        self.head = encoder.head
+
+    def __iter__(self) -> Iterator[Tuple[str, int, bytes]]:
+        return iter(self.records)
+
+
+class PieceStream(io.RawIOBase):
     """
-    A key for natural sorting. Splits the string into text and number parts.
-    e.g. 'file10.txt' -> ['file', 10, '.txt']
+    Wraps a forward-only stream (an archive member) so it chunks exactly
+    like an upload of the same bytes: no seeking, and reads split at
+    UPLOAD_PIECE_SIZE boundaries. `prefix` holds bytes already read for
+    the ingest heuristic.
     """
-    if not isinstance(s, str):
-        return [s]
-    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'([0-9]+)', s)]
 
+    def __init__(self, raw: Any, prefix: bytes = b'') -> None:
+        self.raw = raw
+        self.prefix = memoryview(prefix)
+        self.pos = 0
 
-class CompactVaultManager:
-    def __init__(self, db_path: str = DEFAULT_DB) -> None:
-        self.db_path = pathlib.Path(db_path)
-        self.lock = threading.RLock()
-        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.conn.execute("PRAGMA foreign_keys = ON;")
-        self.conn.execute("PRAGMA journal_mode = WAL;")
-        self.conn.execute("PRAGMA synchronous = NORMAL;")
-        self.conn.execute("PRAGMA busy_timeout = 5000;")
-        self.conn.execute("PRAGMA cache_size = -64000;")
-        self.conn.execute("PRAGMA temp_store = MEMORY;")
-        self.conn.commit()
-        self.create_database_schema()
-        self._ensure_schema_extensions()
+    def readable(self) -> bool:
+        return True
 
-        # Asset creation queue and worker
-        self.asset_creation_queue: queue.Queue[Optional[Tuple[int, str, List[str], str]]] = queue.Queue()
-        num_workers = os.cpu_count() or 4
-        self.workers: List[threading.Thread] = []
-        for _ in range(num_workers):
-            t = threading.Thread(target=self._process_asset_creation_queue, daemon=True)
-            t.start()
-            self.workers.append(t)
+    def readinto(self, b: Any) -> int:
+        view = memoryview(b)[:UPLOAD_PIECE_SIZE - self.pos % UPLOAD_PIECE_SIZE]
+        n = 0
+        while n < len(view):
+            if self.prefix:
+                k = min(len(self.prefix), len(view) - n)
+                view[n:n + k] = self.prefix[:k]
+                self.prefix = self.prefix[k:]
+            else:
+                data = self.raw.read(len(view) - n)
+                if not data:
+                    break
+                k = len(data)
+                view[n:n + k] = data
+            n += k
+        self.pos += n
+        return n
 
-    def _get_read_conn(self) -> sqlite3.Connection:
-        """Creates a new, short-lived, read-only database connection."""
-        db_uri = f"file:{self.db_path}?mode=ro"
-        conn = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        return conn
 
-    def create_database_schema(self) -> None:
-        queries = [
-            'CREATE TABLE IF NOT EXISTS vault_properties (key TEXT PRIMARY KEY, value TEXT);',
-            'CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY, name TEXT NOT NULL, type TEXT NOT NULL, description TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
-            'CREATE TABLE IF NOT EXISTS collections (id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL REFERENCES projects(id), parent_id INTEGER REFERENCES collections(id), name TEXT, type TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
-            'CREATE TABLE IF NOT EXISTS assets (id INTEGER PRIMARY KEY, collection_id INTEGER REFERENCES collections(id), type TEXT NOT NULL, format TEXT, manifest TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
-            'CREATE TABLE IF NOT EXISTS metadata (id INTEGER PRIMARY KEY, asset_id INTEGER REFERENCES assets(id), key TEXT NOT NULL, value TEXT );',
-            'CREATE INDEX IF NOT EXISTS idx_metadata_asset ON metadata(asset_id);',
-            'CREATE INDEX IF NOT EXISTS idx_metadata_key ON metadata(key);',
-            'CREATE INDEX IF NOT EXISTS idx_metadata_asset_key ON metadata(asset_id, key);',
-            'CREATE INDEX IF NOT EXISTS idx_metadata_value ON metadata(value);',
-            'CREATE INDEX IF NOT EXISTS idx_collections_project ON collections(project_id);',
-            'CREATE INDEX IF NOT EXISTS idx_collections_parent ON collections(parent_id);',
-            'CREATE INDEX IF NOT EXISTS idx_assets_collection ON assets(collection_id);',
-            'CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB );'
+class SeekableParts(io.RawIOBase):
+    """Upload parts as one seekable file, for formats that need random access (zip's central directory)."""
 
-        ]
-        with self.lock:
-            for q in queries:
+    def __init__(self, paths: List[str]) -> None:
+        self.paths = paths
+        self.offsets = [0]
+        for p in paths:
+            self.offsets.append(self.offsets[-1] + os.path.getsize(p))
+        self.size = self.offsets[-1]
+        self.pos = 0
+        self.files: Dict[int, Any] = {}
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.pos, 2: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def readinto(self, b: Any) -> int:
+        if self.pos >= self.size:
+            return 0
+        index = bisect.bisect_right(self.offsets, self.pos) - 1
+        f = self.files.get(index)
+        if f is None:
+            f = self.files[index] = open(self.paths[index], 'rb')
+        f.seek(self.pos - self.offsets[index])
+        n = f.readinto(memoryview(b)[:self.offsets[index + 1] - self.pos])
+        self.pos += n
+        return n
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        super().close()
+
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def archive_root_name(filename: str) -> Optional[str]:
+    """The collection name an archive expands into, or None if the filename is not a supported archive."""
+    lower = filename.lower()
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if lower.endswith(suffix) and len(filename) > len(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def safe_member_path(name: str) -> Tuple[str, str]:
+    """Splits an archive member name into (directory prefix, filename), dropping absolute and '..' components."""
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.', '..')]
+    if not parts:
+        return '', ''
+    return '/'.join(parts[:-1]), parts[-1]
+
+
+def iter_archive_members(chunk_paths: List[str], filename: str) -> Iterator[Tuple[str, int, Any, Any]]:
+    """
+    Yields (member name, size, stream, source) for each regular file in an
+    uploaded zip or tar (optionally compressed), reading members straight
+    out of the upload parts; source.pos is how far into the archive the
+    reader is. A zip member that cannot be opened (encrypted, unsupported
+    method) comes with its exception in place of the stream. Each stream is
+    only valid until the next member is requested.
+    """
+    if filename.lower().endswith('.zip'):
+        with SeekableParts(chunk_paths) as source, zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
                 try:
-                    self.conn.execute(q)
-                except sqlite3.Error as e:
-                    logging.error(f"Schema error: {e}")
-            self.conn.commit()
+                    member = archive.open(info)
+                except (RuntimeError, NotImplementedError, zipfile.BadZipFile) as e:
+                    # Encrypted or unsupported compression: reported per member.
+                    yield info.filename, info.file_size, e, source
+                    continue
+                with member:
+                    yield info.filename, info.file_size, member, source
+    else:
+        with ChainedFileWrapper(chunk_paths) as source, tarfile.open(fileobj=source, mode='r|*') as archive:
+            for info in archive:
+                if not info.isreg():
+                    continue
+                member = archive.extractfile(info)
+                if member is not None:
+                    yield info.name, info.size, member, source
 
-    def _ensure_schema_extensions(self) -> None:
+
+def read_upload_batch(stream: Any, length: int) -> Iterator[Tuple[str, str, bytes]]:
+    """
+    Parses the /api/upload/batch framing: repeated [u32 big-endian header
+    length][header JSON {"name", "path", "size"}][size bytes of content].
+    Yields (path, name, data), with path cleaned like an archive member's;
+    raises ValueError on malformed input.
+    """
+    def read_exact(n: int) -> bytes:
+        data = stream.read(n)
+        if len(data) != n:
+            raise ValueError('Unexpected end of batch')
+        return data
+
+    remaining = length
+    while remaining > 0:
+        if remaining < 4:
+            raise ValueError('Truncated batch header')
+        header_len = int.from_bytes(read_exact(4), 'big')
+        if header_len > 65536 or header_len + 4 > remaining:
+            raise ValueError('Invalid batch header length')
+        header = json.loads(read_exact(header_len))
+        if not isinstance(header, dict):
+            raise ValueError(f'Invalid batch entry: {header}')
+        name, path, size = header.get('name'), header.get('path') or '', header.get('size')
+        if not isinstance(name, str) or not name or '/' in name or not isinstance(path, str) \
+                or not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise ValueError(f'Invalid batch entry: {header}')
+        # Same cleanup as archive members: no absolute paths or '..' collections.
+        prefix, last = safe_member_path(path)
+        path = f'{prefix}/{last}' if prefix else last
+        if size > BATCH_MAX_FILE_BYTES:
+            raise ValueError(f'{name} is larger than the {BATCH_MAX_FILE_BYTES} byte batch limit')
+        remaining -= 4 + header_len
+        if size > remaining:
+            raise ValueError(f'Truncated content for {name}')
+        yield path, name, read_exact(size)
+        remaining -= size
+
+# region Metrics
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    __slots__ = ('name', 'help', 'labelnames', 'values', 'lock')
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[Any, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels: Tuple[Any, ...] = ()) -> None:
         with self.lock:
-            c = self.conn.cursor()
-            try:
-                c.execute("PRAGMA table_info(assets)")
-                cols = [r['name'] for r in c.fetchall()]
-                if 'data' in cols: self._migrate_to_chunked_storage(c)
-                c.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = set(r[0] for r in c.fetchall())
-                if 'chunks' not in tables:
-                    c.execute('CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB );')
-                for table, col, typ in [
-                    ('projects', 'order_index', 'INTEGER'),
-                    ('assets', 'order_index', 'INTEGER'),
-                    ('collections', 'parent_id', 'INTEGER REFERENCES collections(id)')
-                ]:
-                    c.execute(f"PRAGMA table_info({table})")
-                    if col not in [r['name'] for r in c.fetchall()]:
-                        c.execute(f"ALTER TABLE {table} ADD COLUMN {col} {typ}")
-                self.conn.commit()
-            except sqlite3.Error as e:
-                logging.error(f"Extension error: {e}")
+            self.values[labels] = self.values.get(labels, 0) + amount
 
-    def set_password(self, password: str) -> None:
-        """Hashes and stores the vault password."""
+    def render(self) -> List[str]:
         with self.lock:
-            salt = os.urandom(16)
-            pw_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-            self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)", ('password_salt', salt.hex()))
-            self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)", ('password_hash', pw_hash.hex()))
-            self.conn.commit()
+            items = sorted(self.values.items(), key=lambda kv: tuple(map(str, kv[0])))
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{_format_labels(self.labelnames, k)} {v}' for k, v in items]
+        return lines
 
-    def check_password(self, password: str) -> bool:
-        """Checks if the provided password is correct."""
-        try:
-            with self._get_read_conn() as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT value FROM vault_properties WHERE key = 'password_salt'")
-                salt_row = cur.fetchone()
-                cur.execute("SELECT value FROM vault_properties WHERE key = 'password_hash'")
-                hash_row = cur.fetchone()
 
-                if not salt_row or not hash_row:
-                    # If no password is set, allow access (for initial setup)
-                    return True
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition layout."""
 
-                salt = bytes.fromhex(salt_row[0])
-                stored_hash = bytes.fromhex(hash_row[0])
-                
-                new_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-                
-                return new_hash == stored_hash
-        except (sqlite3.Error, ValueError) as e:
-            logging.error(f"Password check error: {e}")
-            return False
+    __slots__ = ('name', 'help', 'labelnames', 'buckets', 'series', 'lock')
 
-    def _migrate_to_chunked_storage(self, cursor: sqlite3.Cursor) -> None:
+    LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self.series: Dict[Tuple[Any, ...], List[Any]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple[Any, ...] = ()) -> None:
+        i = bisect.bisect_left(self.buckets, value)
         with self.lock:
-            try:
-                c = cursor
-                c.execute("CREATE TABLE assets_new (id INTEGER PRIMARY KEY, collection_id INTEGER REFERENCES collections(id), type TEXT NOT NULL, format TEXT, manifest TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB)")
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
 
-                # Add columns if they don't exist
-                c.execute("PRAGMA table_info(assets_new)")
-                cols = [r['name'] for r in c.fetchall()]
-                if 'order_index' not in cols:
-                    c.execute("ALTER TABLE assets_new ADD COLUMN order_index INTEGER")
+    def render(self) -> List[str]:
+        with self.lock:
+            items = sorted(((k, list(v[0]), v[1]) for k, v in self.series.items()), key=lambda kv: tuple(map(str, kv[0])))
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        for labels, counts, total in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + (le,))} {running}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {running}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics. Hot paths only touch a counter or histogram once
+    per request, asset or lock acquisition; per-vault state such as queue
+    depth or WAL size is sampled when /metrics is scraped.
+    """
 
-                for asset in c.execute("SELECT * FROM assets").fetchall():
-                    data = zlib.decompress(asset['data']) if asset.get('compression') == 'zlib' else asset['data']
-                    
+    def __init__(self) -> None:
+        self.metrics: List[Any] = []
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), **kwargs: Any) -> Histogram:
+        metric = Histogram(name, help, labelnames, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, gauges: List[Tuple[str, str, str, List[Tuple[Tuple[Tuple[str, Any], ...], float]]]] = ()) -> str:
+        """Renders registered metrics plus scrape-time samples given as (name, type, help, [(labels, value)])."""
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for name, kind, help, samples in gauges:
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(tuple(k for k, _ in labels), tuple(v for _, v in labels))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+HTTP_REQUEST_SECONDS = METRICS.histogram(
+    'compactvault_http_request_duration_seconds', 'Time from routing to the end of the response body.', ('method', 'route', 'status'))
+HTTP_RESPONSE_BYTES = METRICS.counter(
+    'compactvault_http_response_bytes_total', 'Bytes written to clients, headers included.', ('method', 'route'))
+INGEST_ASSETS = METRICS.counter('compactvault_ingest_assets_total', 'Assets committed by the ingest workers.')
+INGEST_CHUNKS = METRICS.counter('compactvault_ingest_chunks_total', 'Content-defined chunks processed at ingest.')
+INGEST_BYTES = METRICS.counter('compactvault_ingest_bytes_total', 'Logical bytes ingested.')
+INGEST_STORED_BYTES = METRICS.counter('compactvault_ingest_stored_bytes_total', 'Compressed bytes of newly stored chunks.')
+INGEST_CLONED = METRICS.counter(
+    'compactvault_ingest_cloned_assets_total', 'Assets stored by cloning the manifest of an identical existing file.')
+INGEST_BUSY_SECONDS = METRICS.counter(
+    'compactvault_ingest_worker_busy_seconds_total', 'Time ingest workers spent processing assets; divide its rate by the worker count for utilization.')
+INGEST_REFUSED = METRICS.counter(
+    'compactvault_ingest_refused_total', 'Upload requests refused by ingest admission control.', ('status',))
+INGEST_JOBS_FINISHED = METRICS.counter('compactvault_ingest_jobs_total', 'Ingest jobs finished, by outcome.', ('state',))
+CHUNK_VERIFY = METRICS.counter(
+    'compactvault_chunk_verify_total', 'Chunk reads checked by verify-on-read: hashed, or skipped as already verified (cached).', ('outcome',))
+CHUNK_READ_ERRORS = METRICS.counter(
+    'compactvault_chunk_read_errors_total', 'Chunk reads that failed: missing, corrupt (undecodable), size or hash mismatch.', ('reason',))
+WRITE_LOCK_WAIT = METRICS.histogram(
+    'compactvault_write_lock_wait_seconds', 'Time spent waiting to acquire the manager write lock.',
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+
+
+class TimedLock:
+    """Re-entrant lock that records how long each outermost acquisition waited."""
+
+    __slots__ = ('_lock', '_owner', '_depth')
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._owner: Optional[int] = None
+        self._depth = 0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        me = threading.get_ident()
+        if self._owner == me:
+            self._depth += 1
+            return True
+        started = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        WRITE_LOCK_WAIT.observe(time.perf_counter() - started)
+        self._owner = me
+        self._depth = 1
+        return True
+
+    def release(self) -> None:
+        if self._owner != threading.get_ident():
+            raise RuntimeError("cannot release un-acquired lock")
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            self._lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+class CountingWriter:
+    """Wraps a handler's wfile and counts bytes written for the current request."""
+
+    __slots__ = ('raw', 'written')
+
+    def __init__(self, raw: Any) -> None:
+        self.raw = raw
+        self.written = 0
+
+    def write(self, data: Any) -> int:
+        self.written += len(data)
+        with trace_span('wfile.write'):
+            return self.raw.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+# endregion
+
+# region Tracing
+
+SLOW_REQUEST_SECONDS = float(os.environ.get('COMPACTVAULT_SLOW_REQUEST_MS', '1000')) / 1000.0
+TRACE_RETAIN = 64
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed phase of a request. Spans nest; each phase is credited with its self time."""
+
+    __slots__ = ('trace', 'name', 'start', 'child_time')
+
+    def __init__(self, trace: 'RequestTrace', name: str) -> None:
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> 'Span':
+        self.child_time = 0.0
+        self.trace.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        elapsed = time.perf_counter() - self.start
+        trace = self.trace
+        trace.stack.pop()
+        if trace.stack:
+            trace.stack[-1].child_time += elapsed
+        phase = trace.phases.get(self.name)
+        if phase is None:
+            phase = trace.phases[self.name] = [0.0, 0]
+        phase[0] += elapsed - self.child_time
+        phase[1] += 1
+        if len(trace.spans) < RequestTrace.MAX_SPANS:
+            trace.spans.append((self.name, self.start, elapsed, len(trace.stack)))
+        else:
+            trace.dropped += 1
+
+
+class RequestTrace:
+    """Spans and per-phase totals of one request, recorded on the handling thread."""
+
+    MAX_SPANS = 4096
+
+    __slots__ = ('id', 'method', 'path', 'status', 'tid', 'wall_start', 'start', 'duration',
+                 'phases', 'spans', 'stack', 'dropped')
+
+    def __init__(self, trace_id: int, method: str, path: str) -> None:
+        self.id = trace_id
+        self.method = method
+        self.path = path
+        self.status = 0
+        self.tid = threading.get_ident()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.phases: Dict[str, List[Any]] = {}
+        self.spans: List[Tuple[str, float, float, int]] = []
+        self.stack: List[Span] = []
+        self.dropped = 0
+
+    def breakdown(self) -> List[Tuple[str, float, int]]:
+        """(phase, self seconds, span count), largest first."""
+        return sorted(((name, t, n) for name, (t, n) in self.phases.items()), key=lambda p: -p[1])
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'id': self.id, 'method': self.method, 'path': self.path, 'status': self.status,
+            'started': self.wall_start, 'duration_ms': round(self.duration * 1000, 3),
+            'phases': [{'phase': name, 'ms': round(t * 1000, 3), 'spans': n} for name, t, n in self.breakdown()],
+            'spans_dropped': self.dropped,
+        }
+
+    def chrome_events(self) -> List[Dict[str, Any]]:
+        """Complete ('X') events in the Chrome trace format, one process per request."""
+        base = self.wall_start * 1e6
+        events: List[Dict[str, Any]] = [{
+            'name': 'process_name', 'ph': 'M', 'pid': self.id, 'tid': self.tid,
+            'args': {'name': f'{self.method} {self.path} -> {self.status}'},
+        }]
+        for name, start, elapsed, depth in self.spans:
+            events.append({
+                'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': self.id, 'tid': self.tid,
+                'ts': round(base + (start - self.start) * 1e6, 3), 'dur': round(elapsed * 1e6, 3),
+                'args': {'depth': depth},
+            })
+        return events
+
+
+class Tracer:
+    """
+    Traces every routed request on its handling thread. Requests slower than
+    the threshold are logged with a per-phase breakdown and retained, along
+    with any request that asked for a trace, for Chrome trace export.
+    """
+
+    def __init__(self, slow_seconds: float = SLOW_REQUEST_SECONDS, retain: int = TRACE_RETAIN) -> None:
+        self.slow_seconds = slow_seconds
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.retained: deque = deque(maxlen=retain)
+
+    def current(self) -> Optional[RequestTrace]:
+        return getattr(self.local, 'trace', None)
+
+    def begin(self, method: str, path: str) -> RequestTrace:
+        with self.lock:
+            trace_id = self.next_id
+            self.next_id += 1
+        trace = RequestTrace(trace_id, method, path)
+        self.local.trace = trace
+        return trace
+
+    def end(self, trace: RequestTrace, status: int, keep: bool = False) -> None:
+        self.local.trace = None
+        trace.duration = time.perf_counter() - trace.start
+        trace.status = status
+        slow = trace.duration >= self.slow_seconds
+        if slow:
+            phases = ', '.join(f'{name} {t * 1000:.1f}ms/{n}' for name, t, n in trace.breakdown())
+            logging.warning(f"Slow request {trace.method} {trace.path} -> {status} took {trace.duration * 1000:.1f}ms: {phases}")
+        if slow or keep:
+            with self.lock:
+                self.retained.append(trace)
+
+    def traces(self) -> List[RequestTrace]:
+        with self.lock:
+            return list(self.retained)
+
+    def get(self, trace_id: int) -> Optional[RequestTrace]:
+        with self.lock:
+            return next((t for t in self.retained if t.id == trace_id), None)
+
+
+TRACER = Tracer()
+
+
+def trace_span(name: str) -> Any:
+    """Context manager timing a phase of the current request; free when nothing is being traced."""
+    trace = getattr(TRACER.local, 'trace', None)
+    return NULL_SPAN if trace is None else Span(trace, name)
+
+# endregion
+
+# region CompactVaultManager
+
+def natural_sort_key(s):
+    """
+    A key for natural sorting. Splits the string into text and number parts.
+    e.g. 'file10.txt' -> ['file', 10, '.txt']
+    """
+    if not isinstance(s, str):
+        return [s]
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'([0-9]+)', s)]
+
+
+class CachedResponse:
+    """A serialized JSON body plus its lazily built gzip encoding."""
+
+    __slots__ = ('data', '_gzipped')
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self._gzipped: Optional[bytes] = None
+
+    @property
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.data, compresslevel=6)
+        return self._gzipped
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + (len(self._gzipped) if self._gzipped else 0)
+
+
+class ResponseCache:
+    """
+    Bounded LRU of already-serialized responses.
+    Keys embed the vault write generation, so stale entries are never hit;
+    they simply age out once newer generations push them past the bounds.
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[Tuple[Any, ...], CachedResponse]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[CachedResponse]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple[Any, ...], entry: CachedResponse) -> None:
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        # Sizes can grow after insertion when the gzip body is built, so
+        # the byte total is recomputed rather than tracked incrementally.
+        total = sum(e.nbytes for e in self.entries.values())
+        while self.entries and (len(self.entries) > self.max_entries or total > self.max_bytes):
+            _, old = self.entries.popitem(last=False)
+            total -= old.nbytes
+
+
+class IngestJob:
+    """One queued upload. Progress lives in memory; state changes are persisted to ingest_jobs."""
+
+    __slots__ = ('id', 'collection_id', 'filename', 'state', 'total_bytes', 'processed_bytes',
+                 'asset_id', 'assets', 'error', 'created_at', 'started_at', 'finished_at', 'upload_id', 'expand')
+
+    def __init__(self, job_id: int, collection_id: int, filename: str, total_bytes: int, created_at: float,
+                 upload_id: Optional[str] = None, expand: bool = False) -> None:
+        self.id = job_id
+        self.upload_id = upload_id
+        self.expand = expand
+        self.assets = 0
+        self.collection_id = collection_id
+        self.filename = filename
+        self.state = 'queued'
+        self.total_bytes = total_bytes
+        self.processed_bytes = 0
+        self.asset_id: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = created_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def add_bytes(self, n: int) -> None:
+        self.processed_bytes += n
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            'id': self.id, 'collection_id': self.collection_id, 'filename': self.filename, 'state': self.state,
+            'total_bytes': self.total_bytes, 'processed_bytes': self.processed_bytes, 'asset_id': self.asset_id,
+            'assets': self.assets, 'error': self.error, 'created_at': self.created_at, 'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'mb_per_s': round(self.processed_bytes / elapsed / 1048576, 2) if elapsed > 0 else None,
+        }
+
+
+class IngestJobs:
+    """
+    Tracks uploads from /api/upload/complete to a committed asset (or an
+    error), and applies admission control: once too many jobs are queued,
+    or the bytes waiting in upload_temp exceed the budget, new work is
+    refused with a Retry-After estimated from recent ingest throughput.
+    Waiting bytes are those of queued and running jobs (pending_bytes) plus
+    parts received for uploads not yet completed (UploadSessions.part_bytes).
+    """
+
+    COLUMNS = ('id', 'collection_id', 'filename', 'state', 'total_bytes', 'processed_bytes',
+               'asset_id', 'assets', 'error', 'created_at', 'started_at', 'finished_at')
+    RETAIN_FINISHED = 10000
+
+    def __init__(self, manager: 'CompactVaultManager') -> None:
+        self.manager = manager
+        self.lock = threading.Lock()
+        self.active: Dict[int, IngestJob] = {}
+        self.pending_bytes = 0
+        self.max_queued = MAX_QUEUED_INGEST_JOBS
+        self.max_pending_bytes = MAX_PENDING_INGEST_BYTES
+        # Exponentially weighted ingest rate in bytes/s, for Retry-After.
+        self.rate = 0.0
+        with manager.lock:
+            # A restart interrupts every unfinished job. Their parts stay on disk and UploadSessions
+            # reopens the sessions, so the client can complete them again as new jobs.
+            manager.conn.execute("UPDATE ingest_jobs SET state = 'failed', error = 'interrupted by server restart', finished_at = ? "
+                                 "WHERE state IN ('queued', 'running')", (time.time(),))
+            manager.conn.execute("DELETE FROM ingest_jobs WHERE id <= (SELECT MAX(id) FROM ingest_jobs) - ?", (self.RETAIN_FINISHED,))
+            manager.conn.commit()
+
+    def backlog_bytes(self) -> int:
+        """Bytes in upload_temp that still have to be ingested."""
+        return self.pending_bytes + self.manager.uploads.part_bytes
+
+    def admit(self, incoming_bytes: int = 0, new_job: bool = True) -> Optional[Tuple[int, int, str]]:
+        """Returns None if the work is accepted, else (status, retry_after_seconds, message)."""
+        with self.lock:
+            queued = sum(1 for j in self.active.values() if j.state == 'queued')
+            pending = self.backlog_bytes()
+            rate = self.rate
+        if pending + incoming_bytes > self.max_pending_bytes:
+            retry = pending / rate if rate else 30
+            return 503, max(1, min(300, int(retry) + 1)), 'Ingest backlog is full; retry later'
+        if new_job and queued >= self.max_queued:
+            # The shared pool's workers drain the queue roughly one job per worker at a time.
+            return 429, max(1, min(60, queued // self.manager.ingest_pool.size)), 'Too many queued ingest jobs; retry later'
+        return None
+
+    def create(self, collection_id: int, filename: str, total_bytes: int, upload_id: Optional[str] = None,
+               expand: bool = False) -> IngestJob:
+        now = time.time()
+        with self.manager.lock:
+            cur = self.manager.conn.execute(
+                "INSERT INTO ingest_jobs (collection_id, filename, state, total_bytes, processed_bytes, created_at) VALUES (?, ?, 'queued', ?, 0, ?)",
+                (collection_id, filename, total_bytes, now))
+            self.manager.conn.commit()
+        job = IngestJob(cur.lastrowid, collection_id, filename, total_bytes, now, upload_id, expand)
+        with self.lock:
+            self.active[job.id] = job
+            self.pending_bytes += total_bytes
+        return job
+
+    def started(self, job: IngestJob) -> None:
+        job.state = 'running'
+        job.started_at = time.time()
+
+    def finished(self, job: IngestJob, asset_id: Optional[int] = None, error: Optional[str] = None,
+                 assets: Optional[int] = None) -> None:
+        """An archive job that stored some members is done, with the members that failed listed in error."""
+        job.finished_at = time.time()
+        job.asset_id = asset_id
+        job.assets = assets if assets is not None else int(asset_id is not None)
+        job.error = error
+        job.state = 'failed' if error and not job.assets else 'done'
+        INGEST_JOBS_FINISHED.inc(labels=(job.state,))
+        try:
+            with self.manager.lock:
+                self.manager.conn.execute(
+                    "UPDATE ingest_jobs SET state = ?, processed_bytes = ?, asset_id = ?, assets = ?, error = ?, started_at = ?, finished_at = ? WHERE id = ?",
+                    (job.state, job.processed_bytes, asset_id, job.assets, error, job.started_at, job.finished_at, job.id))
+                self.manager.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to record ingest job {job.id}: {e}")
+        with self.lock:
+            self.active.pop(job.id, None)
+            self.pending_bytes -= job.total_bytes
+            elapsed = job.finished_at - (job.started_at or job.finished_at)
+            if job.state == 'done' and elapsed > 0:
+                sample = job.processed_bytes / elapsed
+                self.rate = sample if not self.rate else 0.8 * self.rate + 0.2 * sample
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            job = self.active.get(job_id)
+        if job:
+            return job.to_dict()
+        jobs = self.list(ids=[job_id])
+        return jobs[0] if jobs else None
+
+    def list(self, state: Optional[str] = None, ids: Optional[List[int]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recent jobs first; live progress for unfinished ones comes from memory."""
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM ingest_jobs"
+        clauses, params = [], []
+        if state:
+            clauses.append("state = ?")
+            params.append(state)
+        if ids:
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        try:
+            with self.manager._get_read_conn() as conn:
+                rows = conn.execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Error listing ingest jobs: {e}")
+            return []
+        with self.lock:
+            live = dict(self.active)
+        jobs = []
+        for row in rows:
+            job = live.get(row['id'])
+            if job and (not state or job.state == state):
+                jobs.append(job.to_dict())
+            else:
+                d = dict(row)
+                elapsed = (d['finished_at'] - d['started_at']) if d['finished_at'] and d['started_at'] else 0.0
+                d['mb_per_s'] = round(d['processed_bytes'] / elapsed / 1048576, 2) if elapsed > 0 else None
+                jobs.append(d)
+        return jobs
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            queued = sum(1 for j in self.active.values() if j.state == 'queued')
+            return {'queued': queued, 'running': len(self.active) - queued, 'pending_bytes': self.backlog_bytes(),
+                    'max_queued': self.max_queued, 'max_pending_bytes': self.max_pending_bytes,
+                    'ingest_mb_per_s': round(self.rate / 1048576, 2)}
+
+
+class UploadSessions:
+    """
+    Resumable upload bookkeeping. upload_sessions holds what the client
+    declared (file, target, size, part size). The parts themselves land in
+    UPLOAD_TEMP_DIR/<vault name>/<upload_id>/<index> next to an <index>.sha256
+    sidecar and are renamed into place once complete, so the directory is the record of
+    what was received. Part uploads therefore never wait on the vault write
+    lock, which an ingest holds for the length of a file. A client can ask
+    which parts the server holds and send only the rest, across reconnects
+    and server restarts. Sessions idle for longer than UPLOAD_SESSION_TTL
+    are expired together with their temp data. part_bytes counts the parts
+    on disk until a completion hands them to an ingest job, for admission
+    control.
+    """
+
+    ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+    SWEEP_INTERVAL = 3600.0
+
+    def __init__(self, manager: 'CompactVaultManager') -> None:
+        self.manager = manager
+        # Per vault, since clients derive upload ids from the target location and vaults share a server.
+        self.root = os.path.join(UPLOAD_TEMP_DIR, manager.db_path.name)
+        self.ttl = UPLOAD_SESSION_TTL
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.bytes_lock = threading.Lock()
+        with manager.lock:
+            # An ingest interrupted by a restart left its parts on disk; let the client complete again.
+            manager.conn.execute("UPDATE upload_sessions SET state = 'open', job_id = NULL WHERE state = 'ingesting'")
+            manager.conn.commit()
+        # After a restart no job holds any parts, so every part on disk counts.
+        try:
+            self.part_bytes = sum(sum(size for _, size, _ in self.parts(e.name)) for e in os.scandir(self.root) if e.is_dir())
+        except OSError:
+            self.part_bytes = 0
+
+    def _count(self, delta: int) -> None:
+        with self.bytes_lock:
+            self.part_bytes = max(0, self.part_bytes + delta)
+
+    def store_part(self, upload_id: str, index: int, partial_path: str) -> None:
+        """Renames a fully received part into place, replacing any earlier copy."""
+        path = os.path.join(self.dir(upload_id), str(index))
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        size = os.path.getsize(partial_path)
+        os.replace(partial_path, path)
+        self._count(size - replaced)
+
+    @classmethod
+    def valid_id(cls, upload_id: Optional[str]) -> bool:
+        return bool(upload_id) and bool(cls.ID_PATTERN.match(upload_id)) and upload_id not in ('.', '..')
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name='upload-expiry', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.expire()
+            except Exception as e:
+                logging.error(f"Upload session expiry failed: {e}")
+            if self.stop_event.wait(self.SWEEP_INTERVAL):
+                return
+
+    def open(self, upload_id: str, filename: Optional[str], collection_id: Optional[int], path_prefix: str,
+             size: Optional[int], chunk_size: Optional[int]) -> Dict[str, Any]:
+        """Creates the session, or returns the existing one so the client can resume it."""
+        now = time.time()
+        with self.manager.lock:
+            row = self.manager.conn.execute("SELECT size, chunk_size FROM upload_sessions WHERE upload_id = ?", (upload_id,)).fetchone()
+            if row and row['size'] is not None and size is not None and row['size'] != size:
+                # Same id, different file: the parts on disk are useless.
+                self._discard(upload_id)
+                row = None
+            if row and row['chunk_size'] and chunk_size != row['chunk_size'] and self.parts(upload_id):
+                # Parts already received fix the layout; the client adopts the session's part size.
+                chunk_size = row['chunk_size']
+            if row is None:
+                self.manager.conn.execute(
+                    "INSERT OR REPLACE INTO upload_sessions (upload_id, filename, collection_id, path_prefix, size, chunk_size, state, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'open', ?, ?)",
+                    (upload_id, filename, collection_id, path_prefix, size, chunk_size, now, now))
+            else:
+                self.manager.conn.execute(
+                    "UPDATE upload_sessions SET filename = COALESCE(?, filename), collection_id = COALESCE(?, collection_id), "
+                    "path_prefix = ?, size = COALESCE(?, size), chunk_size = COALESCE(?, chunk_size), updated_at = ? WHERE upload_id = ?",
+                    (filename, collection_id, path_prefix, size, chunk_size, now, upload_id))
+            self.manager.conn.commit()
+        return self.status(upload_id)
+
+    def dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, upload_id)
+
+    def parts(self, upload_id: str) -> List[Tuple[int, int, float]]:
+        """(index, size, mtime) of every complete part on disk, in index order."""
+        try:
+            entries = [e for e in os.scandir(self.dir(upload_id)) if e.name.isdigit()]
+        except OSError:
+            return []
+        parts = []
+        for e in entries:
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            parts.append((int(e.name), st.st_size, st.st_mtime))
+        return sorted(parts)
+
+    def status(self, upload_id: str, with_parts: bool = False) -> Optional[Dict[str, Any]]:
+        """Session details plus the received parts as inclusive index ranges (and byte ranges when the layout is known)."""
+        with self.manager._get_read_conn() as conn:
+            session = conn.execute("SELECT * FROM upload_sessions WHERE upload_id = ?", (upload_id,)).fetchone()
+        if session is None:
+            return None
+        parts = self.parts(upload_id)
+        ranges: List[List[int]] = []
+        for index, _, _ in parts:
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        result = dict(session)
+        chunk_size = session['chunk_size']
+        if chunk_size and session['size'] is not None:
+            result['total_chunks'] = -(-session['size'] // chunk_size) if session['size'] else 1
+            result['byte_ranges'] = [[a * chunk_size, min(session['size'], (b + 1) * chunk_size)] for a, b in ranges]
+        result['received'] = ranges
+        result['received_bytes'] = sum(size for _, size, _ in parts)
+        result['updated_at'] = max([session['updated_at']] + [mtime for _, _, mtime in parts])
+        result['expires_at'] = result['updated_at'] + self.ttl
+        if with_parts:
+            result['parts'] = [{'chunk_index': index, 'size': size, 'sha256': self._read_checksum(upload_id, index)}
+                               for index, size, _ in parts]
+        return result
+
+    def _read_checksum(self, upload_id: str, index: int) -> Optional[str]:
+        try:
+            with open(os.path.join(self.dir(upload_id), f'{index}.sha256')) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def missing_parts(self, upload_id: str, chunk_files: List[str]) -> Optional[List[int]]:
+        """Indices still needed before completion, or None when the session does not declare its layout."""
+        status = self.status(upload_id)
+        if not status or 'total_chunks' not in status:
+            return None
+        have = {int(f) for f in chunk_files}
+        return [i for i in range(status['total_chunks']) if i not in have]
+
+    def mark_ingesting(self, upload_id: str, job_id: int, total_bytes: int) -> None:
+        """Hands the parts to an ingest job, whose pending bytes count them from now on."""
+        with self.manager.lock:
+            self.manager.conn.execute("UPDATE upload_sessions SET state = 'ingesting', job_id = ?, updated_at = ? WHERE upload_id = ?",
+                                      (job_id, time.time(), upload_id))
+            self.manager.conn.commit()
+        self._count(-total_bytes)
+
+    def finished(self, upload_id: str) -> None:
+        """The ingest consumed (and removed) the parts, whatever its outcome."""
+        with self.manager.lock:
+            self._discard(upload_id, counted=False)
+            self.manager.conn.commit()
+
+    def _discard(self, upload_id: str, counted: bool = True) -> None:
+        """Drops a session and its parts; counted says whether they are still in part_bytes."""
+        if counted:
+            self._count(-sum(size for _, size, _ in self.parts(upload_id)))
+        self.manager.conn.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,))
+        shutil.rmtree(self.dir(upload_id), ignore_errors=True)
+
+    def expire(self) -> int:
+        """Drops idle sessions, and temp directories no session has touched within the TTL."""
+        cutoff = time.time() - self.ttl
+        with self.manager.lock:
+            stale = [r[0] for r in self.manager.conn.execute(
+                "SELECT upload_id FROM upload_sessions WHERE state = 'open' AND updated_at < ?", (cutoff,))]
+            # Parts arriving keep a session alive.
+            stale = [u for u in stale if all(mtime < cutoff for _, _, mtime in self.parts(u))]
+            for upload_id in stale:
+                self._discard(upload_id)
+            self.manager.conn.commit()
+            live = {r[0] for r in self.manager.conn.execute("SELECT upload_id FROM upload_sessions")}
+        # Directories of the old protocol have no session here; age alone decides. So
+        # does it for ones from before parts were kept per vault, directly under UPLOAD_TEMP_DIR.
+        removed = len(stale)
+        entries = []
+        for root, legacy in ((self.root, False), (UPLOAD_TEMP_DIR, True)):
+            try:
+                entries += [e for e in os.scandir(root) if not legacy or not e.name.endswith('.vault')]
+            except OSError:
+                pass
+        for entry in entries:
+            if entry.name in live or not entry.is_dir():
+                continue
+            try:
+                newest = max([entry.stat().st_mtime] + [f.stat().st_mtime for f in os.scandir(entry.path)])
+            except OSError:
+                continue
+            if newest < cutoff:
+                if entry.path == self.dir(entry.name):
+                    self._count(-sum(size for _, size, _ in self.parts(entry.name)))
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logging.info(f"Expired {removed} stale upload sessions")
+        return removed
+
+
+class IngestStats:
+    """Per-asset ingest counters, folded into vault_stats inside the ingest transaction."""
+
+    __slots__ = ('logical_bytes', 'chunk_refs', 'new_chunks', 'new_chunk_bytes', 'stored_bytes',
+                 'reused_chunks', 'reused_bytes', 'cloned_assets', 'cloned_bytes', 'size_buckets')
+
+    def __init__(self) -> None:
+        self.cloned_assets = 0
+        self.cloned_bytes = 0
+        self.logical_bytes = 0
+        self.chunk_refs = 0
+        self.new_chunks = 0
+        self.new_chunk_bytes = 0
+        self.stored_bytes = 0
+        self.reused_chunks = 0
+        self.reused_bytes = 0
+        self.size_buckets: Dict[int, List[int]] = defaultdict(lambda: [0, 0])
+
+    def add_chunk(self, raw_size: int, stored_size: int, is_new: bool) -> None:
+        self.logical_bytes += raw_size
+        self.chunk_refs += 1
+        if is_new:
+            self.new_chunks += 1
+            self.new_chunk_bytes += raw_size
+            self.stored_bytes += stored_size
+            # Power-of-two buckets of unique chunk sizes.
+            bucket = self.size_buckets[raw_size.bit_length()]
+            bucket[0] += 1
+            bucket[1] += raw_size
+        else:
+            self.reused_chunks += 1
+            self.reused_bytes += raw_size
+
+    def add_clone(self, manifest: Dict[str, Any]) -> None:
+        """Counts an asset whose manifest was copied from an identical file: every chunk is reused."""
+        for block in manifest['chain']:
+            self.add_chunk(block['size'], 0, False)
+        self.cloned_assets += 1
+        self.cloned_bytes += manifest.get('total_size', 0)
+
+
+class ReadGate:
+    """
+    Counts live read connections and can briefly hold new ones back, so
+    maintenance that replaces the database file can wait for readers to drain.
+    """
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.active = 0
+        self.opened_total = 0
+        self.closed = False
+
+    def acquire(self) -> None:
+        with self.cond:
+            while self.closed:
+                self.cond.wait()
+            self.active += 1
+            self.opened_total += 1
+
+    def release(self) -> None:
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Waits for a moment with no active readers and closes the gate then;
+        False on timeout. New readers are let in while it waits, so the gate
+        is only ever closed for as long as the caller holds it.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.active == 0, timeout):
+                return False
+            self.closed = True
+            return True
+
+    def reopen(self) -> None:
+        with self.cond:
+            self.closed = False
+            self.cond.notify_all()
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor whose statement execution and fetches are timed as 'sqlite' spans."""
+
+    def execute(self, *args: Any) -> 'TracedCursor':
+        with trace_span('sqlite'):
+            return super().execute(*args)
+
+    def fetchone(self) -> Any:
+        with trace_span('sqlite'):
+            return super().fetchone()
+
+    def fetchall(self) -> List[Any]:
+        with trace_span('sqlite'):
+            return super().fetchall()
+
+
+class TrackedReadConnection(sqlite3.Connection):
+    """Read connection that reports its lifetime to a ReadGate."""
+
+    gate: Optional[ReadGate] = None
+
+    def execute(self, *args: Any) -> sqlite3.Cursor:
+        if TRACER.current() is None:
+            return super().execute(*args)
+        return self.cursor(TracedCursor).execute(*args)
+
+    def close(self) -> None:
+        gate, self.gate = self.gate, None
+        try:
+            super().close()
+        finally:
+            if gate is not None:
+                gate.release()
+
+    def __exit__(self, *exc: Any) -> Any:
+        # Read connections are short-lived: leaving the `with` block closes them.
+        # Otherwise they linger until a GC pass, since sqlite3 connections sit
+        # in a reference cycle with their statement cache.
+        try:
+            return super().__exit__(*exc)
+        finally:
+            self.close()
+
+    def __del__(self) -> None:
+        if self.gate is not None:
+            self.close()
+
+
+class ChunkIntegrityError(IOError):
+    """A chunk a read needs is missing, undecodable, the wrong size or (with verify-on-read) does not match its hash."""
+
+
+class VerifiedChunks:
+    """
+    Bounded LRU of chunk hashes whose stored content has been re-hashed and
+    matched since the vault was opened. Chunks are immutable and keyed by
+    content, so a hit means the bytes were already proven once.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(0, capacity)
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, None]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, chunk_hash: str) -> bool:
+        with self.lock:
+            if chunk_hash in self.entries:
+                self.entries.move_to_end(chunk_hash)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, chunk_hash: str) -> None:
+        with self.lock:
+            self.entries[chunk_hash] = None
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def discard(self, chunk_hash: str) -> None:
+        with self.lock:
+            self.entries.pop(chunk_hash, None)
+
+    def resize(self, capacity: int) -> None:
+        with self.lock:
+            self.capacity = max(0, capacity)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': round(self.hits / lookups, 4) if lookups else None}
+
+
+class IngestPool:
+    """
+    Ingest worker threads shared by every open vault, so hosting more vaults
+    does not multiply threads. Tasks are (manager, task) pairs, run in
+    arrival order; each manager counts its own share so it can drain on close.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = max(1, size)
+        self.queue: 'queue.Queue[Tuple[CompactVaultManager, Tuple[IngestJob, int, str, List[str], str]]]' = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+
+    def submit(self, manager: 'CompactVaultManager', task: Tuple[IngestJob, int, str, List[str], str]) -> None:
+        with self.lock:
+            # Started on first use, so CLI tools that never ingest through the queue spawn nothing.
+            while len(self.threads) < self.size:
+                t = threading.Thread(target=self._run, name=f'ingest-{len(self.threads)}', daemon=True)
+                t.start()
+                self.threads.append(t)
+        self.queue.put((manager, task))
+
+    def _run(self) -> None:
+        while True:
+            manager, task = self.queue.get()
+            manager._process_ingest_task(task)
+
+
+INGEST_POOL = IngestPool(INGEST_WORKERS)
+
+
+class CompactVaultManager:
+    def __init__(self, db_path: str = DEFAULT_DB, ingest_pool: Optional[IngestPool] = None, background: bool = True) -> None:
+        # background=False opens the vault for a single writer such as a
+        # replication target: no scrub, reclaim, checkpoint, upload expiry
+        # or backfill threads are started.
+        self.db_path = pathlib.Path(db_path)
+        self.lock = TimedLock()
+        self.read_gate = ReadGate()
+        self.conn = self._open_write_conn()
+        self.create_database_schema()
+        self._ensure_schema_extensions()
+
+        # Write generations: bumped after every committed write so cached
+        # listings keyed on them are invalidated without explicit purges.
+        self.generation_lock = threading.Lock()
+        self.write_generation = 0
+        self.collection_generations: Dict[int, int] = defaultdict(int)
+        self.response_cache = ResponseCache()
+        self.active_exports: Dict[int, 'ExportPipeline'] = {}
+        self.replication_lock = threading.Lock()
+        self.replication: Optional['VaultReplicator'] = None
+        self.zip_layouts_lock = threading.Lock()
+        self.zip_layouts: 'OrderedDict[Tuple[str, int, int], ZipLayout]' = OrderedDict()
+        self.verify_reads = VERIFY_READS
+        self.verified_chunks = VerifiedChunks(VERIFIED_CHUNK_CACHE)
+
+        # Vaults that predate ingest statistics get a one-time background backfill.
+        # Every backfill checks backfill_stop between steps; close() sets it and joins them.
+        self.backfill_stop = threading.Event()
+        self.backfill_threads: List[threading.Thread] = []
+        self.backfills: Dict[str, Dict[str, Any]] = {'stats': {'state': 'done'}, 'previews': {'state': 'done'},
+                                                     'checksums': {'state': 'done'}}
+        stats_high_water = self._stats_backfill_high_water()
+        # Likewise for text previews, which older vaults built on every view.
+        preview_high_water = self._preview_backfill_high_water()
+        # And for whole-file digests and the CRC32s that fixed-layout zips need, read in one pass.
+        # Until then those assets are not cloned from and export as a streamed zip.
+        checksum_high_water = self._checksum_backfill_high_water()
+
+        # Asset creation runs on the shared ingest pool; this vault's queued and running tasks are counted here.
+        self.jobs = IngestJobs(self)
+        self.uploads = UploadSessions(self)
+        self.ingest_pool = ingest_pool or INGEST_POOL
+        self.ingest_lock = threading.Condition()
+        self.ingest_pending = 0
+        self.ingest_busy = 0
+        self.closing = False
+
+        self.scrubber = IntegrityScrubber(self)
+        self.space_reclaimer = SpaceReclaimer(self)
+        self.checkpointer = CheckpointScheduler(self)
+        if not background:
+            return
+        self.scrubber.resume_if_interrupted()
+        self.space_reclaimer.start()
+        self.checkpointer.start()
+        self.uploads.start()
+        self._start_backfill('stats', self._backfill_stats, stats_high_water)
+        self._start_backfill('previews', self._backfill_previews, preview_high_water)
+        self._start_backfill('checksums', self._backfill_checksums, checksum_high_water)
+
+    def _start_backfill(self, name: str, target: Callable[[int], None], high_water: int) -> None:
+        if not high_water:
+            return
+        self.backfills[name] = {'state': 'running', 'assets_done': 0, 'assets_total': high_water}
+        t = threading.Thread(target=target, args=(high_water,), name=f'{name}-backfill', daemon=True)
+        self.backfill_threads.append(t)
+        t.start()
+
+    def _open_write_conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # auto_vacuum only takes effect before the first table exists (or after a
+        # rewrite), so new vaults are created with incremental reclamation.
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA busy_timeout = 5000;")
+        conn.execute("PRAGMA cache_size = -64000;")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.commit()
+        return conn
+
+    def _get_read_conn(self) -> sqlite3.Connection:
+        """Creates a new, short-lived, read-only database connection."""
+        db_uri = f"file:{self.db_path}?mode=ro"
+        self.read_gate.acquire()
+        try:
+            with trace_span('sqlite.connect'):
+                conn = sqlite3.connect(db_uri, uri=True, check_same_thread=False, factory=TrackedReadConnection)
+        except sqlite3.Error:
+            self.read_gate.release()
+            raise
+        conn.gate = self.read_gate
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def bump_generation(self, collection_id: Optional[int] = None) -> None:
+        """Marks a committed write. Must be called after the commit, never before."""
+        with self.generation_lock:
+            self.write_generation += 1
+            if collection_id is not None:
+                self.collection_generations[collection_id] += 1
+
+    def get_generation(self, collection_id: Optional[int] = None) -> Tuple[int, int]:
+        """Returns (global generation, collection generation) for cache keys."""
+        with self.generation_lock:
+            local = self.collection_generations.get(collection_id, 0) if collection_id is not None else 0
+            return self.write_generation, local
+
+    def create_database_schema(self) -> None:
+        queries = [
+            'CREATE TABLE IF NOT EXISTS vault_properties (key TEXT PRIMARY KEY, value TEXT);',
+            'CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY, name TEXT NOT NULL, type TEXT NOT NULL, description TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
+            'CREATE TABLE IF NOT EXISTS collections (id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL REFERENCES projects(id), parent_id INTEGER REFERENCES collections(id), name TEXT, type TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
+            'CREATE TABLE IF NOT EXISTS assets (id INTEGER PRIMARY KEY, collection_id INTEGER REFERENCES collections(id), type TEXT NOT NULL, format TEXT, manifest TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
+            'CREATE TABLE IF NOT EXISTS metadata (id INTEGER PRIMARY KEY, asset_id INTEGER REFERENCES assets(id), key TEXT NOT NULL, value TEXT );',
+            'CREATE INDEX IF NOT EXISTS idx_metadata_asset ON metadata(asset_id);',
+            'CREATE INDEX IF NOT EXISTS idx_metadata_key ON metadata(key);',
+            'CREATE INDEX IF NOT EXISTS idx_metadata_asset_key ON metadata(asset_id, key);',
+            'CREATE INDEX IF NOT EXISTS idx_metadata_value ON metadata(value);',
+            'CREATE INDEX IF NOT EXISTS idx_collections_project ON collections(project_id);',
+            'CREATE INDEX IF NOT EXISTS idx_collections_parent ON collections(parent_id);',
+            'CREATE INDEX IF NOT EXISTS idx_assets_collection ON assets(collection_id);',
+            'CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB );',
+            'CREATE TABLE IF NOT EXISTS vault_stats (project_id INTEGER NOT NULL, collection_id INTEGER NOT NULL, format TEXT NOT NULL, assets INTEGER NOT NULL DEFAULT 0, logical_bytes INTEGER NOT NULL DEFAULT 0, chunk_refs INTEGER NOT NULL DEFAULT 0, new_chunks INTEGER NOT NULL DEFAULT 0, new_chunk_bytes INTEGER NOT NULL DEFAULT 0, stored_bytes INTEGER NOT NULL DEFAULT 0, reused_chunks INTEGER NOT NULL DEFAULT 0, reused_bytes INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (project_id, collection_id, format) );',
+            'CREATE TABLE IF NOT EXISTS chunk_size_stats (bucket INTEGER PRIMARY KEY, chunks INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0 );',
+            'CREATE TABLE IF NOT EXISTS scrub_failures (id INTEGER PRIMARY KEY, run_started TEXT, kind TEXT NOT NULL, ref TEXT NOT NULL, error TEXT, detected_at DATETIME DEFAULT CURRENT_TIMESTAMP );',
+            'CREATE TABLE IF NOT EXISTS ingest_jobs (id INTEGER PRIMARY KEY, collection_id INTEGER, filename TEXT, state TEXT NOT NULL, total_bytes INTEGER, processed_bytes INTEGER, asset_id INTEGER, error TEXT, created_at REAL, started_at REAL, finished_at REAL );',
+            'CREATE INDEX IF NOT EXISTS idx_ingest_jobs_state ON ingest_jobs(state);',
+            'CREATE TABLE IF NOT EXISTS upload_sessions (upload_id TEXT PRIMARY KEY, filename TEXT, collection_id INTEGER, path_prefix TEXT, size INTEGER, chunk_size INTEGER, state TEXT NOT NULL, job_id INTEGER, created_at REAL, updated_at REAL );',
+            'CREATE TABLE IF NOT EXISTS replica_map (source_vault TEXT NOT NULL, kind TEXT NOT NULL, source_id INTEGER NOT NULL, target_id INTEGER NOT NULL, PRIMARY KEY (source_vault, kind, source_id) );',
+            'CREATE TABLE IF NOT EXISTS replica_credit (source_vault TEXT NOT NULL, hash TEXT NOT NULL, stored INTEGER NOT NULL, PRIMARY KEY (source_vault, hash) ) WITHOUT ROWID;',
+            'CREATE TABLE IF NOT EXISTS asset_previews (asset_id INTEGER PRIMARY KEY REFERENCES assets(id), size INTEGER NOT NULL, encoding TEXT, line_count INTEGER, truncated INTEGER NOT NULL DEFAULT 0, content BLOB );',
+            'CREATE TABLE IF NOT EXISTS import_journal (collection_id INTEGER NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, asset_id INTEGER NOT NULL, source TEXT, imported_at DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (collection_id, path) );',
+            'CREATE TABLE IF NOT EXISTS stats_backfill_chunks (hash TEXT PRIMARY KEY) WITHOUT ROWID;'
+        ]
+        with self.lock:
+            for q in queries:
+                try:
+                    self.conn.execute(q)
+                except sqlite3.Error as e:
+                    logging.error(f"Schema error: {e}")
+            self.conn.commit()
+
+    def _ensure_schema_extensions(self) -> None:
+        with self.lock:
+            c = self.conn.cursor()
+            try:
+                c.execute("PRAGMA table_info(assets)")
+                cols = [r['name'] for r in c.fetchall()]
+                if 'data' in cols: self._migrate_to_chunked_storage(c)
+                c.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                tables = set(r[0] for r in c.fetchall())
+                if 'chunks' not in tables:
+                    c.execute('CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB );')
+                for table, col, typ in [
+                    ('projects', 'order_index', 'INTEGER'),
+                    ('assets', 'order_index', 'INTEGER'),
+                    ('collections', 'parent_id', 'INTEGER REFERENCES collections(id)'),
+                    ('assets', 'crc32', 'INTEGER'),
+                    ('ingest_jobs', 'assets', 'INTEGER'),
+                    ('assets', 'size', 'INTEGER'),
+                    ('assets', 'digest', 'TEXT'),
+                    ('vault_stats', 'cloned_assets', 'INTEGER NOT NULL DEFAULT 0'),
+                    ('vault_stats', 'cloned_bytes', 'INTEGER NOT NULL DEFAULT 0')
+                ]:
+                    c.execute(f"PRAGMA table_info({table})")
+                    if col not in [r['name'] for r in c.fetchall()]:
+                        c.execute(f"ALTER TABLE {table} ADD COLUMN {col} {typ}")
+                # Whole-file SHA-256 lookups always come with the size, which rules most files out on its own.
+                c.execute('CREATE INDEX IF NOT EXISTS idx_assets_size_digest ON assets(size, digest)')
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Extension error: {e}")
+
+    def close(self) -> None:
+        """Drains this vault's ingest tasks, stops background maintenance and checkpoints the WAL away."""
+        # 1. Refuse new ingest tasks.
+        with self.ingest_lock:
+            self.closing = True
+            logging.info(f"Waiting for {self.ingest_pending} ingest tasks of {self.db_path.name}...")
+
+            # 2. Wait for the shared pool to finish the ones already queued or running.
+            while self.ingest_pending:
+                self.ingest_lock.wait()
+        logging.info("All ingest tasks have completed.")
+
+        # Pause any integrity scrub; its checkpoint lets it resume on next start.
+        self.scrubber.stop()
+        # Backfills persist their progress, so they likewise resume on next open.
+        self.backfill_stop.set()
+        for t in self.backfill_threads:
+            t.join()
+        self.space_reclaimer.stop()
+        self.checkpointer.stop()
+        self.uploads.stop()
+
+        # 3. Now that no threads are using the connection, safely checkpoint and close.
+        try:
+            logging.info("Running final database checkpoint...")
+            # TRUNCATE is more aggressive than FULL and ideal for shutdown.
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            self.conn.close()
+            logging.info("Database connection closed.")
+        except Exception as e:
+            logging.error(f"Error during final DB cleanup: {e}")
+
+    def start_replication(self, target_path: str, password: str) -> bool:
+        """Starts a background sync of this vault into target_path. False if one is already running."""
+        with self.replication_lock:
+            if self.replication and self.replication.state == 'running':
+                return False
+            self.replication = VaultReplicator(self, target_path, password)
+            self.replication.state = 'running'
+        threading.Thread(target=self.replication.run, name='replication', daemon=True).start()
+        return True
+
+    def set_password(self, password: str) -> None:
+        """Hashes and stores the vault password."""
+        with self.lock:
+            salt = os.urandom(16)
+            pw_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
+            self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)", ('password_salt', salt.hex()))
+            self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)", ('password_hash', pw_hash.hex()))
+            self.conn.commit()
+
+    def check_password(self, password: str) -> bool:
+        """Checks if the provided password is correct."""
+        try:
+            with self._get_read_conn() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT value FROM vault_properties WHERE key = 'password_salt'")
+                salt_row = cur.fetchone()
+                cur.execute("SELECT value FROM vault_properties WHERE key = 'password_hash'")
+                hash_row = cur.fetchone()
+
+                if not salt_row or not hash_row:
+                    # If no password is set, allow access (for initial setup)
+                    return True
+
+                salt = bytes.fromhex(salt_row[0])
+                stored_hash = bytes.fromhex(hash_row[0])
+                
+                new_hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
+                
+                return new_hash == stored_hash
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Password check error: {e}")
+            return False
+
+    def _migrate_to_chunked_storage(self, cursor: sqlite3.Cursor) -> None:
+        with self.lock:
+            try:
+                c = cursor
+                c.execute("CREATE TABLE assets_new (id INTEGER PRIMARY KEY, collection_id INTEGER REFERENCES collections(id), type TEXT NOT NULL, format TEXT, manifest TEXT, order_index INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+                c.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB)")
+
+                # Add columns if they don't exist
+                c.execute("PRAGMA table_info(assets_new)")
+                cols = [r['name'] for r in c.fetchall()]
+                if 'order_index' not in cols:
+                    c.execute("ALTER TABLE assets_new ADD COLUMN order_index INTEGER")
+
+                for asset in c.execute("SELECT * FROM assets").fetchall():
+                    data = zlib.decompress(asset['data']) if asset.get('compression') == 'zlib' else asset['data']
+                    
                     manifest: Dict[str, Any] = {'chain': [], 'total_size': 0, 'filename': f"asset_{asset['id']}"}
                     previous_block_hash: Optional[str] = None
                     
@@ -1617,50 +3425,71 @@ class CompactVaultManager:
                 logging.error(f"Migration error: {e}")
                 self.conn.rollback()
 
-    def _process_asset_creation_queue(self) -> None:
-        while True:
+    def submit_ingest(self, task: Tuple[IngestJob, int, str, List[str], str]) -> None:
+        """Queues a completed upload on the shared ingest pool."""
+        with self.ingest_lock:
+            if self.closing:
+                raise RuntimeError(f'{self.db_path.name} is closing')
+            self.ingest_pending += 1
+        self.ingest_pool.submit(self, task)
+
+    def _process_ingest_task(self, task: Tuple[IngestJob, int, str, List[str], str]) -> None:
+        """Runs on an IngestPool thread."""
+        try:
+            job, base_collection_id, path_prefix, chunk_paths, filename = task
+            with self.ingest_lock:
+                self.ingest_busy += 1
+            started = time.perf_counter()
+            self.jobs.started(job)
             try:
-                task = self.asset_creation_queue.get()
-                if task is None:
-                    break  # Sentinel value to stop the worker
-                base_collection_id, path_prefix, chunk_paths, filename = task
-                self.create_asset_from_chunks(base_collection_id, path_prefix, chunk_paths, filename)
+                if job.expand:
+                    assets, errors = self.expand_archive(base_collection_id, path_prefix, chunk_paths, filename, job)
+                    self.jobs.finished(job, error='; '.join(errors[:20]) or None, assets=assets)
+                else:
+                    asset_id = self.create_asset_from_chunks(base_collection_id, path_prefix, chunk_paths, filename, job)
+                    self.jobs.finished(job, asset_id=asset_id)
             except Exception as e:
-                logging.error(f"Error in asset creation worker: {e}")
-
-    def create_asset_from_chunks(self, base_collection_id: int, path_prefix: str, chunk_paths: List[str], filename: str) -> int:
-        try:
-            file_extension = filename.split('.')[-1].lower() if '.' in filename else 'binary'
-            asset_type_map = {
-                'txt':'text','html':'text','css':'text','js':'text','md':'text','json':'text','csv':'text','xml':'text','py':'text',
-                'png':'image','jpg':'image','jpeg':'image','gif':'image','svg':'image','webp':'image',
-                'mp3':'audio','wav':'audio','ogg':'audio','m4a':'audio','flac':'audio',
-                'mp4':'video','mov':'video','webm':'video', 'mkv':'video', 'avi':'video', 'flv':'video',
-                'gltf':'3d','glb':'3d',
-                'epub':'binary','pdf':'binary','zip':'binary','rar':'binary','7z':'binary'
-            }
-            asset_type = asset_type_map.get(file_extension, 'binary')
+                self.jobs.finished(job, error=str(e))
+                raise
+            finally:
+                if job.upload_id:
+                    self.uploads.finished(job.upload_id)
+                INGEST_BUSY_SECONDS.inc(time.perf_counter() - started)
+                with self.ingest_lock:
+                    self.ingest_busy -= 1
+        except Exception as e:
+            logging.error(f"Error in asset creation worker: {e}")
+        finally:
+            with self.ingest_lock:
+                self.ingest_pending -= 1
+                self.ingest_lock.notify_all()
 
-            manifest: Dict[str, Any] = {'chain': [], 'total_size': 0, 'filename': filename}
-            previous_block_hash: Optional[str] = None
-            
+    def create_asset_from_chunks(self, base_collection_id: int, path_prefix: str, chunk_paths: List[str], filename: str,
+                                 job: Optional[IngestJob] = None) -> int:
+        try:
             # Optimization: Estimate params based on first chunk header
             header = b''
             if chunk_paths:
                 with open(chunk_paths[0], 'rb') as f:
                     header = f.read(1024)
-            
-            # Simple heuristic for chunking parameters without reading whole file size
-            # Assuming if there are many chunks, it's a big file
-            if len(chunk_paths) > 2: 
-                min_sz, max_sz = 65536, 1048576 # 1MB chunks
-            else:
-                min_sz, max_sz = 4096, 262144
-            
-            sentinel = b'\x42\xFE'
-            if all(b < 128 for b in header[:100]):
-                sentinel = b'\xFF\xFE'
+            # Parts may be any size; the heuristic counts 5 MB pieces like the original client sent.
+            total_size = sum(os.path.getsize(p) for p in chunk_paths)
+            piece_count = max(1, -(-total_size // UPLOAD_PIECE_SIZE))
 
+            # Hashing is far cheaper than chunking, so when a file of this size
+            # exists, look for an identical one and store a reference to it.
+            digest = None
+            with self._get_read_conn() as conn:
+                candidates = total_size > 0 and self._size_indexed(conn, total_size)
+            if candidates:
+                digest = sha256_files(chunk_paths)
+                asset_id = self.clone_asset(base_collection_id, path_prefix, filename, digest, total_size)
+                if asset_id is not None:
+                    if job:
+                        job.add_bytes(total_size)
+                    return asset_id
+            
+            min_sz, max_sz, sentinel = OptimizedCDC.ingest_params(header, piece_count)
             cdc = OptimizedCDC(min_size=min_sz, max_size=max_sz, sentinel=sentinel)
             
             # Use wrapped stream instead of concatenating to a huge temp file
@@ -1673,41 +3502,12 @@ class CompactVaultManager:
                 try:
                     # ATOMIC FIX: Resolve path inside the transaction
                     collection_id = self.get_or_create_collection_from_path(base_collection_id, path_prefix)
-
-                    for chunk_data in cdc.chunk_file(stream):
-                        chunk_size = len(chunk_data)
-                        chunk_hash = hashlib.blake2b(chunk_data).hexdigest()
-                        
-                        # OPTIMIZATION: Lower compression level for speed (1=Fastest, 9=Best)
-                        compressed = zlib.compress(chunk_data, level=1)
-
-                        # Insert chunk data
-                        self.conn.execute("INSERT OR IGNORE INTO chunks (hash, data) VALUES (?, ?)", (chunk_hash, compressed))
-
-                        block = {
-                            'chunk_hash': chunk_hash,
-                            'size': chunk_size,
-                            'previous_hash': previous_block_hash
-                        }
-                        block_str = json.dumps(block, sort_keys=True)
-                        block_hash = hashlib.blake2b(block_str.encode()).hexdigest()
-
-                        manifest['chain'].append(block)
-                        manifest['total_size'] += chunk_size
-                        previous_block_hash = block_hash
-                    
-                    manifest_str = json.dumps(manifest)
-                    logging.info(f"Created manifest for {filename}")
-
-                    sql = 'INSERT INTO assets (collection_id, type, format, manifest) VALUES (?, ?, ?, ?)'
-                    params = (collection_id, asset_type, file_extension, manifest_str)
-                    cur = self.conn.execute(sql, params)
-                    asset_id = cur.lastrowid
-
-                    self.conn.execute("INSERT INTO metadata (asset_id, key, value) VALUES (?, 'filename', ?)", (asset_id, filename))
+                    records = ChunkEncoder(cdc, stream, job.add_bytes if job else None, digest)
+                    asset_id, stats = self._insert_asset(collection_id, filename, records)
                     
                     # Commit everything at once
                     self.conn.commit()
+                    self._asset_committed(collection_id, stats)
                     logging.info(f"Successfully inserted asset {asset_id} for {filename}")
                     
                 except Exception:
@@ -1730,6 +3530,567 @@ class CompactVaultManager:
                 try: os.rmdir(os.path.dirname(chunk_paths[0]))
                 except (OSError, IndexError): pass
 
+    EXPAND_BATCH_FILES = 500
+    EXPAND_BATCH_BYTES = 256 * 1048576
+    EXPAND_BATCH_SECONDS = 5.0
+    EXPAND_DIGEST_BYTES = 64 * 1048576
+
+    def expand_archive(self, base_collection_id: int, path_prefix: str, chunk_paths: List[str], filename: str,
+                       job: Optional[IngestJob] = None) -> Tuple[int, List[str]]:
+        """
+        Stores every regular file of an uploaded zip or tar as its own asset,
+        under a collection named after the archive, and returns (assets
+        stored, member errors). Members stream from the upload parts into
+        the chunker without touching disk. Transactions are bounded by
+        members, bytes and time, so the write lock is released between
+        batches; a member that fails to read is rolled back alone.
+        """
+        root = '/'.join(p for p in (path_prefix.strip('/'), archive_root_name(filename)) if p)
+        members = iter_archive_members(chunk_paths, filename)
+        collections: Dict[str, int] = {}
+        errors: List[str] = []
+        stored = 0
+        try:
+            exhausted = False
+            while not exhausted:
+                committed: List[Tuple[int, IngestStats]] = []
+                batch_bytes, batch_started = 0, time.monotonic()
+                with self.lock:
+                    self.conn.execute("BEGIN TRANSACTION")
+                    try:
+                        while (len(committed) < self.EXPAND_BATCH_FILES and batch_bytes < self.EXPAND_BATCH_BYTES
+                               and time.monotonic() - batch_started < self.EXPAND_BATCH_SECONDS):
+                            try:
+                                entry = next(members, None)
+                            except (OSError, EOFError, ValueError, zipfile.BadZipFile, tarfile.TarError, zlib.error) as e:
+                                # A damaged archive keeps the members read before the damage.
+                                errors.append(f'{filename}: {e}')
+                                entry = None
+                            if entry is None:
+                                exhausted = True
+                                break
+                            name, size, stream, source = entry
+                            member_dir, member_name = safe_member_path(name)
+                            if not member_name:
+                                continue
+                            if isinstance(stream, Exception):
+                                errors.append(f'{name}: {stream}')
+                                continue
+                            prefix = '/'.join(p for p in (root, member_dir) if p)
+                            if prefix not in collections:
+                                collections[prefix] = self.get_or_create_collection_from_path(base_collection_id, prefix)
+                            self.conn.execute("SAVEPOINT expand_member")
+                            try:
+                                digest, original = None, None
+                                if 0 < size <= self.EXPAND_DIGEST_BYTES and self._size_indexed(self.conn, size):
+                                    # Members can only be read once, so a possible duplicate is buffered and hashed first.
+                                    data = stream.read()
+                                    digest = hashlib.sha256(data).hexdigest()
+                                    original = self._duplicate_of(self.conn, digest, size) if len(data) == size else None
+                                    stream = BufferReader(data)
+                                if original:
+                                    _, stats = self._clone_asset(collections[prefix], member_name, original, digest)
+                                    if job:
+                                        job.processed_bytes = source.pos
+                                else:
+                                    header = stream.read(1024)
+                                    min_sz, max_sz, sentinel = OptimizedCDC.ingest_params(header, max(1, -(-size // UPLOAD_PIECE_SIZE)))
+                                    progress = (lambda _, source=source: setattr(job, 'processed_bytes', source.pos)) if job else None
+                                    records = ChunkEncoder(OptimizedCDC(min_size=min_sz, max_size=max_sz, sentinel=sentinel),
+                                                           PieceStream(stream, header), progress, digest)
+                                    _, stats = self._insert_asset(collections[prefix], member_name, records)
+                                self.conn.execute("RELEASE expand_member")
+                                committed.append((collections[prefix], stats))
+                                batch_bytes += size
+                            except (OSError, EOFError, ValueError, zipfile.BadZipFile, tarfile.TarError, zlib.error) as e:
+                                self.conn.execute("ROLLBACK TO expand_member")
+                                self.conn.execute("RELEASE expand_member")
+                                errors.append(f'{name}: {e}')
+                                logging.error(f"Expanding {name} from {filename} failed: {e}")
+                        self.conn.commit()
+                    except Exception:
+                        self.conn.rollback()
+                        raise
+                for collection_id, stats in committed:
+                    self._asset_committed(collection_id, stats)
+                stored += len(committed)
+            logging.info(f"Expanded {stored} files from {filename}")
+            return stored, errors
+        finally:
+            members.close()
+            for path in chunk_paths:
+                try: os.remove(path)
+                except OSError: pass
+
+    def create_assets_from_buffers(self, base_collection_id: int, files: List[EncodedFile]) -> List[int]:
+        """Inserts pre-encoded files, creating their path collections, in a single transaction."""
+        committed: List[Tuple[int, IngestStats]] = []
+        asset_ids: List[int] = []
+        with self.lock:
+            self.conn.execute("BEGIN TRANSACTION")
+            try:
+                collections: Dict[str, int] = {}
+                for f in files:
+                    if f.path_prefix not in collections:
+                        collections[f.path_prefix] = self.get_or_create_collection_from_path(base_collection_id, f.path_prefix)
+                    original = self._duplicate_of(self.conn, f.digest, f.size) if f.size else None
+                    if original:
+                        asset_id, stats = self._clone_asset(collections[f.path_prefix], f.filename, original, f.digest)
+                    else:
+                        asset_id, stats = self._insert_asset(collections[f.path_prefix], f.filename, f)
+                    committed.append((collections[f.path_prefix], stats))
+                    asset_ids.append(asset_id)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        for collection_id, stats in committed:
+            self._asset_committed(collection_id, stats)
+        return asset_ids
+
+    def _insert_asset(self, collection_id: int, filename: str, records: 'ChunkEncoder') -> Tuple[int, IngestStats]:
+        """
+        Stores one file's chunks, manifest, asset row, filename metadata and,
+        for text, the preview. Runs inside the caller's transaction. records
+        yields (hash, size, compressed) in file order and carries the
+        whole-file crc, digest and head once exhausted.
+        """
+        asset_type, file_extension = self._asset_type(filename)
+
+        manifest: Dict[str, Any] = {'version': MANIFEST_VERSION, 'chain': [], 'total_size': 0, 'filename': filename}
+        leaves: List[bytes] = []
+        stats = IngestStats()
+
+        for chunk_hash, chunk_size, compressed in records:
+            # Insert chunk data; rowcount tells a new chunk from a deduplicated one
+            cur = self.conn.execute("INSERT OR IGNORE INTO chunks (hash, data) VALUES (?, ?)", (chunk_hash, compressed))
+            stats.add_chunk(chunk_size, len(compressed), cur.rowcount == 1)
+
+            manifest['chain'].append({'chunk_hash': chunk_hash, 'size': chunk_size})
+            manifest['total_size'] += chunk_size
+            leaves.append(merkle_leaf(chunk_hash, chunk_size))
+
+        manifest['merkle_root'] = merkle_root(leaves).hex()
+        manifest_str = json.dumps(manifest)
+        logging.info(f"Created manifest for {filename}")
+
+        sql = 'INSERT INTO assets (collection_id, type, format, manifest, crc32, size, digest) VALUES (?, ?, ?, ?, ?, ?, ?)'
+        params = (collection_id, asset_type, file_extension, manifest_str, records.crc, manifest['total_size'], records.digest)
+        cur = self.conn.execute(sql, params)
+        asset_id = cur.lastrowid
+
+        self.conn.execute("INSERT INTO metadata (asset_id, key, value) VALUES (?, 'filename', ?)", (asset_id, filename))
+        if asset_type == 'text':
+            self._store_preview(self.conn, asset_id, records.head, manifest['total_size'], file_extension)
+        self._record_ingest_stats(collection_id, file_extension, stats)
+        return asset_id, stats
+
+    @staticmethod
+    def _asset_type(filename: str) -> Tuple[str, str]:
+        """(asset type, format) from a filename's extension."""
+        file_extension = filename.split('.')[-1].lower() if '.' in filename else 'binary'
+        asset_type_map = {
+            'txt':'text','html':'text','css':'text','js':'text','md':'text','json':'text','csv':'text','xml':'text','py':'text',
+            'png':'image','jpg':'image','jpeg':'image','gif':'image','svg':'image','webp':'image',
+            'mp3':'audio','wav':'audio','ogg':'audio','m4a':'audio','flac':'audio',
+            'mp4':'video','mov':'video','webm':'video', 'mkv':'video', 'avi':'video', 'flv':'video',
+            'gltf':'3d','glb':'3d',
+            'epub':'binary','pdf':'binary','zip':'binary','rar':'binary','7z':'binary'
+        }
+        return asset_type_map.get(file_extension, 'binary'), file_extension
+
+    @staticmethod
+    def _size_indexed(conn: sqlite3.Connection, size: int) -> bool:
+        """Whether any asset of exactly this size has a digest, i.e. whether hashing a new file first can pay off."""
+        return conn.execute("SELECT 1 FROM assets WHERE size = ? AND digest IS NOT NULL LIMIT 1", (size,)).fetchone() is not None
+
+    @staticmethod
+    def _duplicate_of(conn: sqlite3.Connection, digest: str, size: int) -> Optional[sqlite3.Row]:
+        return conn.execute("SELECT id, collection_id, manifest, crc32 FROM assets WHERE size = ? AND digest = ? ORDER BY id LIMIT 1",
+                            (size, digest.lower())).fetchone()
+
+    def _clone_asset(self, collection_id: int, filename: str, source: sqlite3.Row, digest: str) -> Tuple[int, IngestStats]:
+        """
+        Stores a file identical to an existing asset by copying its manifest
+        (renamed) and preview; no chunk is read or written. Runs inside the
+        caller's transaction.
+        """
+        asset_type, file_extension = self._asset_type(filename)
+        manifest = json.loads(source['manifest'])
+        manifest['filename'] = filename
+        stats = IngestStats()
+        stats.add_clone(manifest)
+
+        cur = self.conn.execute(
+            'INSERT INTO assets (collection_id, type, format, manifest, crc32, size, digest) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (collection_id, asset_type, file_extension, json.dumps(manifest), source['crc32'], manifest['total_size'], digest.lower()))
+        asset_id = cur.lastrowid
+        self.conn.execute("INSERT INTO metadata (asset_id, key, value) VALUES (?, 'filename', ?)", (asset_id, filename))
+        if asset_type == 'text':
+            # Without a stored preview to copy, reads fall back to building it from the chunks.
+            self.conn.execute("INSERT INTO asset_previews (asset_id, size, encoding, line_count, truncated, content) "
+                              "SELECT ?, size, encoding, line_count, truncated, content FROM asset_previews WHERE asset_id = ?",
+                              (asset_id, source['id']))
+        self._record_ingest_stats(collection_id, file_extension, stats)
+        logging.info(f"Stored {filename} as a copy of asset {source['id']}")
+        return asset_id, stats
+
+    def find_asset_by_digest(self, digest: str, size: int) -> Optional[Dict[str, Any]]:
+        """The oldest asset whose content has this SHA-256 and size, if any."""
+        with self._get_read_conn() as conn:
+            row = self._duplicate_of(conn, digest, size)
+            if not row:
+                return None
+            name = conn.execute("SELECT value FROM metadata WHERE asset_id = ? AND key = 'filename'", (row['id'],)).fetchone()
+        return {'asset_id': row['id'], 'collection_id': row['collection_id'], 'filename': name[0] if name else None,
+                'size': size, 'digest': digest.lower()}
+
+    def has_asset_of_size(self, size: int) -> bool:
+        """Whether hashing a file of this size could find a copy in the vault."""
+        with self._get_read_conn() as conn:
+            return self._size_indexed(conn, size)
+
+    def clone_asset(self, base_collection_id: int, path_prefix: str, filename: str, digest: str, size: int) -> Optional[int]:
+        """
+        Creates an asset from an identical existing one, found by SHA-256 and
+        size, without uploading or chunking anything. Returns None when no
+        such asset exists.
+        """
+        with self.lock:
+            source = self._duplicate_of(self.conn, digest, size)
+            if not source:
+                return None
+            self.conn.execute("BEGIN TRANSACTION")
+            try:
+                collection_id = self.get_or_create_collection_from_path(base_collection_id, path_prefix)
+                asset_id, stats = self._clone_asset(collection_id, filename, source, digest)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        self._asset_committed(collection_id, stats)
+        return asset_id
+
+    @staticmethod
+    def _store_preview(conn: sqlite3.Connection, asset_id: int, head: bytes, total_size: int, fmt: str) -> None:
+        text, line_count, truncated, encoding = build_text_preview(head, total_size, fmt)
+        conn.execute("INSERT OR REPLACE INTO asset_previews (asset_id, size, encoding, line_count, truncated, content) VALUES (?, ?, ?, ?, ?, ?)",
+                     (asset_id, total_size, encoding, line_count, int(truncated), zlib.compress(text.encode('utf-8'), 6)))
+
+    def _asset_committed(self, collection_id: int, stats: IngestStats) -> None:
+        """Bookkeeping once an inserted asset's transaction has committed."""
+        self.bump_generation(collection_id)
+        INGEST_ASSETS.inc()
+        INGEST_CHUNKS.inc(stats.chunk_refs)
+        INGEST_BYTES.inc(stats.logical_bytes)
+        INGEST_STORED_BYTES.inc(stats.stored_bytes)
+        INGEST_CLONED.inc(stats.cloned_assets)
+
+    def _record_ingest_stats(self, collection_id: int, fmt: str, stats: IngestStats, assets: int = 1,
+                             conn: Optional[sqlite3.Connection] = None) -> None:
+        """Folds one asset's counters into vault_stats. Runs inside the caller's transaction."""
+        conn = conn or self.conn
+        row = conn.execute("SELECT project_id FROM collections WHERE id = ?", (collection_id,)).fetchone()
+        project_id = row[0] if row else 0
+        conn.execute(
+            """INSERT INTO vault_stats (project_id, collection_id, format, assets, logical_bytes, chunk_refs,
+                                        new_chunks, new_chunk_bytes, stored_bytes, reused_chunks, reused_bytes,
+                                        cloned_assets, cloned_bytes)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (project_id, collection_id, format) DO UPDATE SET
+                   assets = assets + excluded.assets,
+                   logical_bytes = logical_bytes + excluded.logical_bytes,
+                   chunk_refs = chunk_refs + excluded.chunk_refs,
+                   new_chunks = new_chunks + excluded.new_chunks,
+                   new_chunk_bytes = new_chunk_bytes + excluded.new_chunk_bytes,
+                   stored_bytes = stored_bytes + excluded.stored_bytes,
+                   reused_chunks = reused_chunks + excluded.reused_chunks,
+                   reused_bytes = reused_bytes + excluded.reused_bytes,
+                   cloned_assets = cloned_assets + excluded.cloned_assets,
+                   cloned_bytes = cloned_bytes + excluded.cloned_bytes""",
+            (project_id, collection_id, fmt or '', assets, stats.logical_bytes, stats.chunk_refs, stats.new_chunks,
+             stats.new_chunk_bytes, stats.stored_bytes, stats.reused_chunks, stats.reused_bytes,
+             stats.cloned_assets, stats.cloned_bytes))
+        if stats.size_buckets:
+            conn.executemany(
+                """INSERT INTO chunk_size_stats (bucket, chunks, bytes) VALUES (?, ?, ?)
+                   ON CONFLICT (bucket) DO UPDATE SET chunks = chunks + excluded.chunks, bytes = bytes + excluded.bytes""",
+                [(b, c, n) for b, (c, n) in stats.size_buckets.items()])
+
+    def metric_samples(self) -> List[Tuple[str, str, str, List[Tuple[Tuple[Tuple[str, Any], ...], float]]]]:
+        """Point-in-time vault samples for /metrics; everything here is cheap to read."""
+        cache = self.response_cache
+        wal = self.checkpointer.metrics()
+        return [
+            ('compactvault_ingest_queue_depth', 'gauge', 'Assets waiting for an ingest worker.',
+             [((), self.ingest_pending - self.ingest_busy)]),
+            ('compactvault_ingest_workers', 'gauge', 'Ingest worker threads (shared by all open vaults).',
+             [((), self.ingest_pool.size)]),
+            ('compactvault_ingest_workers_busy', 'gauge', 'Ingest workers currently processing an asset.',
+             [((), self.ingest_busy)]),
+            ('compactvault_ingest_pending_bytes', 'gauge', 'Uploaded bytes accepted but not yet ingested.',
+             [((), self.jobs.backlog_bytes())]),
+            ('compactvault_read_connections_opened_total', 'counter', 'Read connections opened since the vault was unlocked.',
+             [((), self.read_gate.opened_total)]),
+            ('compactvault_read_connections_active', 'gauge', 'Read connections currently open.',
+             [((), self.read_gate.active)]),
+            ('compactvault_response_cache_requests_total', 'counter', 'Response cache lookups by result.',
+             [((('result', 'hit'),), cache.hits), ((('result', 'miss'),), cache.misses)]),
+            ('compactvault_response_cache_entries', 'gauge', 'Serialized responses held in the cache.',
+             [((), len(cache.entries))]),
+            ('compactvault_wal_bytes', 'gauge', 'Size of the write-ahead log file.', [((), wal['wal_bytes'])]),
+            ('compactvault_wal_frames_behind', 'gauge', 'WAL frames not yet checkpointed into the database.',
+             [((), wal['frames_behind'])]),
+            ('compactvault_wal_checkpoints_total', 'counter', 'Scheduled checkpoints by mode.',
+             [((('mode', mode),), n) for mode, n in sorted(wal['checkpoints'].items())]),
+        ]
+
+    def get_vault_id(self) -> str:
+        """Stable identity of this vault, used to key replicas made from it."""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM vault_properties WHERE key = 'vault_id'").fetchone()
+            if row:
+                return row[0]
+            vault_id = uuid.uuid4().hex
+            self.conn.execute("INSERT INTO vault_properties (key, value) VALUES ('vault_id', ?)", (vault_id,))
+            self.conn.commit()
+            return vault_id
+
+    def _stats_backfill_high_water(self) -> int:
+        """
+        Returns the last asset id needing a stats backfill, or 0 when stats
+        are complete. The mark is fixed (stats_backfill_to) the first time,
+        since assets ingested after it are counted at ingest and must not
+        be replayed by a backfill resumed after a restart.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM vault_properties WHERE key = 'stats_version'").fetchone()
+            if row:
+                return 0
+            row = self.conn.execute("SELECT value FROM vault_properties WHERE key = 'stats_backfill_to'").fetchone()
+            if row:
+                return int(row[0])
+            high = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM assets").fetchone()[0]
+            if high:
+                self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES ('stats_backfill_to', ?)", (str(high),))
+            else:
+                # Nothing ingested yet: the ingest path keeps stats complete from here on.
+                self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES ('stats_version', '1')")
+            self.conn.commit()
+            return high
+
+    def _backfill_high_water(self, name: str, pending_sql: str) -> int:
+        """
+        Returns the last asset id a backfill still has to cover (from
+        pending_sql), or 0 once <name>_version marks it complete. A vault
+        with nothing pending is marked complete right away.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM vault_properties WHERE key = ?", (f'{name}_version',)).fetchone()
+            if row:
+                return 0
+            high = self.conn.execute(pending_sql).fetchone()[0] or 0
+            if not high:
+                self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, '1')", (f'{name}_version',))
+                self.conn.commit()
+            return high
+
+    def _preview_backfill_high_water(self) -> int:
+        """Returns the last asset id that may lack a precomputed preview, or 0 when previews are complete."""
+        return self._backfill_high_water('previews', "SELECT MAX(id) FROM assets")
+
+    def _checksum_backfill_high_water(self) -> int:
+        """Returns the last asset id that may lack a digest or CRC32, or 0 when every asset has both."""
+        return self._backfill_high_water('checksums', "SELECT MAX(id) FROM assets WHERE digest IS NULL OR crc32 IS NULL")
+
+    BACKFILL_BATCH = 200
+
+    def _run_backfill(self, name: str, high_water: int, rows_sql: str, read: Callable[[sqlite3.Connection, List[sqlite3.Row]], Any],
+                      write: Callable[[Any], None], finish: Optional[Callable[[], None]] = None) -> None:
+        """
+        Drives a backfill over assets up to high_water, BACKFILL_BATCH at a
+        time. rows_sql selects a batch (params: last id, high_water, limit);
+        read(conn, rows) turns it into updates on a short read snapshot, and
+        write(updates) applies them in one transaction together with the id
+        reached (<name>_backfilled_to), so a restart resumes where it
+        stopped. The last batch sets <name>_version instead, and runs
+        finish() in the same transaction. Progress is kept in
+        self.backfills[name].
+        """
+        try:
+            with self.lock:
+                row = self.conn.execute("SELECT value FROM vault_properties WHERE key = ?", (f'{name}_backfilled_to',)).fetchone()
+            last = int(row[0]) if row else 0
+            while last < high_water:
+                with self._get_read_conn() as conn:
+                    rows = conn.execute(rows_sql, (last, high_water, self.BACKFILL_BATCH)).fetchall()
+                    updates = read(conn, rows)
+                last = rows[-1]['id'] if len(rows) == self.BACKFILL_BATCH else high_water
+                with self.lock:
+                    try:
+                        write(updates)
+                        if last >= high_water:
+                            if finish:
+                                finish()
+                            self.conn.execute("DELETE FROM vault_properties WHERE key = ?", (f'{name}_backfilled_to',))
+                            self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, '1')", (f'{name}_version',))
+                        else:
+                            self.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)",
+                                              (f'{name}_backfilled_to', str(last)))
+                        self.conn.commit()
+                    except Exception:
+                        self.conn.rollback()
+                        raise
+                self.backfills[name]['assets_done'] = last
+                if self.backfill_stop.is_set() and last < high_water:
+                    self.backfills[name] = {'state': 'paused', 'assets_done': last, 'assets_total': high_water}
+                    return
+            self.backfills[name] = {'state': 'done'}
+            logging.info(f"Backfill of {name} finished up to asset {high_water}")
+        except (sqlite3.Error, json.JSONDecodeError, zlib.error) as e:
+            logging.error(f"Backfill of {name} failed: {e}")
+            self.backfills[name] = {'state': 'failed', 'error': str(e)}
+
+    def _backfill_previews(self, high_water: int) -> None:
+        """Builds previews for text assets up to high_water that predate them."""
+        def read(conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> List[Tuple[int, bytes, int, str]]:
+            previews = []
+            for r in rows:
+                manifest = json.loads(r['manifest']) if r['manifest'] else {'chain': [], 'total_size': 0}
+                try:
+                    head = self._read_preview_head(conn, manifest, r['id'])
+                except ChunkIntegrityError as e:
+                    logging.error(f"Preview backfill skipped asset {r['id']}: {e}")
+                    continue
+                previews.append((r['id'], head, manifest.get('total_size', 0), r['format']))
+            return previews
+
+        def write(previews: List[Tuple[int, bytes, int, str]]) -> None:
+            for asset_id, head, size, fmt in previews:
+                self._store_preview(self.conn, asset_id, head, size, fmt)
+
+        self._run_backfill('previews', high_water,
+                           "SELECT a.id, a.format, a.manifest FROM assets a WHERE a.id > ? AND a.id <= ? AND a.type = 'text' "
+                           "AND NOT EXISTS (SELECT 1 FROM asset_previews p WHERE p.asset_id = a.id) ORDER BY a.id LIMIT ?",
+                           read, write)
+
+    def _backfill_checksums(self, high_water: int) -> None:
+        """
+        Reads back assets up to high_water that predate whole-file digests or
+        CRC32s and stores their size, SHA-256 and CRC32, both computed in one
+        pass over the chunks. An asset whose chunks cannot be read keeps its
+        size but neither checksum, so it is never cloned from and exports as
+        a streamed zip.
+        """
+        def read(conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> List[Tuple[int, Optional[str], Optional[int], int]]:
+            updates = []
+            for r in rows:
+                manifest = json.loads(r['manifest']) if r['manifest'] else {'chain': [], 'total_size': 0}
+                digest, crc = hashlib.sha256(), 0
+                try:
+                    for block in manifest['chain']:
+                        data = self.read_chunk(conn, block['chunk_hash'], block['size'], r['id'])
+                        digest.update(data)
+                        crc = zlib.crc32(data, crc)
+                except ChunkIntegrityError as e:
+                    logging.error(f"Checksum backfill skipped asset {r['id']}: {e}")
+                    updates.append((manifest.get('total_size', 0), None, None, r['id']))
+                    continue
+                updates.append((manifest.get('total_size', 0), digest.hexdigest(), crc, r['id']))
+            return updates
+
+        def write(updates: List[Tuple[int, Optional[str], Optional[int], int]]) -> None:
+            self.conn.executemany("UPDATE assets SET size = COALESCE(size, ?), digest = COALESCE(digest, ?), "
+                                  "crc32 = COALESCE(crc32, ?) WHERE id = ?", updates)
+
+        self._run_backfill('checksums', high_water,
+                           "SELECT id, manifest FROM assets WHERE id > ? AND id <= ? AND (digest IS NULL OR crc32 IS NULL) "
+                           "ORDER BY id LIMIT ?", read, write)
+
+    def _backfill_stats(self, high_water: int) -> None:
+        """
+        Replays manifests of assets up to high_water to rebuild vault_stats.
+        The first asset to reference a chunk is credited with storing it, as
+        the ingest path would have done. Chunks already credited are kept in
+        stats_backfill_chunks, written with each batch's counters and
+        stats_backfilled_to, so a resumed backfill neither recounts a batch
+        nor credits a chunk twice.
+        """
+        def read(conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> Tuple[Dict[Tuple[int, str], IngestStats], Dict[Tuple[int, str], int], Set[str]]:
+            totals: Dict[Tuple[int, str], IngestStats] = defaultdict(IngestStats)
+            counts: Dict[Tuple[int, str], int] = defaultdict(int)
+            credited: Set[str] = set()
+            for r in rows:
+                manifest = json.loads(r['manifest']) if r['manifest'] else {'chain': []}
+                key = (r['collection_id'], r['format'] or '')
+                stats = totals[key]
+                counts[key] += 1
+                for block in manifest['chain']:
+                    chunk_hash = block['chunk_hash']
+                    is_new = chunk_hash not in credited and conn.execute(
+                        "SELECT 1 FROM stats_backfill_chunks WHERE hash = ?", (chunk_hash,)).fetchone() is None
+                    stored = 0
+                    if is_new:
+                        credited.add(chunk_hash)
+                        stored_row = conn.execute("SELECT length(data) FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone()
+                        stored = stored_row[0] if stored_row and stored_row[0] else 0
+                    stats.add_chunk(block['size'], stored, is_new)
+            return totals, counts, credited
+
+        def write(batch: Tuple[Dict[Tuple[int, str], IngestStats], Dict[Tuple[int, str], int], Set[str]]) -> None:
+            totals, counts, credited = batch
+            self.conn.executemany("INSERT OR IGNORE INTO stats_backfill_chunks (hash) VALUES (?)", [(h,) for h in credited])
+            for (collection_id, fmt), stats in totals.items():
+                self._record_ingest_stats(collection_id, fmt, stats, assets=counts[(collection_id, fmt)])
+
+        def finish() -> None:
+            self.conn.execute("DELETE FROM stats_backfill_chunks")
+            self.conn.execute("DELETE FROM vault_properties WHERE key = 'stats_backfill_to'")
+
+        self._run_backfill('stats', high_water,
+                           "SELECT id, collection_id, format, manifest FROM assets WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                           read, write, finish)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Storage and dedup statistics, read from the counters kept at ingest."""
+        sums = ("SUM(assets) AS assets, SUM(logical_bytes) AS logical_bytes, SUM(chunk_refs) AS chunk_refs, "
+                "SUM(new_chunks) AS unique_chunks, SUM(new_chunk_bytes) AS unique_bytes, SUM(stored_bytes) AS stored_bytes, "
+                "SUM(reused_chunks) AS reused_chunks, SUM(reused_bytes) AS reused_bytes, "
+                "SUM(cloned_assets) AS cloned_assets, SUM(cloned_bytes) AS cloned_bytes")
+
+        def derive(row: sqlite3.Row) -> Dict[str, Any]:
+            d = dict(row)
+            for k in ('assets', 'logical_bytes', 'chunk_refs', 'unique_chunks', 'unique_bytes', 'stored_bytes', 'reused_chunks',
+                      'reused_bytes', 'cloned_assets', 'cloned_bytes'):
+                d[k] = d[k] or 0
+            d['dedup_ratio'] = round(d['logical_bytes'] / d['unique_bytes'], 3) if d['unique_bytes'] else None
+            d['compression_ratio'] = round(d['unique_bytes'] / d['stored_bytes'], 3) if d['stored_bytes'] else None
+            d['saved_bytes'] = d['logical_bytes'] - d['stored_bytes']
+            return d
+
+        try:
+            with self._get_read_conn() as conn:
+                totals = derive(conn.execute(f"SELECT {sums} FROM vault_stats").fetchone())
+                by_project = [derive(r) for r in conn.execute(
+                    f"SELECT s.project_id, p.name, {sums} FROM vault_stats s LEFT JOIN projects p ON p.id = s.project_id "
+                    "GROUP BY s.project_id ORDER BY logical_bytes DESC")]
+                by_collection = [derive(r) for r in conn.execute(
+                    f"SELECT s.collection_id, c.name, s.project_id, {sums} FROM vault_stats s LEFT JOIN collections c ON c.id = s.collection_id "
+                    "GROUP BY s.collection_id ORDER BY logical_bytes DESC")]
+                by_format = [derive(r) for r in conn.execute(
+                    f"SELECT s.format, {sums} FROM vault_stats s GROUP BY s.format ORDER BY logical_bytes DESC")]
+                chunk_sizes = [{'min_bytes': (1 << (r['bucket'] - 1)) if r['bucket'] else 0, 'max_bytes': (1 << r['bucket']) - 1,
+                                'chunks': r['chunks'], 'bytes': r['bytes']}
+                               for r in conn.execute("SELECT bucket, chunks, bytes FROM chunk_size_stats ORDER BY bucket")]
+            return {'totals': totals, 'by_project': by_project, 'by_collection': by_collection,
+                    'by_format': by_format, 'chunk_sizes': chunk_sizes, 'backfill': dict(self.backfills['stats']),
+                    'preview_backfill': dict(self.backfills['previews']), 'checksum_backfill': dict(self.backfills['checksums'])}
+        except sqlite3.Error as e:
+            logging.error(f"Get stats error: {e}")
+            return {'totals': {}, 'by_project': [], 'by_collection': [], 'by_format': [], 'chunk_sizes': [],
+                    'backfill': dict(self.backfills['stats']),
+                    'preview_backfill': dict(self.backfills['previews']), 'checksum_backfill': dict(self.backfills['checksums'])}
+
     def get_or_create_collection_from_path(self, base_collection_id: int, path_prefix: str) -> int:
         with self.lock:
             if not path_prefix:
@@ -1799,7 +4160,8 @@ class CompactVaultManager:
                 paginated_assets = []
                 for row in cur.fetchall():
                     r = dict(row)
-                    manifest = json.loads(r['manifest']) if r['manifest'] else {}
+                    with trace_span('manifest.decode'):
+                        manifest = json.loads(r['manifest']) if r['manifest'] else {}
                     if not r['filename']:
                         r['filename'] = manifest.get('filename', 'Untitled')
                     r['size_original'] = manifest.get('total_size', 0)
@@ -1815,19 +4177,30 @@ class CompactVaultManager:
 
         except (sqlite3.Error, json.JSONDecodeError) as e:
             logging.error(f"Get assets error: {e}")
-            return {'assets': [], 'total': 0, 'all_formats': []}
+            raise
 
     def get_asset_metadata(self, asset_id: int) -> Optional[Dict[str, Any]]:
         """Gets asset metadata without loading data."""
         try:
             with self._get_read_conn() as conn:
-                row = conn.execute("SELECT manifest FROM assets WHERE id=?", (asset_id,)).fetchone()
+                row = conn.execute("SELECT manifest, created_at FROM assets WHERE id=?", (asset_id,)).fetchone()
                 if not row or not row['manifest']: return None
-                manifest = json.loads(row['manifest'])
+                with trace_span('manifest.decode'):
+                    manifest = json.loads(row['manifest'])
                 filename = manifest.get('filename', f'asset_{asset_id}')
                 mime = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
                 size = manifest.get('total_size', 0)
-                return {'filename': filename, 'mime': mime, 'size': size, 'manifest_str': row['manifest']}
+                # Assets are immutable, so the manifest itself is a strong validator.
+                etag = '"' + hashlib.blake2b(row['manifest'].encode(), digest_size=16).hexdigest() + '"'
+                last_modified = None
+                if row['created_at']:
+                    try:
+                        created = datetime.datetime.strptime(str(row['created_at']), '%Y-%m-%d %H:%M:%S')
+                        last_modified = email.utils.format_datetime(created.replace(tzinfo=datetime.timezone.utc), usegmt=True)
+                    except ValueError:
+                        pass
+                return {'filename': filename, 'mime': mime, 'size': size, 'manifest_str': row['manifest'],
+                        'manifest': manifest, 'etag': etag, 'last_modified': last_modified}
         except (sqlite3.Error, json.JSONDecodeError) as e:
             logging.error(f"Get asset metadata error: {e}")
             return None
@@ -1838,54 +4211,89 @@ class CompactVaultManager:
                 row = conn.execute("SELECT manifest FROM assets WHERE id=?", (asset_id,)).fetchone()
                 if not row or not row['manifest']:
                     return None
-                return json.loads(row['manifest'])
+                with trace_span('manifest.decode'):
+                    return json.loads(row['manifest'])
         except (sqlite3.Error, json.JSONDecodeError) as e:
             logging.error(f"Get manifest error: {e}")
             return None
 
-    def stream_asset_range(self, asset_id: int, start_byte: int, end_byte: int) -> Iterator[bytes]:
-        # get_manifest is already refactored and uses a read connection
+    def get_range_proof(self, asset_id: int, start_byte: int = 0, end_byte: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        The chunks covering bytes start_byte..end_byte (inclusive) and the
+        Merkle proof tying them to the asset's root, so a client can check a
+        ranged download without fetching the rest. Format 1 manifests get a
+        root computed on the fly ('stored_root' is false).
+        """
         manifest = self.get_manifest(asset_id)
+        if manifest is None:
+            return None
+        leaves = manifest_leaves(manifest)
+        root = manifest.get('merkle_root') or merkle_root(leaves).hex()
+        result: Dict[str, Any] = {'asset_id': asset_id, 'merkle_root': root, 'stored_root': 'merkle_root' in manifest,
+                                  'leaf_count': len(leaves), 'total_size': manifest['total_size']}
+        if not leaves:
+            return dict(result, first_leaf=0, chunks=[], proof=[])
+        if end_byte is None or end_byte >= manifest['total_size']:
+            end_byte = manifest['total_size'] - 1
+        if start_byte > end_byte:
+            raise ValueError('empty range')
+        offsets = self.chunk_offsets(manifest)
+        lo = max(0, bisect.bisect_right(offsets, start_byte) - 1)
+        hi = max(lo + 1, bisect.bisect_right(offsets, end_byte))
+        chunks = [dict(manifest['chain'][i], offset=offsets[i]) for i in range(lo, hi)]
+        return dict(result, first_leaf=lo, chunks=chunks, proof=[h.hex() for h in merkle_range_proof(leaves, lo, hi)])
+
+    @staticmethod
+    def chunk_offsets(manifest: Dict[str, Any]) -> List[int]:
+        """Returns the starting byte offset of every block in the manifest chain."""
+        offsets: List[int] = []
+        pos = 0
+        for block in manifest['chain']:
+            offsets.append(pos)
+            pos += block['size']
+        return offsets
+
+    def stream_asset_range(self, asset_id: int, start_byte: int, end_byte: int,
+                           manifest: Optional[Dict[str, Any]] = None,
+                           offsets: Optional[List[int]] = None) -> Iterator[bytes]:
+        """
+        Yields the bytes start_byte..end_byte (inclusive) of an asset.
+        Callers serving several ranges of one asset pass the parsed manifest
+        and its offsets so each range bisects straight to its first chunk.
+        """
+        if manifest is None:
+            manifest = self.get_manifest(asset_id)
         if not manifest:
             return
 
         total_size = manifest['total_size']
         if end_byte is None or end_byte >= total_size:
             end_byte = total_size - 1
+        if offsets is None:
+            offsets = self.chunk_offsets(manifest)
 
-        current_pos = 0
+        chain = manifest['chain']
+        first = max(0, bisect.bisect_right(offsets, start_byte) - 1)
 
         # This method is a generator, so we must manage the connection lifecycle carefully.
         # We can't use a 'with' statement that would close the connection after the first yield.
         conn = self._get_read_conn()
         try:
-            for block in manifest['chain']:
-                chunk_hash = block['chunk_hash']
+            for idx in range(first, len(chain)):
+                chunk_start = offsets[idx]
+                if chunk_start > end_byte:
+                    break
+                block = chain[idx]
                 chunk_size = block['size']
 
-                chunk_start = current_pos
-                chunk_end = current_pos + chunk_size - 1
+                # No lock needed for reads
+                data = self.read_chunk(conn, block['chunk_hash'], chunk_size, asset_id)
 
-                if chunk_end >= start_byte:
-                    # No lock needed for reads
-                    chunk_row = conn.execute("SELECT data FROM chunks WHERE hash=?", (chunk_hash,)).fetchone()
-
-                    if chunk_row and chunk_row['data']:
-                        try:
-                            data = zlib.decompress(chunk_row['data'])
-
-                            slice_start = max(0, start_byte - chunk_start)
-                            slice_end = min(chunk_size, end_byte - chunk_start + 1)
-
-                            if slice_start < slice_end:
-                                yield data[slice_start:slice_end]
-                        except zlib.error:
-                            logging.error(f"Failed to decompress chunk {chunk_hash} for asset {asset_id}")
-                            continue
+                slice_start = max(0, start_byte - chunk_start)
+                slice_end = min(chunk_size, end_byte - chunk_start + 1)
 
-                current_pos += chunk_size
-                if current_pos > end_byte:
-                    break
+                if slice_start < slice_end:
+                    yield data[slice_start:slice_end]
         finally:
             conn.close()
 
@@ -1896,55 +4304,182 @@ class CompactVaultManager:
         if not manifest:
             return
 
-        conn = self._get_read_conn()
+        conn = self._get_read_conn()
+        try:
+            for block in manifest['chain']:
+                yield self.read_chunk(conn, block['chunk_hash'], block['size'], asset_id)
+        finally:
+            conn.close()
+
+    def read_chunk(self, conn: sqlite3.Connection, chunk_hash: str, size: int, asset_id: int) -> bytes:
+        """
+        Loads and decompresses one chunk of an asset. Anything short of the
+        exact bytes raises ChunkIntegrityError, so a response never goes out
+        silently truncated. With verify_reads on, the content is also
+        re-hashed against its key, unless it was verified since the vault
+        opened.
+        """
+        row = conn.execute("SELECT data FROM chunks WHERE hash=?", (chunk_hash,)).fetchone()
+        if row is None or not row['data']:
+            CHUNK_READ_ERRORS.inc(labels=('missing',))
+            raise ChunkIntegrityError(f"Chunk {chunk_hash} of asset {asset_id} is missing")
+        try:
+            with trace_span('zlib.decompress'):
+                data = zlib.decompress(row['data'])
+        except zlib.error as e:
+            CHUNK_READ_ERRORS.inc(labels=('corrupt',))
+            raise ChunkIntegrityError(f"Chunk {chunk_hash} of asset {asset_id} does not decompress: {e}") from None
+        if len(data) != size:
+            CHUNK_READ_ERRORS.inc(labels=('size',))
+            raise ChunkIntegrityError(f"Chunk {chunk_hash} of asset {asset_id} holds {len(data)} bytes, manifest says {size}")
+        if self.verify_reads:
+            if self.verified_chunks.check(chunk_hash):
+                CHUNK_VERIFY.inc(labels=('cached',))
+            else:
+                with trace_span('chunk.verify'):
+                    digest = hashlib.blake2b(data).hexdigest()
+                if digest != chunk_hash:
+                    CHUNK_READ_ERRORS.inc(labels=('hash',))
+                    raise ChunkIntegrityError(f"Chunk {chunk_hash} of asset {asset_id} fails verification")
+                CHUNK_VERIFY.inc(labels=('hashed',))
+                self.verified_chunks.add(chunk_hash)
+        return data
+
+    def verify_status(self) -> Dict[str, Any]:
+        return {'enabled': self.verify_reads, 'cache': self.verified_chunks.status()}
+
+    def _resolve_export_entries(self, conn: sqlite3.Connection, seed_sql: str, seed_params: Tuple[Any, ...], base_path: str) -> List[Tuple[int, str, int]]:
+        """
+        Resolves (asset_id, path, size) for every asset under the seed collections
+        using three queries, instead of a listing query per collection.
+        Order is deterministic: a collection's assets by filename, then its
+        sub-collections by id, depth first.
+        """
+        tree_sql = f"""
+            WITH RECURSIVE sub(id) AS (
+                {seed_sql}
+                UNION
+                SELECT c.id FROM collections c JOIN sub ON c.parent_id = sub.id
+            )
+        """
+        names: Dict[int, str] = {}
+        children: Dict[Optional[int], List[int]] = defaultdict(list)
+        for row in conn.execute(tree_sql + "SELECT c.id, c.parent_id, c.name FROM collections c JOIN sub ON c.id = sub.id ORDER BY c.id", seed_params):
+            names[row['id']] = row['name'] or ''
+            children[row['parent_id']].append(row['id'])
+
+        assets: Dict[int, List[Tuple[str, int, int]]] = defaultdict(list)
+        asset_sql = tree_sql + """
+            SELECT a.id, a.collection_id, json_extract(a.manifest, '$.total_size') AS size,
+                   COALESCE((SELECT value FROM metadata WHERE asset_id = a.id AND key = 'filename'),
+                            json_extract(a.manifest, '$.filename')) AS filename
+            FROM assets a JOIN sub ON a.collection_id = sub.id
+        """
+        for row in conn.execute(asset_sql, seed_params):
+            if row['filename']:
+                assets[row['collection_id']].append((row['filename'], row['id'], row['size'] or 0))
+
+        results: List[Tuple[int, str, int]] = []
+        roots = [cid for parent, kids in children.items() if parent not in names for cid in kids]
+
+        def walk(collection_id: int, path: str) -> None:
+            current_path = path + names[collection_id] + '/'
+            for filename, asset_id, size in sorted(assets[collection_id]):
+                results.append((asset_id, current_path + filename, size))
+            for sub_id in children.get(collection_id, []):
+                walk(sub_id, current_path)
+
+        for root in sorted(roots):
+            walk(root, base_path)
+        return results
+
+    def resolve_export_entries_for_collection(self, collection_id: int) -> List[Tuple[int, str, int]]:
+        """Gets (asset_id, path, size) for every asset in a collection tree."""
         try:
-            for block in manifest['chain']:
-                chunk_hash = block['chunk_hash']
-                chunk_row = conn.execute("SELECT data FROM chunks WHERE hash=?", (chunk_hash,)).fetchone()
-
-                if chunk_row and chunk_row['data']:
-                    try:
-                        yield zlib.decompress(chunk_row['data'])
-                    except zlib.error:
-                        logging.error(f"Failed to decompress chunk {chunk_hash} for asset {asset_id}")
-                        continue
-        finally:
-            conn.close()
+            with self._get_read_conn() as conn:
+                return self._resolve_export_entries(conn, "SELECT ?", (collection_id,), "")
+        except sqlite3.Error as e:
+            logging.error(f"Resolve collection export error: {e}")
+            return []
 
-    def get_asset_ids_with_paths_for_collection(self, collection_id: int, base_path: str = "") -> List[Tuple[int, str]]:
-        """Recursively gets asset IDs and their zip paths for a collection."""
-        results: List[Tuple[int, str]] = []
-        # These sub-calls now use their own read connections and don't lock.
-        coll = self.get_collection(collection_id)
-        if not coll: return []
+    def resolve_export_entries_for_project(self, project_id: int) -> List[Tuple[int, str, int]]:
+        """Gets (asset_id, path, size) for every asset in a project."""
+        proj = self.get_project(project_id)
+        if not proj: return []
+        try:
+            with self._get_read_conn() as conn:
+                return self._resolve_export_entries(
+                    conn, "SELECT id FROM collections WHERE project_id = ? AND parent_id IS NULL", (project_id,), proj['name'] + '/')
+        except sqlite3.Error as e:
+            logging.error(f"Resolve project export error: {e}")
+            return []
 
-        current_path = base_path + coll['name'] + '/'
+    def resolve_export_entries_for_ids(self, asset_ids: List[int]) -> List[Tuple[int, str, int]]:
+        """Gets (asset_id, filename, size) for an explicit selection, keeping its order."""
+        found: Dict[int, Tuple[str, int]] = {}
+        ids = [int(a) for a in asset_ids]
+        try:
+            with self._get_read_conn() as conn:
+                for i in range(0, len(ids), 500):
+                    batch = ids[i:i + 500]
+                    placeholders = ','.join('?' * len(batch))
+                    sql = f"SELECT id, json_extract(manifest, '$.filename') AS filename, json_extract(manifest, '$.total_size') AS size FROM assets WHERE id IN ({placeholders})"
+                    for row in conn.execute(sql, batch):
+                        found[row['id']] = (row['filename'] or f"asset_{row['id']}", row['size'] or 0)
+        except sqlite3.Error as e:
+            logging.error(f"Resolve selection export error: {e}")
+        return [(aid, found[aid][0], found[aid][1]) for aid in ids if aid in found]
 
-        assets = self.get_assets_for_collection(collection_id, 0, 999999)['assets']
-        for a in assets:
-            if a.get('filename'):
-                results.append((a['id'], current_path + a['filename']))
+    def get_zip_layout(self, scope: str, scope_id: int) -> Optional['ZipLayout']:
+        """
+        Builds (or reuses) the deterministic zip layout of a project or collection.
+        Layouts are cached per write generation, so parallel range requests
+        from download managers share one resolution pass. Returns None while
+        an asset in scope still awaits the CRC backfill; callers then stream.
+        """
+        generation, _ = self.get_generation()
+        key = (scope, scope_id, generation)
+        with self.zip_layouts_lock:
+            layout = self.zip_layouts.get(key)
+            if layout is not None:
+                self.zip_layouts.move_to_end(key)
+                return layout
+
+        if scope == 'project':
+            entries = self.resolve_export_entries_for_project(scope_id)
+        else:
+            entries = self.resolve_export_entries_for_collection(scope_id)
 
+        info: Dict[int, Tuple[Optional[int], Optional[str]]] = {}
+        ids = list({aid for aid, _, _ in entries})
         with self._get_read_conn() as conn:
-            subs = conn.execute("SELECT id FROM collections WHERE parent_id=?", (collection_id,)).fetchall()
-        
-        for sub in subs:
-            results.extend(self.get_asset_ids_with_paths_for_collection(sub['id'], current_path))
-        return results
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                for row in conn.execute(f"SELECT id, crc32, created_at FROM assets WHERE id IN ({placeholders})", batch):
+                    info[row['id']] = (row['crc32'], row['created_at'])
+
+        zip_entries: List[Tuple[int, str, int, int, Tuple[int, int]]] = []
+        for aid, path, size in entries:
+            crc, created_at = info.get(aid, (None, None))
+            if crc is None:
+                return None
+            zip_entries.append((aid, path, size, crc, ZipLayout.dos_datetime(created_at)))
+
+        layout = ZipLayout(zip_entries)
+        with self.zip_layouts_lock:
+            self.zip_layouts[key] = layout
+            while len(self.zip_layouts) > 8:
+                self.zip_layouts.popitem(last=False)
+        return layout
+
+    def get_asset_ids_with_paths_for_collection(self, collection_id: int) -> List[Tuple[int, str]]:
+        """Gets asset IDs and their zip paths for a collection tree."""
+        return [(aid, path) for aid, path, _ in self.resolve_export_entries_for_collection(collection_id)]
 
     def get_asset_ids_with_paths_for_project(self, project_id: int) -> List[Tuple[int, str]]:
         """Gets all asset IDs and their zip paths for a project."""
-        results: List[Tuple[int, str]] = []
-        proj = self.get_project(project_id) # Already refactored
-        if not proj: return []
-        base_path = proj['name'] + '/'
-        
-        with self._get_read_conn() as conn:
-            tops = conn.execute("SELECT id FROM collections WHERE project_id=? AND parent_id IS NULL", (project_id,)).fetchall()
-
-        for top in tops:
-            results.extend(self.get_asset_ids_with_paths_for_collection(top['id'], base_path))
-        return results
+        return [(aid, path) for aid, path, _ in self.resolve_export_entries_for_project(project_id)]
 
     def write_asset_to_zip(self, asset_id: int, zf: zipfile.ZipFile, path_in_zip: str) -> None:
         """Streams an asset's data directly into a ZipFile object."""
@@ -1960,6 +4495,7 @@ class CompactVaultManager:
                 cur = self.conn.cursor()
                 cur.execute('INSERT INTO projects (name, type, description) VALUES (?, ?, ?)', (name, type, description))
                 self.conn.commit()
+                self.bump_generation()
                 return cur.lastrowid
             except sqlite3.Error as e:
                 logging.error(f"Create project error: {e}")
@@ -1973,7 +4509,7 @@ class CompactVaultManager:
                 return [dict(row) for row in cur.fetchall()]
         except sqlite3.Error as e:
             logging.error(f"Get all projects error: {e}")
-            return []
+            raise
 
     def create_collection(self, project_id: int, name: str, type: str, parent_id: Optional[int]) -> int:
         with self.lock:
@@ -1981,6 +4517,7 @@ class CompactVaultManager:
                 cur = self.conn.cursor()
                 cur.execute('INSERT INTO collections (project_id, name, type, parent_id) VALUES (?, ?, ?, ?)', (project_id, name, type, parent_id))
                 self.conn.commit()
+                self.bump_generation()
                 return cur.lastrowid
             except sqlite3.Error as e:
                 logging.error(f"Create collection error: {e}")
@@ -1993,7 +4530,7 @@ class CompactVaultManager:
                 return [dict(row) for row in cur.fetchall()]
         except sqlite3.Error as e:
             logging.error(f"Get collections for project error: {e}")
-            return []
+            raise
 
     def get_project(self, project_id: int) -> Optional[Dict[str, Any]]:
         try:
@@ -2018,57 +4555,30 @@ class CompactVaultManager:
     def get_asset_preview(self, asset_id: int) -> Optional[Dict[str, Any]]:
         try:
             with self._get_read_conn() as conn:
+                # Text previews are precomputed at ingest: one indexed row, no chunk reads.
+                row = conn.execute('SELECT a.id, a.type, a.format, p.size, p.encoding, p.line_count, p.truncated, p.content, (SELECT value FROM metadata m WHERE m.asset_id=a.id AND m.key="filename" LIMIT 1) as filename FROM assets a LEFT JOIN asset_previews p ON p.asset_id = a.id WHERE a.id = ?', (asset_id,)).fetchone()
+                if not row: return None
+                if row['content'] is not None:
+                    text = zlib.decompress(row['content']).decode('utf-8')
+                    return self._text_preview(asset_id, row['format'], row['filename'] or f'asset_{asset_id}', row['size'],
+                                              text, row['line_count'], bool(row['truncated']), row['encoding'])
+
                 row = conn.execute('SELECT a.id, a.type, a.format, a.manifest, (SELECT value FROM metadata m WHERE m.asset_id=a.id AND m.key="filename" LIMIT 1) as filename FROM assets a WHERE a.id = ?', (asset_id,)).fetchone()
                 if not row: return None
-                manifest = json.loads(row['manifest'])
+                with trace_span('manifest.decode'):
+                    manifest = json.loads(row['manifest'])
                 filename = manifest.get('filename', f'asset_{asset_id}')
                 size = manifest.get('total_size', 0)
 
-                # === OPTIMIZATION START ===
                 if row['type'] == 'text':
-                    MAX_PREVIEW_SIZE = 32 * 1024  # Limit preview to 32KB
-                    data = bytearray()
-                    is_truncated = False
-                    
-                    for block in manifest['chain']:
-                        # Stop if we have enough data for a preview
-                        if len(data) >= MAX_PREVIEW_SIZE:
-                            is_truncated = True
-                            break
-                            
-                        chunk_hash = block['chunk_hash']
-                        chunk_row = conn.execute("SELECT data FROM chunks WHERE hash=?", (chunk_hash,)).fetchone()
-                        if chunk_row: 
-                            decompressed = zlib.decompress(chunk_row['data'])
-                            data.extend(decompressed)
-                    
-                    # Trim to exact limit if we went over
-                    if len(data) > MAX_PREVIEW_SIZE:
-                        data = data[:MAX_PREVIEW_SIZE]
-                        is_truncated = True
-
-                    text = data.decode('utf-8', errors='ignore')
-                    
-                    if is_truncated:
-                        text += "\n\n... [PREVIEW TRUNCATED AT 32KB] ... Download to view full file."
-
-                    # Basic formatting for code files
-                    if row['format'] == 'json' and not is_truncated:
-                        try: text = json.dumps(json.loads(text), indent=2)
-                        except: pass
-                    
-                    return {
-                        'id': asset_id, 
-                        'type': 'text', 
-                        'format': row['format'], 
-                        'filename': filename, 
-                        'size_original': size, 
-                        'content': text
-                    }
-                # === OPTIMIZATION END ===
-                
+                    # Not backfilled yet: build the same preview from the chunks.
+                    head = self._read_preview_head(conn, manifest, asset_id)
+                    return self._text_preview(asset_id, row['format'], filename, size,
+                                              *build_text_preview(head, size, row['format']))
                 else:
                     return {'id':asset_id, 'type':row['type'], 'format':row['format'], 'filename':filename, 'size_original':size}
+        except ChunkIntegrityError:
+            raise
         except sqlite3.Error as e:
             logging.error(f"Preview error: {e}")
             return None
@@ -2076,11 +4586,1582 @@ class CompactVaultManager:
             logging.error(f"Unexpected preview error: {e}")
             return None
 
-    def vacuum(self) -> None:
-        """Optimizes the database file."""
-        with self.lock:
-            self.conn.execute("VACUUM;")
-            self.conn.commit()
+    def _read_preview_head(self, conn: sqlite3.Connection, manifest: Dict[str, Any], asset_id: int) -> bytes:
+        """The first PREVIEW_MAX_BYTES of an asset, read chunk by chunk through read_chunk."""
+        data = bytearray()
+        for block in manifest['chain']:
+            if len(data) >= PREVIEW_MAX_BYTES:
+                break
+            data.extend(self.read_chunk(conn, block['chunk_hash'], block['size'], asset_id))
+        return bytes(data[:PREVIEW_MAX_BYTES])
+
+    @staticmethod
+    def _text_preview(asset_id: int, fmt: str, filename: str, size: int, text: str, line_count: int,
+                      truncated: bool, encoding: str) -> Dict[str, Any]:
+        if truncated:
+            text += "\n\n... [PREVIEW TRUNCATED AT 32KB] ... Download to view full file."
+        return {
+            'id': asset_id,
+            'type': 'text',
+            'format': fmt,
+            'filename': filename,
+            'size_original': size,
+            'content': text,
+            'line_count': line_count,
+            'truncated': truncated,
+            'encoding': encoding
+        }
+
+    def vacuum(self) -> None:
+        """
+        Rewrites the whole database file (offline: blocks all writes while it
+        runs). Routine reclamation is handled online by SpaceReclaimer.
+        """
+        with self.lock:
+            self.conn.execute("VACUUM;")
+            self.conn.commit()
+
+
+class ExportPipeline:
+    """
+    Prefetching reader for bulk exports.
+    A planner walks the resolved entries in order, loading manifests in
+    batches, and splits every asset into read tasks of a few MB. Tasks run on
+    a worker pool (fetch + decompress) while the single consumer drains them
+    in order, so output stays deterministic and the bytes held in flight
+    never exceed max_buffer_bytes.
+    """
+
+    TASK_BYTES = 4 * 1048576
+    MANIFEST_BATCH = 256
+    PROGRESS_INTERVAL = 5.0
+
+    def __init__(self, manager: 'CompactVaultManager', entries: List[Tuple[int, str, int]], label: str = 'export',
+                 workers: Optional[int] = None, max_buffer_bytes: int = 64 * 1048576) -> None:
+        self.manager = manager
+        self.entries = entries
+        self.label = label
+        self.workers = workers or min(8, (os.cpu_count() or 4))
+        self.max_buffer_bytes = max_buffer_bytes
+        self.files_total = len(entries)
+        self.bytes_total = sum(size for _, _, size in entries)
+        self.files_done = 0
+        self.bytes_done = 0
+        self.started = 0.0
+        self.finished: Optional[float] = None
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    def progress(self) -> Dict[str, Any]:
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        return {
+            'label': self.label,
+            'files_done': self.files_done,
+            'files_total': self.files_total,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'elapsed': round(elapsed, 3),
+            'mb_per_s': round(self.bytes_done / elapsed / 1048576, 2) if elapsed > 0 else 0.0,
+            'finished': self.finished is not None,
+        }
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.manager._get_read_conn()
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _read_task(self, asset_id: int, blocks: List[Tuple[str, int]]) -> List[bytes]:
+        conn = self._conn()
+        return [self.manager.read_chunk(conn, chunk_hash, size, asset_id) for chunk_hash, size in blocks]
+
+    def _plan(self) -> Iterator[Tuple[int, List[Tuple[List[Tuple[str, int]], int]]]]:
+        """Yields (entry index, [((chunk hash, size), ...), task bytes), ...]) in entry order."""
+        conn = self.manager._get_read_conn()
+        try:
+            for i in range(0, len(self.entries), self.MANIFEST_BATCH):
+                batch = self.entries[i:i + self.MANIFEST_BATCH]
+                ids = list({aid for aid, _, _ in batch})
+                placeholders = ','.join('?' * len(ids))
+                manifests = {row['id']: row['manifest'] for row in
+                             conn.execute(f"SELECT id, manifest FROM assets WHERE id IN ({placeholders})", ids)}
+                for offset, (aid, _, _) in enumerate(batch):
+                    chain = json.loads(manifests[aid])['chain'] if manifests.get(aid) else []
+                    tasks: List[Tuple[List[Tuple[str, int]], int]] = []
+                    hashes: List[Tuple[str, int]] = []
+                    task_bytes = 0
+                    for block in chain:
+                        hashes.append((block['chunk_hash'], block['size']))
+                        task_bytes += block['size']
+                        if task_bytes >= self.TASK_BYTES:
+                            tasks.append((hashes, task_bytes))
+                            hashes, task_bytes = [], 0
+                    if hashes:
+                        tasks.append((hashes, task_bytes))
+                    yield i + offset, tasks
+        finally:
+            conn.close()
+
+    def _refill(self) -> None:
+        """Submits planned read tasks until the in-flight byte budget is spent."""
+        while self._plan_iter is not None:
+            if self._pending is None:
+                try:
+                    idx, tasks = next(self._plan_iter)
+                except StopIteration:
+                    self._plan_iter = None
+                    return
+                if not tasks:
+                    self._inflight.append((idx, None, 0))
+                    continue
+                self._pending = (idx, deque(tasks))
+            idx, tasks = self._pending
+            while tasks:
+                hashes, nbytes = tasks[0]
+                # At least one task is always allowed in flight so huge chunks still progress.
+                if self._inflight and self._buffered + nbytes > self.max_buffer_bytes:
+                    return
+                tasks.popleft()
+                self._inflight.append((idx, self._pool.submit(self._read_task, self.entries[idx][0], hashes), nbytes))
+                self._buffered += nbytes
+            self._pending = None
+
+    def _entry_data(self, idx: int) -> Iterator[bytes]:
+        while True:
+            if not self._inflight:
+                self._refill()
+            if not self._inflight or self._inflight[0][0] != idx:
+                return
+            _, future, nbytes = self._inflight.popleft()
+            parts = future.result() if future is not None else []
+            self._buffered -= nbytes
+            self._refill()
+            for part in parts:
+                self.bytes_done += len(part)
+                yield part
+
+    def _log_progress(self, prefix: str) -> None:
+        p = self.progress()
+        logging.info(f"{prefix} {self.label}: {p['files_done']}/{p['files_total']} files, "
+                     f"{p['bytes_done'] / 1048576:.1f}/{p['bytes_total'] / 1048576:.1f} MB "
+                     f"in {p['elapsed']:.1f}s ({p['mb_per_s']} MB/s)")
+
+    def __iter__(self) -> Iterator[Tuple[str, int, Iterator[bytes]]]:
+        """
+        Yields (path, size, data iterator) per entry, in order. Each data
+        iterator must be fully consumed before advancing to the next entry.
+        """
+        self.started = time.monotonic()
+        last_report = self.started
+        self.manager.active_exports[id(self)] = self
+        self._plan_iter: Optional[Iterator[Tuple[int, List[Tuple[List[str], int]]]]] = self._plan()
+        self._pending: Optional[Tuple[int, 'deque[Tuple[List[str], int]]']] = None
+        # FIFO of (entry index, future, task bytes); entries without data carry a None future.
+        self._inflight: 'deque[Tuple[int, Optional[concurrent.futures.Future], int]]' = deque()
+        self._buffered = 0
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export')
+        try:
+            self._refill()
+            for idx, (_, path, size) in enumerate(self.entries):
+                yield path, size, self._entry_data(idx)
+                self.files_done += 1
+
+                now = time.monotonic()
+                if now - last_report >= self.PROGRESS_INTERVAL:
+                    last_report = now
+                    self._log_progress("Export")
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            if self._plan_iter is not None:
+                self._plan_iter.close()
+            for conn in self._conns:
+                conn.close()
+            self.finished = time.monotonic()
+            self.manager.active_exports.pop(id(self), None)
+            self._log_progress("Export finished")
+
+    def write_zip(self, fileobj: Any) -> None:
+        """Writes every entry into a ZIP_STORED archive on fileobj, in order."""
+        with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for path, size, data in self:
+                info = zipfile.ZipInfo(path, time.localtime())
+                info.compress_type = zipfile.ZIP_STORED
+                # Declaring the size up front lets zipfile pick ZIP64 for huge members.
+                info.file_size = size
+                with zf.open(info, 'w') as asset_file:
+                    for part in data:
+                        asset_file.write(part)
+
+    def write_tar(self, fileobj: Any, codec: Optional[str] = None) -> None:
+        """
+        Streams every entry as a POSIX/PAX tar onto fileobj, optionally
+        compressed with one of TAR_CODECS. Tar has no trailing index, so
+        memory stays flat however many entries are exported.
+        """
+        compressor = TAR_CODECS[codec][2]() if codec else None
+        out = bytearray()
+        mtime = int(time.time())
+
+        def emit(data: bytes) -> None:
+            if compressor is not None:
+                data = compressor.compress(data)
+            out.extend(data)
+            if len(out) >= 256 * 1024:
+                fileobj.write(out)
+                out.clear()
+
+        for path, size, data in self:
+            info = tarfile.TarInfo(path)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            emit(info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape'))
+            written = 0
+            for part in data:
+                written += len(part)
+                emit(part)
+            if written != size:
+                raise IOError(f"Export entry {path} returned {written} bytes, expected {size}")
+            if size % tarfile.BLOCKSIZE:
+                emit(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+
+        emit(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        if compressor is not None:
+            out.extend(compressor.flush())
+        if out:
+            fileobj.write(out)
+
+
+# format -> (Content-Type, file extension, compressor factory); None factory means plain tar.
+TAR_CODECS: Dict[str, Tuple[str, str, Any]] = {
+    'tar.gz': ('application/gzip', 'tar.gz', lambda: zlib.compressobj(6, zlib.DEFLATED, 31)),
+    'tar.bz2': ('application/x-bzip2', 'tar.bz2', lambda: bz2.BZ2Compressor(6)),
+    'tar.xz': ('application/x-xz', 'tar.xz', lambda: lzma.LZMACompressor(preset=1)),
+}
+if zstd is not None:
+    TAR_CODECS['tar.zst'] = ('application/zstd', 'tar.zst', lambda: zstd.ZstdCompressor())
+
+
+class ZipLayout:
+    """
+    Byte-exact layout of a ZIP_STORED archive over immutable assets.
+    Every header is precomputed from recorded sizes, CRC32s and creation
+    times, so the archive has a fixed length and any byte offset maps back to
+    either a header slice or a range of one asset.
+    """
+
+    ZIP32_LIMIT = 0xFFFFFFFF
+    ZIP32_MAX_ENTRIES = 0xFFFF
+
+    def __init__(self, entries: List[Tuple[int, str, int, int, Tuple[int, int]]]) -> None:
+        """entries: (asset_id, path, size, crc32, (dos_time, dos_date)) in archive order."""
+        self.entries = entries
+        # Parallel lists: segment start offsets and (header bytes, asset_id, length).
+        self.offsets: List[int] = []
+        self.segments: List[Tuple[Optional[bytes], int, int]] = []
+        self.local_headers: List[bytes] = []
+        central = bytearray()
+        pos = 0
+        for asset_id, path, size, crc, (dos_time, dos_date) in entries:
+            name = path.encode('utf-8')
+            flags = 0x0800 if not path.isascii() else 0
+            zip64_size = size >= self.ZIP32_LIMIT
+            zip64_offset = pos >= self.ZIP32_LIMIT
+            version = 45 if (zip64_size or zip64_offset) else 20
+
+            local_extra = struct.pack('<HHQQ', 0x0001, 16, size, size) if zip64_size else b''
+            size32 = 0xFFFFFFFF if zip64_size else size
+            local = struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, 0, dos_time, dos_date,
+                                crc, size32, size32, len(name), len(local_extra)) + name + local_extra
+            local_offset = pos
+            self.local_headers.append(local)
+            self._add(pos, local, 0, len(local))
+            pos += len(local)
+            self._add(pos, None, asset_id, size)
+
+            extra_fields = b''
+            if zip64_size:
+                extra_fields += struct.pack('<QQ', size, size)
+            if zip64_offset:
+                extra_fields += struct.pack('<Q', local_offset)
+            central_extra = struct.pack('<HH', 0x0001, len(extra_fields)) + extra_fields if extra_fields else b''
+            offset32 = 0xFFFFFFFF if zip64_offset else local_offset
+            central += struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, flags, 0, dos_time, dos_date,
+                                   crc, size32, size32, len(name), len(central_extra), 0, 0, 0, 0, offset32)
+            central += name + central_extra
+            pos += size
+
+        cd_offset, cd_size, count = pos, len(central), len(entries)
+        tail = bytearray(central)
+        if count >= self.ZIP32_MAX_ENTRIES or cd_offset >= self.ZIP32_LIMIT or cd_size >= self.ZIP32_LIMIT:
+            zip64_eocd_offset = cd_offset + cd_size
+            tail += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+            tail += struct.pack('<IIQI', 0x07064b50, 0, zip64_eocd_offset, 1)
+            tail += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0)
+        else:
+            tail += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+        self.tail = bytes(tail)
+        self._add(pos, self.tail, 0, len(tail))
+        self.total_size = pos + len(tail)
+        # The central directory covers every path, size, CRC and offset.
+        self.etag = '"zip-' + hashlib.blake2b(bytes(tail), digest_size=16).hexdigest() + '"'
+
+    def _add(self, start: int, header: Optional[bytes], asset_id: int, length: int) -> None:
+        if length:
+            self.offsets.append(start)
+            self.segments.append((header, asset_id, length))
+
+    @staticmethod
+    def dos_datetime(created_at: Optional[str]) -> Tuple[int, int]:
+        """Converts a SQLite CURRENT_TIMESTAMP string into (dos_time, dos_date)."""
+        try:
+            t = datetime.datetime.strptime(str(created_at), '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            t = datetime.datetime(1980, 1, 1)
+        if t.year < 1980:
+            t = datetime.datetime(1980, 1, 1)
+        return (t.hour << 11) | (t.minute << 5) | (t.second // 2), ((t.year - 1980) << 9) | (t.month << 5) | t.day
+
+    def iter_range(self, manager: 'CompactVaultManager', start: int, end: int) -> Iterator[bytes]:
+        """Yields bytes start..end (inclusive) of the virtual archive."""
+        idx = max(0, bisect.bisect_right(self.offsets, start) - 1)
+        while idx < len(self.segments) and self.offsets[idx] <= end:
+            seg_start = self.offsets[idx]
+            header, asset_id, length = self.segments[idx]
+            lo = max(start, seg_start) - seg_start
+            hi = min(end, seg_start + length - 1) - seg_start
+            if header is not None:
+                yield header[lo:hi + 1]
+            else:
+                sent = 0
+                for part in manager.stream_asset_range(asset_id, lo, hi):
+                    sent += len(part)
+                    yield part
+                if sent != hi - lo + 1:
+                    raise IOError(f"Asset {asset_id} returned {sent} bytes for a {hi - lo + 1} byte range")
+            idx += 1
+
+    def iter_full(self, manager: 'CompactVaultManager', label: str = 'export') -> Iterator[bytes]:
+        """Yields the whole archive, reading asset data through the prefetching pipeline."""
+        pipeline = ExportPipeline(manager, [(aid, path, size) for aid, path, size, _, _ in self.entries], label=label)
+        for (path, size, data), local in zip(pipeline, self.local_headers):
+            yield local
+            sent = 0
+            for part in data:
+                sent += len(part)
+                yield part
+            if sent != size:
+                raise IOError(f"Export entry {path} returned {sent} bytes, expected {size}")
+        yield self.tail
+
+
+class IntegrityScrubber:
+    """
+    Background verifier for the chunk store and manifests.
+    Chunks are re-read in rowid order, decompressed and re-hashed against
+    their key; manifests are checked against their stored Merkle root (or,
+    for format 1, re-walked to check every previous_hash link) and for
+    every referenced chunk existing. Hashing and decompression run on a
+    thread pool (both release the GIL on large buffers). Progress is
+    checkpointed to vault_properties so an interrupted run resumes after a
+    restart, and the high-water marks of the last completed run make
+    incremental passes cover only what was ingested since.
+    """
+
+    STATE_KEY = 'scrub_state'
+    BATCH_ROWS = 64
+    CHECKPOINT_INTERVAL = 5.0
+
+    def __init__(self, manager: 'CompactVaultManager') -> None:
+        self.manager = manager
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.state: Dict[str, Any] = self._load_state()
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    # -- persistence --
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with self.manager._get_read_conn() as conn:
+                row = conn.execute("SELECT value FROM vault_properties WHERE key = ?", (self.STATE_KEY,)).fetchone()
+                if row and row['value']:
+                    return json.loads(row['value'])
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            logging.error(f"Scrub state load error: {e}")
+        return {'state': 'idle', 'last_completed': None}
+
+    def _save_state(self) -> None:
+        with self.manager.lock:
+            self.manager.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)",
+                                      (self.STATE_KEY, json.dumps(self.state)))
+            self.manager.conn.commit()
+
+    def _record_failures(self, failures: List[Tuple[str, str, str]]) -> None:
+        if not failures:
+            return
+        for kind, ref, error in failures:
+            logging.error(f"Scrub failure [{kind}] {ref}: {error}")
+            if kind == 'chunk':
+                # Verify-on-read must hash this chunk again rather than trust an earlier pass.
+                self.manager.verified_chunks.discard(ref)
+        with self.manager.lock:
+            self.manager.conn.executemany(
+                "INSERT INTO scrub_failures (run_started, kind, ref, error) VALUES (?, ?, ?, ?)",
+                [(self.state.get('started_at'), kind, ref, error) for kind, ref, error in failures])
+            self.manager.conn.commit()
+        self.state['failures'] = self.state.get('failures', 0) + len(failures)
+
+    # -- control --
+
+    def start(self, incremental: bool = False, io_limit_mb: float = 0, cpu_fraction: float = 0.5,
+              workers: Optional[int] = None) -> bool:
+        """Starts a run; returns False if one is already active."""
+        if self.thread and self.thread.is_alive():
+            return False
+        with self.manager._get_read_conn() as conn:
+            chunk_end = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM chunks").fetchone()[0]
+            asset_end = conn.execute("SELECT COALESCE(MAX(id), 0) FROM assets").fetchone()[0]
+        last = self.state.get('last_completed') if incremental else None
+        self.state = {
+            'state': 'running',
+            'mode': 'incremental' if incremental else 'full',
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'chunk_cursor': last['chunk_high_water'] if last else 0,
+            'asset_cursor': last['asset_high_water'] if last else 0,
+            'chunk_end': chunk_end,
+            'asset_end': asset_end,
+            'chunks_checked': 0,
+            'assets_checked': 0,
+            'bytes_checked': 0,
+            'failures': 0,
+            'options': {'io_limit_mb': io_limit_mb, 'cpu_fraction': cpu_fraction, 'workers': workers},
+            'last_completed': self.state.get('last_completed'),
+        }
+        self._save_state()
+        self._launch()
+        return True
+
+    def resume_if_interrupted(self) -> None:
+        if self.state.get('state') == 'running':
+            logging.info(f"Resuming interrupted {self.state.get('mode')} integrity scrub")
+            self._launch()
+
+    def resume(self) -> bool:
+        if self.state.get('state') != 'paused' or (self.thread and self.thread.is_alive()):
+            return False
+        self.state['state'] = 'running'
+        self._save_state()
+        self._launch()
+        return True
+
+    def stop(self) -> None:
+        """Pauses the active run at its next checkpoint; the cursor is kept for resume()."""
+        if self.thread and self.thread.is_alive():
+            self.stop_event.set()
+            self.thread.join()
+
+    def _launch(self) -> None:
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='integrity-scrub', daemon=True)
+        self.thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        st = dict(self.state)
+        st['active'] = bool(self.thread and self.thread.is_alive())
+        return st
+
+    def report(self, limit: int = 100) -> Dict[str, Any]:
+        with self.manager._get_read_conn() as conn:
+            rows = conn.execute("SELECT run_started, kind, ref, error, detected_at FROM scrub_failures ORDER BY id DESC LIMIT ?",
+                                (limit,)).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM scrub_failures").fetchone()[0]
+        return {'status': self.status(), 'failures_total': total, 'failures': [dict(r) for r in rows]}
+
+    # -- verification --
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.manager._get_read_conn()
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    @staticmethod
+    def _verify_chunks(rows: List[Tuple[str, bytes]]) -> List[Tuple[str, str, str]]:
+        failures = []
+        for chunk_hash, blob in rows:
+            try:
+                data = zlib.decompress(blob)
+            except (zlib.error, TypeError) as e:
+                failures.append(('chunk', chunk_hash, f'decompress failed: {e}'))
+                continue
+            if hashlib.blake2b(data).hexdigest() != chunk_hash:
+                failures.append(('chunk', chunk_hash, 'hash mismatch'))
+        return failures
+
+    def _verify_manifests(self, rows: List[Tuple[int, Optional[str]]]) -> List[Tuple[str, str, str]]:
+        failures = []
+        conn = self._conn()
+        for asset_id, manifest_str in rows:
+            ref = f'asset {asset_id}'
+            try:
+                manifest = json.loads(manifest_str) if manifest_str else None
+            except json.JSONDecodeError as e:
+                failures.append(('manifest', ref, f'unparseable manifest: {e}'))
+                continue
+            if not manifest or 'chain' not in manifest:
+                failures.append(('manifest', ref, 'missing manifest'))
+                continue
+            total = 0
+            if manifest.get('version', 1) >= 2:
+                try:
+                    intact = merkle_root(manifest_leaves(manifest)).hex() == manifest.get('merkle_root')
+                except (KeyError, ValueError, TypeError, AttributeError):
+                    intact = False
+                total = sum(b.get('size', 0) for b in manifest['chain'])
+                if not intact:
+                    failures.append(('manifest', ref, 'merkle root mismatch'))
+            else:
+                previous: Optional[str] = None
+                intact = True
+                for i, block in enumerate(manifest['chain']):
+                    if block.get('previous_hash') != previous:
+                        failures.append(('manifest', ref, f'chain broken at block {i}'))
+                        intact = False
+                        break
+                    previous = hashlib.blake2b(json.dumps(block, sort_keys=True).encode()).hexdigest()
+                    total += block.get('size', 0)
+            if intact:
+                if total != manifest.get('total_size'):
+                    failures.append(('manifest', ref, f'total_size {manifest.get("total_size")} != sum of blocks {total}'))
+            hashes = list({b['chunk_hash'] for b in manifest['chain']})
+            present = set()
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                present.update(r[0] for r in conn.execute(f"SELECT hash FROM chunks WHERE hash IN ({placeholders})", batch))
+            missing = len(hashes) - len(present)
+            if missing:
+                failures.append(('manifest', ref, f'{missing} referenced chunk(s) missing'))
+        return failures
+
+    def _throttle(self, batch_started: float, run_started: float) -> None:
+        """Sleeps to hold the CPU duty cycle and the compressed-bytes read rate under their limits."""
+        opts = self.state.get('options', {})
+        cpu_fraction = opts.get('cpu_fraction') or 1.0
+        if 0 < cpu_fraction < 1:
+            busy = time.monotonic() - batch_started
+            self.stop_event.wait(busy * (1 - cpu_fraction) / cpu_fraction)
+        io_limit = (opts.get('io_limit_mb') or 0) * 1048576
+        if io_limit > 0:
+            ahead = self._run_bytes / io_limit - (time.monotonic() - run_started)
+            if ahead > 0:
+                self.stop_event.wait(ahead)
+
+    def _run(self) -> None:
+        st = self.state
+        workers = st.get('options', {}).get('workers') or (os.cpu_count() or 4)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scrub')
+        read_conn = self.manager._get_read_conn()
+        run_started = time.monotonic()
+        last_checkpoint = run_started
+        self._run_bytes = 0
+        try:
+            phases = [
+                ('chunk_cursor', 'chunk_end', "SELECT rowid, hash, data FROM chunks WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?"),
+                ('asset_cursor', 'asset_end', "SELECT id, manifest FROM assets WHERE id > ? AND id <= ? ORDER BY id LIMIT ?"),
+            ]
+            for cursor_key, end_key, sql in phases:
+                is_chunks = cursor_key == 'chunk_cursor'
+                while not self.stop_event.is_set():
+                    batch_started = time.monotonic()
+                    # One pool-sized round of batches: read here, verify on the pool.
+                    futures = []
+                    for _ in range(workers):
+                        rows = read_conn.execute(sql, (st[cursor_key], st[end_key], self.BATCH_ROWS)).fetchall()
+                        if not rows:
+                            break
+                        st[cursor_key] = rows[-1][0]
+                        if is_chunks:
+                            nbytes = sum(len(r['data'] or b'') for r in rows)
+                            self._run_bytes += nbytes
+                            st['bytes_checked'] += nbytes
+                            st['chunks_checked'] += len(rows)
+                            futures.append(pool.submit(self._verify_chunks, [(r['hash'], r['data']) for r in rows]))
+                        else:
+                            st['assets_checked'] += len(rows)
+                            futures.append(pool.submit(self._verify_manifests, [(r['id'], r['manifest']) for r in rows]))
+                    if not futures:
+                        break
+                    failures = [f for fut in futures for f in fut.result()]
+                    self._record_failures(failures)
+
+                    now = time.monotonic()
+                    if now - last_checkpoint >= self.CHECKPOINT_INTERVAL:
+                        last_checkpoint = now
+                        self._save_state()
+                    self._throttle(batch_started, run_started)
+
+            if self.stop_event.is_set():
+                st['state'] = 'paused'
+                logging.info(f"Integrity scrub paused at chunk {st['chunk_cursor']}, asset {st['asset_cursor']}")
+            else:
+                st['state'] = 'completed'
+                st['finished_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+                st['last_completed'] = {'finished_at': st['finished_at'], 'mode': st['mode'],
+                                        'chunk_high_water': st['chunk_end'], 'asset_high_water': st['asset_end'],
+                                        'failures': st['failures']}
+                logging.info(f"Integrity scrub completed: {st['chunks_checked']} chunks, {st['assets_checked']} assets, "
+                             f"{st['failures']} failures in {time.monotonic() - run_started:.1f}s")
+            self._save_state()
+        except Exception as e:
+            logging.error(f"Integrity scrub error: {e}")
+            st['state'] = 'paused'
+            st['error'] = str(e)
+            try: self._save_state()
+            except sqlite3.Error: pass
+        finally:
+            pool.shutdown(wait=True)
+            read_conn.close()
+            with self._conns_lock:
+                for conn in self._conns:
+                    conn.close()
+                self._conns.clear()
+            self._local = threading.local()
+
+
+class SpaceReclaimer:
+    """
+    Online alternative to a full VACUUM.
+    On vaults with auto_vacuum=INCREMENTAL a maintenance thread trims the
+    freelist with PRAGMA incremental_vacuum in small steps, each holding the
+    write lock only for a fraction of STEP_BUDGET, so ingest interleaves
+    freely. Older vaults can be converted online: a VACUUM INTO snapshot is
+    built while writes continue, then swapped in during a short pause once
+    readers have drained and no write has landed since the snapshot.
+    """
+
+    INTERVAL = 30.0
+    MIN_FREE_PAGES = 256
+    STEP_BUDGET = 0.05
+    RUN_BUDGET = 2.0
+    MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+    def __init__(self, manager: 'CompactVaultManager') -> None:
+        self.manager = manager
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.step_pages = 128
+        self.reclaimed_pages = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.conversion: Dict[str, Any] = {'state': 'idle'}
+        self.convert_thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name='space-reclaimer', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        for t in (self.thread, self.convert_thread):
+            if t and t.is_alive():
+                t.join()
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.INTERVAL):
+            try:
+                self.reclaim()
+            except sqlite3.Error as e:
+                logging.error(f"Incremental vacuum error: {e}")
+
+    def mode(self) -> str:
+        with self.manager._get_read_conn() as conn:
+            return self.MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 'unknown')
+
+    def reclaim(self, budget: Optional[float] = None, force: bool = False) -> int:
+        """Runs time-boxed incremental_vacuum steps; returns the number of pages freed."""
+        if self.mode() != 'incremental':
+            return 0
+        started = time.monotonic()
+        deadline = started + (budget or self.RUN_BUDGET)
+        freed = 0
+        steps = 0
+        conn = self.manager.conn
+        while time.monotonic() < deadline and not self.stop_event.is_set():
+            with self.manager.lock:
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if before == 0 or (steps == 0 and not force and before < self.MIN_FREE_PAGES):
+                    break
+                t0 = time.monotonic()
+                # executescript steps the pragma to completion; execute() would free one page.
+                conn.executescript(f"PRAGMA incremental_vacuum({int(self.step_pages)});")
+                took = time.monotonic() - t0
+                after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            freed += before - after
+            steps += 1
+            # Keep each step near the budget so writers never wait long for the lock.
+            if took > self.STEP_BUDGET and self.step_pages > 8:
+                self.step_pages //= 2
+            elif took < self.STEP_BUDGET / 4 and self.step_pages < 8192:
+                self.step_pages *= 2
+            time.sleep(0)
+        if steps:
+            self.reclaimed_pages += freed
+            self.last_run = {'at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                             'pages_freed': freed, 'steps': steps, 'seconds': round(time.monotonic() - started, 3)}
+            logging.info(f"Incremental vacuum freed {freed} pages in {steps} steps")
+        return freed
+
+    def estimate(self) -> Dict[str, Any]:
+        with self.manager._get_read_conn() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            mode = self.MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 'unknown')
+        return {
+            'auto_vacuum': mode,
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': free,
+            'reclaimable_bytes': free * page_size,
+            'database_bytes': page_count * page_size,
+            'step_pages': self.step_pages,
+            'reclaimed_pages_total': self.reclaimed_pages,
+            'last_run': self.last_run,
+            'conversion': dict(self.conversion),
+        }
+
+    def convert_online(self) -> bool:
+        """Starts converting a non-incremental vault; returns False if not applicable or running."""
+        if self.convert_thread and self.convert_thread.is_alive():
+            return False
+        if self.mode() == 'incremental':
+            return False
+        self.conversion = {'state': 'running', 'attempts': 0}
+        self.convert_thread = threading.Thread(target=self._convert, name='vacuum-convert', daemon=True)
+        self.convert_thread.start()
+        return True
+
+    def _convert(self, max_attempts: int = 5, drain_timeout: float = 30.0) -> None:
+        manager = self.manager
+        tmp = manager.db_path.with_name(manager.db_path.name + '.converting')
+        try:
+            for attempt in range(1, max_attempts + 1):
+                if self.stop_event.is_set():
+                    break
+                self.conversion['attempts'] = attempt
+                if tmp.exists():
+                    tmp.unlink()
+                with manager.lock:
+                    changes = manager.conn.total_changes
+
+                # The rewrite reads a snapshot, so writers keep going meanwhile.
+                self.conversion['phase'] = 'snapshot'
+                t0 = time.monotonic()
+                src = manager._get_read_conn()
+                try:
+                    src.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    src.execute("VACUUM INTO ?", (str(tmp),))
+                finally:
+                    src.close()
+                self.conversion['snapshot_seconds'] = round(time.monotonic() - t0, 3)
+
+                self.conversion['phase'] = 'swap'
+                if self._swap(tmp, changes, drain_timeout):
+                    self.conversion.update(state='completed', phase=None)
+                    logging.info(f"Vault converted to incremental auto_vacuum after {attempt} attempt(s)")
+                    return
+                logging.info("Vacuum conversion swap deferred (writes or readers active); retrying")
+                self.stop_event.wait(self.INTERVAL)
+            self.conversion.update(state='failed', phase=None, error='vault never quiesced long enough to swap')
+        except (sqlite3.Error, OSError) as e:
+            logging.error(f"Vacuum conversion error: {e}")
+            self.conversion.update(state='failed', phase=None, error=str(e))
+        finally:
+            if tmp.exists():
+                try: tmp.unlink()
+                except OSError: pass
+
+    def _swap(self, tmp: pathlib.Path, changes: int, drain_timeout: float) -> bool:
+        manager = self.manager
+        scrub_was_active = manager.scrubber.status()['active']
+        if scrub_was_active:
+            manager.scrubber.stop()
+        try:
+            if not manager.read_gate.drain(drain_timeout):
+                return False
+            try:
+                # A writer in progress would invalidate the snapshot anyway; back
+                # off rather than hold readers out while waiting for it.
+                if not manager.lock.acquire(blocking=False):
+                    return False
+                try:
+                    if manager.conn.total_changes != changes:
+                        return False
+                    manager.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                    manager.conn.close()
+                    os.replace(tmp, manager.db_path)
+                    manager.conn = manager._open_write_conn()
+                    manager.conn.execute(f"PRAGMA wal_autocheckpoint = {CheckpointScheduler.BACKSTOP_PAGES};")
+                    return True
+                finally:
+                    manager.lock.release()
+            finally:
+                manager.read_gate.reopen()
+        finally:
+            if scrub_was_active:
+                manager.scrubber.resume()
+
+
+class CheckpointScheduler:
+    """
+    Moves WAL checkpointing off the ingest path.
+    SQLite's own auto-checkpoint runs inside whichever commit crosses the
+    threshold and starves behind long-lived readers (streaming downloads),
+    letting the -wal file grow without bound during bulk ingest. This thread
+    watches WAL size, write activity and live readers, and checkpoints at
+    quiet moments on its own short-lived connection: PASSIVE once the WAL
+    passes a soft limit, RESTART when nobody is reading so the log is reused
+    from the start, and TRUNCATE to hand disk back once it is very large.
+    SQLite's auto-checkpoint is raised to act only as a backstop.
+    """
+
+    POLL_INTERVAL = 1.0
+    QUIET_SECONDS = 0.5
+    PASSIVE_BYTES = 16 * 1048576
+    RESTART_BYTES = 64 * 1048576
+    TRUNCATE_BYTES = 512 * 1048576
+    FORCE_BYTES = 1024 * 1048576
+    BACKSTOP_PAGES = 16384
+    BUSY_TIMEOUT_MS = 200
+
+    def __init__(self, manager: 'CompactVaultManager') -> None:
+        self.manager = manager
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.last_changes = -1
+        self.changes_at_checkpoint = -1
+        self.last_write_seen = time.monotonic()
+        self.last: Optional[Dict[str, Any]] = None
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.frames_behind = 0
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        with self.manager.lock:
+            self.manager.conn.execute(f"PRAGMA wal_autocheckpoint = {self.BACKSTOP_PAGES};")
+        self.thread = threading.Thread(target=self._run, name='wal-checkpoint', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join()
+
+    def wal_bytes(self) -> int:
+        try:
+            return os.path.getsize(f"{self.manager.db_path}-wal")
+        except OSError:
+            return 0
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.POLL_INTERVAL):
+            try:
+                self.tick()
+            except sqlite3.Error as e:
+                logging.error(f"WAL checkpoint error: {e}")
+
+    def tick(self) -> Optional[str]:
+        """Decides whether to checkpoint now; returns the mode run, if any."""
+        now = time.monotonic()
+        changes = self.manager.conn.total_changes
+        if changes != self.last_changes:
+            self.last_changes = changes
+            self.last_write_seen = now
+        quiet = now - self.last_write_seen >= self.QUIET_SECONDS
+        readers = self.manager.read_gate.active
+        size = self.wal_bytes()
+        # A PASSIVE checkpoint leaves the file size alone; don't repeat one
+        # that already caught up unless there is new work or space to hand back.
+        if changes == self.changes_at_checkpoint and self.frames_behind == 0 and size < self.TRUNCATE_BYTES:
+            return None
+
+        mode = None
+        if size >= self.FORCE_BYTES:
+            # Bulk ingest never goes quiet; copy what we can without waiting.
+            mode = 'TRUNCATE' if readers == 0 and quiet else 'PASSIVE'
+        elif quiet and size >= self.PASSIVE_BYTES:
+            if readers == 0:
+                mode = 'TRUNCATE' if size >= self.TRUNCATE_BYTES else ('RESTART' if size >= self.RESTART_BYTES else 'PASSIVE')
+            else:
+                mode = 'PASSIVE'
+        if mode:
+            self.checkpoint(mode)
+            self.changes_at_checkpoint = changes
+        return mode
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> Dict[str, Any]:
+        gate = self.manager.read_gate
+        gate.acquire()
+        try:
+            conn = sqlite3.connect(str(self.manager.db_path), check_same_thread=False)
+            try:
+                conn.execute(f"PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS};")
+                wal_before = self.wal_bytes()
+                t0 = time.monotonic()
+                busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+                took = time.monotonic() - t0
+            finally:
+                conn.close()
+        finally:
+            gate.release()
+        with self.lock:
+            self.counts[mode.lower()] += 1
+            self.total_seconds += took
+            self.max_seconds = max(self.max_seconds, took)
+            self.frames_behind = max(0, log_frames - checkpointed) if log_frames >= 0 else 0
+            self.last = {
+                'mode': mode.lower(),
+                'at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'seconds': round(took, 4),
+                'busy': bool(busy),
+                'log_frames': log_frames,
+                'checkpointed_frames': checkpointed,
+                'wal_bytes_before': wal_before,
+                'wal_bytes_after': self.wal_bytes(),
+            }
+        if took > 1.0 or busy:
+            logging.info(f"WAL checkpoint {mode}: {checkpointed}/{log_frames} frames in {took:.2f}s (busy={busy})")
+        return self.last
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'wal_bytes': self.wal_bytes(),
+                'frames_behind': self.frames_behind,
+                'active_readers': self.manager.read_gate.active,
+                'seconds_since_write': round(time.monotonic() - self.last_write_seen, 3),
+                'checkpoints': dict(self.counts),
+                'checkpoint_seconds_total': round(self.total_seconds, 4),
+                'checkpoint_seconds_max': round(self.max_seconds, 4),
+                'last_checkpoint': self.last,
+                'thresholds': {'passive': self.PASSIVE_BYTES, 'restart': self.RESTART_BYTES,
+                               'truncate': self.TRUNCATE_BYTES, 'force': self.FORCE_BYTES},
+            }
+
+class PieceReader(io.RawIOBase):
+    """
+    Reads a local file (memory-mapped where possible) the way ChainedFileWrapper
+    reads an upload: no seeking, and no read crosses an UPLOAD_PIECE_SIZE
+    boundary. Chunking therefore matches an upload of the same file byte for byte.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.pos = 0
+        self.map: Optional[mmap.mmap] = None
+        self.view: Optional[memoryview] = None
+        if self.size:
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.map)
+            except (OSError, ValueError):
+                self.map = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: Any) -> int:
+        n = min(len(b), self.size - self.pos, UPLOAD_PIECE_SIZE - self.pos % UPLOAD_PIECE_SIZE)
+        if n <= 0:
+            return 0
+        if self.view is not None:
+            b[:n] = self.view[self.pos:self.pos + n]
+        else:
+            n = self.file.readinto(memoryview(b)[:n])
+        self.pos += n
+        return n
+
+    def close(self) -> None:
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+        super().close()
+
+
+class PreparedFile:
+    """
+    One file being encoded by an import worker. Files up to BUFFER_BYTES are
+    encoded completely before the writer takes the write lock (`encoded`).
+    Larger ones flow through a small bounded queue, so a worker can run ahead
+    of the writer without holding a large file in memory. A file identical
+    to an asset already in the vault is only hashed, and marked `duplicate`
+    for the writer to clone; one identical to the asset it was imported as
+    before (`previous`), with just a new mtime, is marked `unchanged`.
+    """
+
+    QUEUE_RECORDS = 8
+    BUFFER_BYTES = 16 * 1048576
+    _DONE = object()
+
+    def __init__(self, rel_path: str, size: int, mtime_ns: int, previous: Optional[int] = None) -> None:
+        self.rel_path = rel_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.previous = previous
+        self.crc = 0
+        self.digest = ''
+        self.duplicate = False
+        self.unchanged = False
+        self.decided = threading.Event()
+        self.encoded = threading.Event()
+        self.head = b''
+        self.buffered = size <= self.BUFFER_BYTES
+        self.records: 'queue.Queue[Any]' = queue.Queue(0 if self.buffered else self.QUEUE_RECORDS)
+        self.abandoned = False
+
+    def encode(self, root: str, lookup_conn: Optional[Callable[[], sqlite3.Connection]] = None) -> None:
+        """Runs on a worker thread; errors are handed to the writer through the queue."""
+        try:
+            path = os.path.join(root, self.rel_path)
+            with PieceReader(path) as reader:
+                digest = None
+                if lookup_conn and self.size and CompactVaultManager._size_indexed(lookup_conn(), self.size):
+                    digest = hashlib.sha256(reader.view).hexdigest() if reader.view is not None else sha256_files([path])
+                    if self.previous is not None and lookup_conn().execute(
+                            "SELECT 1 FROM assets WHERE id = ? AND size = ? AND digest = ?", (self.previous, self.size, digest)).fetchone():
+                        self.unchanged = True
+                    elif CompactVaultManager._duplicate_of(lookup_conn(), digest, self.size):
+                        self.duplicate = True
+                    if self.unchanged or self.duplicate:
+                        self.digest = digest
+                        self.decided.set()
+                        self.records.put(self._DONE)
+                        return
+                self.decided.set()
+                header = reader.view[:1024].tobytes() if reader.view is not None else reader.file.read(1024)
+                reader.file.seek(0)
+                pieces = max(1, -(-self.size // UPLOAD_PIECE_SIZE))
+                min_sz, max_sz, sentinel = OptimizedCDC.ingest_params(header, pieces)
+                encoder = ChunkEncoder(OptimizedCDC(min_size=min_sz, max_size=max_sz, sentinel=sentinel), reader, digest=digest)
+                for record in encoder:
+                    if self.abandoned:
+                        return
+                    self.records.put(record)
+                self.crc = encoder.crc
+                self.digest = encoder.digest
+                self.head = encoder.head
+            self.records.put(self._DONE)
+        except Exception as e:
+            self.decided.set()
+            self.records.put(e)
+        finally:
+            self.encoded.set()
+
+    def __iter__(self) -> Iterator[Tuple[str, int, bytes]]:
+        while True:
+            item = self.records.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def abandon(self) -> None:
+        """Unblocks a worker whose file will not be consumed."""
+        self.abandoned = True
+        while True:
+            try:
+                self.records.get_nowait()
+            except queue.Empty:
+                return
+
+
+class BulkImporter:
+    """
+    Imports a local directory tree into a collection without going through
+    HTTP. The tree is walked in parallel; files are chunked, hashed and
+    compressed on a worker pool straight from disk; a single writer inserts
+    them in order, committing in batches. Each batch also records
+    path, size and mtime in import_journal, in the same transaction, so a
+    re-run skips files that are already in the vault and unchanged. A file
+    whose mtime alone changed is matched on its digest and only has its
+    journal row updated, rather than being stored a second time.
+    """
+
+    PROGRESS_INTERVAL = 2.0
+
+    def __init__(self, manager: 'CompactVaultManager', root: str, collection_id: int, workers: Optional[int] = None,
+                 batch_files: int = 500, batch_bytes: int = 256 * 1048576, batch_seconds: float = 5.0,
+                 progress: Any = None) -> None:
+        self.manager = manager
+        self.root = os.path.abspath(root)
+        self.collection_id = collection_id
+        self.workers = workers or min(8, os.cpu_count() or 4)
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        self.batch_seconds = batch_seconds
+        self.progress = progress if progress is not None else sys.stderr
+        self.errors: List[Tuple[str, str]] = []
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.cloned = 0
+        self.started = 0.0
+        self._last_report = 0.0
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    def _lookup_conn(self) -> sqlite3.Connection:
+        """A read connection per worker thread, for the duplicate-file lookups."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.manager._get_read_conn()
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _scan_dir(self, rel_dir: str) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+        files: List[Tuple[str, int, int]] = []
+        subdirs: List[str] = []
+        try:
+            with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                for entry in it:
+                    rel = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                    try:
+                        if entry.is_symlink():
+                            continue
+                        if entry.is_dir():
+                            subdirs.append(rel)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files.append((rel, st.st_size, st.st_mtime_ns))
+                    except OSError as e:
+                        self.errors.append((rel, str(e)))
+        except OSError as e:
+            self.errors.append((rel_dir or '.', str(e)))
+        return files, subdirs
+
+    def walk(self) -> List[Tuple[str, int, int]]:
+        """Lists (relative path, size, mtime_ns) for every regular file, scanning directories in parallel."""
+        files: List[Tuple[str, int, int]] = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self._scan_dir, '')}
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    found, subdirs = future.result()
+                    files.extend(found)
+                    pending.update(pool.submit(self._scan_dir, d) for d in subdirs)
+        files.sort()
+        return files
+
+    def _journal(self) -> Dict[str, Tuple[int, int, int]]:
+        with self.manager._get_read_conn() as conn:
+            rows = conn.execute("SELECT path, size, mtime_ns, asset_id FROM import_journal WHERE collection_id = ?", (self.collection_id,))
+            return {row['path']: (row['size'], row['mtime_ns'], row['asset_id']) for row in rows}
+
+    def _report(self, final: bool = False) -> None:
+        now = time.monotonic()
+        if not final and now - self._last_report < self.PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.bytes_done / elapsed
+        remaining = self.bytes_total - self.bytes_done
+        eta = f'{int(remaining / rate // 60)}m{int(remaining / rate % 60):02d}s' if rate > 0 and not final else '-'
+        self.progress.write(
+            f'\r{self.files_done}/{self.files_total} files, {self.bytes_done / 1e9:.2f}/{self.bytes_total / 1e9:.2f} GB, '
+            f'{rate / 1048576:.1f} MB/s, ETA {eta}, {len(self.errors)} errors' + ('\n' if final else ''))
+        self.progress.flush()
+
+    def run(self) -> Dict[str, Any]:
+        self.started = time.monotonic()
+        listed = self.walk()
+        journal = self._journal()
+        todo = [f for f in listed if journal.get(f[0], (None, None))[:2] != (f[1], f[2])]
+        self.skipped = len(listed) - len(todo)
+        self.files_total = len(todo)
+        self.bytes_total = sum(size for _, size, _ in todo)
+        logging.info(f"Import of {self.root}: {len(todo)} files to import, {self.skipped} unchanged since a previous import")
+
+        manager = self.manager
+        window = self.workers * 2
+        ahead: deque = deque()
+        current: Optional[PreparedFile] = None
+        next_file = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def fill() -> None:
+                nonlocal next_file
+                while next_file < len(todo) and len(ahead) < window:
+                    rel_path, size, mtime_ns = todo[next_file]
+                    previous = journal.get(rel_path)
+                    prepared = PreparedFile(rel_path, size, mtime_ns, previous[2] if previous else None)
+                    pool.submit(prepared.encode, self.root, self._lookup_conn)
+                    ahead.append(prepared)
+                    next_file += 1
+
+            batch: List[PreparedFile] = []
+            try:
+                fill()
+                while ahead:
+                    # Gather the batch while workers finish encoding it, so the write lock
+                    # is not held waiting on them. A file too large to buffer forms a
+                    # batch of its own and streams its records under the lock.
+                    batch = []
+                    batch_started = time.monotonic()
+                    batch_bytes = 0
+                    while ahead and len(batch) < self.batch_files and batch_bytes < self.batch_bytes \
+                            and time.monotonic() - batch_started < self.batch_seconds:
+                        if batch and not ahead[0].buffered:
+                            break
+                        prepared = ahead.popleft()
+                        batch.append(prepared)
+                        fill()
+                        if not prepared.buffered:
+                            break
+                        prepared.encoded.wait()
+                        batch_bytes += prepared.size
+
+                    committed: List[Tuple[int, IngestStats, int]] = []
+                    with manager.lock:
+                        manager.conn.execute("BEGIN TRANSACTION")
+                        try:
+                            for prepared in batch:
+                                result = self._insert(prepared)
+                                if result is not None:
+                                    committed.append(result)
+                            manager.conn.commit()
+                        except Exception:
+                            manager.conn.rollback()
+                            raise
+                    for prepared in batch:
+                        self.files_done += 1
+                        self.bytes_done += prepared.size
+                    batch = []
+                    self._report()
+                    for collection_id, stats, _ in committed:
+                        manager._asset_committed(collection_id, stats)
+            finally:
+                for prepared in batch + list(ahead):
+                    prepared.abandon()
+        for conn in self._conns:
+            conn.close()
+        self._report(final=True)
+        return {'files': self.files_done, 'bytes': self.bytes_done, 'skipped': self.skipped, 'unchanged': self.unchanged,
+                'cloned': self.cloned, 'errors': len(self.errors), 'seconds': round(time.monotonic() - self.started, 3)}
+
+    def _insert(self, prepared: PreparedFile) -> Optional[Tuple[int, IngestStats, int]]:
+        """Inserts one file under a savepoint, so a read error leaves no partial rows behind."""
+        conn = self.manager.conn
+        rel_dir, _, filename = prepared.rel_path.rpartition('/')
+        prepared.decided.wait()
+        if prepared.unchanged:
+            conn.execute("UPDATE import_journal SET size = ?, mtime_ns = ?, source = ? WHERE collection_id = ? AND path = ?",
+                         (prepared.size, prepared.mtime_ns, self.root, self.collection_id, prepared.rel_path))
+            self.unchanged += 1
+            return None
+        conn.execute("SAVEPOINT import_file")
+        try:
+            collection_id = self.manager.get_or_create_collection_from_path(self.collection_id, rel_dir)
+            if prepared.duplicate:
+                original = self.manager._duplicate_of(conn, prepared.digest, prepared.size)
+                if not original:
+                    raise ValueError(f'asset with digest {prepared.digest} disappeared')
+                asset_id, stats = self.manager._clone_asset(collection_id, filename, original, prepared.digest)
+            else:
+                asset_id, stats = self.manager._insert_asset(collection_id, filename, prepared)
+            conn.execute(
+                "INSERT OR REPLACE INTO import_journal (collection_id, path, size, mtime_ns, asset_id, source) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.collection_id, prepared.rel_path, prepared.size, prepared.mtime_ns, asset_id, self.root))
+            conn.execute("RELEASE import_file")
+            self.cloned += stats.cloned_assets
+            return collection_id, stats, asset_id
+        except (OSError, ValueError) as e:
+            conn.execute("ROLLBACK TO import_file")
+            conn.execute("RELEASE import_file")
+            prepared.abandon()
+            self.errors.append((prepared.rel_path, str(e)))
+            logging.error(f"Import of {prepared.rel_path} failed: {e}")
+            return None
+
+
+class VaultReplicator:
+    """
+    Incrementally copies one vault into another. The vault is append-only,
+    so projects, collections and assets are matched by a replica_map of
+    source ids to target ids, and assets are walked past a per-source
+    watermark. Only chunks whose hashes are missing from the target are
+    copied, still compressed. Chunk copies commit in bounded batches before
+    the asset rows that reference them. The asset rows, their map entries
+    and the watermark then commit together, so an interrupted sync resumes
+    where it stopped without re-sending data. Which copied chunks still
+    await an asset to be credited with storing them is kept in
+    replica_credit for the same reason. The target is opened as the sole
+    writer, without background threads, so it must not be hosted meanwhile.
+    """
+
+    ASSET_BATCH = 256
+    HASH_BATCH = 500
+    CHUNK_COMMIT_BYTES = 64 * 1048576
+
+    def __init__(self, source: 'CompactVaultManager', target_path: str, password: str) -> None:
+        self.source = source
+        self.target_path = target_path
+        self.password = password
+        self.target: Optional['CompactVaultManager'] = None
+        self.source_id = ''
+        self.state = 'idle'
+        self.error: Optional[str] = None
+        self.assets_total = 0
+        self.assets_done = 0
+        self.chunks_copied = 0
+        self.chunks_present = 0
+        self.bytes_copied = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._credit: Dict[str, int] = {}
+
+    def status(self) -> Dict[str, Any]:
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0.0
+        return {
+            'state': self.state, 'error': self.error, 'target': self.target_path,
+            'assets_done': self.assets_done, 'assets_total': self.assets_total,
+            'chunks_copied': self.chunks_copied, 'chunks_already_present': self.chunks_present,
+            'bytes_copied': self.bytes_copied, 'elapsed': round(elapsed, 3),
+            'mb_per_s': round(self.bytes_copied / elapsed / 1048576, 2) if elapsed > 0 else 0.0,
+        }
+
+    def run(self) -> Dict[str, Any]:
+        self.started = time.monotonic()
+        self.state = 'running'
+        try:
+            self.source_id = self.source.get_vault_id()
+            self.target = CompactVaultManager(self.target_path, background=False)
+            try:
+                self._credit = {r[0]: r[1] for r in self.target.conn.execute(
+                    "SELECT hash, stored FROM replica_credit WHERE source_vault = ?", (self.source_id,))}
+                self._copy_credentials()
+                self._sync_tree()
+                self._sync_assets()
+            finally:
+                self.target.close()
+            self.state = 'done'
+        except Exception as e:
+            logging.error(f"Replication to {self.target_path} failed: {e}")
+            self.state = 'failed'
+            self.error = str(e)
+        self.finished = time.monotonic()
+        return self.status()
+
+    def _copy_credentials(self) -> None:
+        """A new replica unlocks with the source vault's password; an existing one must already."""
+        target = self.target
+        with target.lock:
+            if target.conn.execute("SELECT 1 FROM vault_properties WHERE key = 'password_hash'").fetchone():
+                if not target.check_password(self.password):
+                    raise PermissionError(f'{self.target_path} does not unlock with the source vault password')
+                return
+            with self.source._get_read_conn() as conn:
+                rows = conn.execute("SELECT key, value FROM vault_properties WHERE key IN ('password_hash', 'password_salt')").fetchall()
+            target.conn.executemany("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)", [tuple(r) for r in rows])
+            target.conn.commit()
+
+    def _mapped(self, kind: str) -> Dict[int, int]:
+        rows = self.target.conn.execute("SELECT source_id, target_id FROM replica_map WHERE source_vault = ? AND kind = ?",
+                                        (self.source_id, kind))
+        return {r[0]: r[1] for r in rows}
+
+    def _sync_tree(self) -> None:
+        """Copies projects and collections not yet in the replica. Parents always precede children by id."""
+        with self.source._get_read_conn() as conn:
+            projects = conn.execute("SELECT id, name, type, description, created_at, order_index FROM projects ORDER BY id").fetchall()
+            collections = conn.execute("SELECT id, project_id, parent_id, name, type, created_at, order_index FROM collections ORDER BY id").fetchall()
+        target = self.target
+        with target.lock:
+            try:
+                project_map = self._mapped('project')
+                for p in projects:
+                    if p['id'] in project_map:
+                        continue
+                    cur = target.conn.execute(
+                        "INSERT INTO projects (name, type, description, created_at, order_index) VALUES (?, ?, ?, ?, ?)",
+                        (p['name'], p['type'], p['description'], p['created_at'], p['order_index']))
+                    project_map[p['id']] = cur.lastrowid
+                    self._map('project', p['id'], cur.lastrowid)
+                collection_map = self._mapped('collection')
+                for c in collections:
+                    if c['id'] in collection_map:
+                        continue
+                    parent = collection_map.get(c['parent_id']) if c['parent_id'] is not None else None
+                    cur = target.conn.execute(
+                        "INSERT INTO collections (project_id, parent_id, name, type, created_at, order_index) VALUES (?, ?, ?, ?, ?, ?)",
+                        (project_map[c['project_id']], parent, c['name'], c['type'], c['created_at'], c['order_index']))
+                    collection_map[c['id']] = cur.lastrowid
+                    self._map('collection', c['id'], cur.lastrowid)
+                target.conn.commit()
+            except Exception:
+                target.conn.rollback()
+                raise
+        target.bump_generation()
+
+    def _map(self, kind: str, source_id: int, target_id: int) -> None:
+        self.target.conn.execute("INSERT INTO replica_map (source_vault, kind, source_id, target_id) VALUES (?, ?, ?, ?)",
+                                 (self.source_id, kind, source_id, target_id))
+
+    def _watermark_key(self) -> str:
+        return f'replica_watermark:{self.source_id}'
+
+    def _sync_assets(self) -> None:
+        target = self.target
+        row = target.conn.execute("SELECT value FROM vault_properties WHERE key = ?", (self._watermark_key(),)).fetchone()
+        watermark = int(row[0]) if row else 0
+        with self.source._get_read_conn() as conn:
+            high = conn.execute("SELECT COALESCE(MAX(id), 0) FROM assets").fetchone()[0]
+            self.assets_total = conn.execute("SELECT COUNT(*) FROM assets WHERE id > ? AND id <= ?", (watermark, high)).fetchone()[0]
+
+        while watermark < high:
+            with self.source._get_read_conn() as conn:
+                assets = conn.execute(
+                    "SELECT id, collection_id, type, format, manifest, crc32, size, digest, order_index, created_at FROM assets "
+                    "WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (watermark, high, self.ASSET_BATCH)).fetchall()
+                if not assets:
+                    break
+                ids = [a['id'] for a in assets]
+                metadata: Dict[int, List[Tuple[str, str]]] = defaultdict(list)
+                placeholders = ','.join('?' * len(ids))
+                for m in conn.execute(f"SELECT asset_id, key, value FROM metadata WHERE asset_id IN ({placeholders}) ORDER BY id", ids):
+                    metadata[m['asset_id']].append((m['key'], m['value']))
+                previews = {p['asset_id']: p for p in conn.execute(
+                    f"SELECT asset_id, size, encoding, line_count, truncated, content FROM asset_previews WHERE asset_id IN ({placeholders})", ids)}
+
+            manifests = {a['id']: json.loads(a['manifest']) if a['manifest'] else {'chain': []} for a in assets}
+            hashes = list(dict.fromkeys(b['chunk_hash'] for m in manifests.values() for b in m['chain']))
+            self._copy_missing_chunks(hashes)
+
+            collection_map = self._mapped('collection')
+            if any(a['collection_id'] not in collection_map for a in assets):
+                # Collections created after the tree pass; pick them up now.
+                self._sync_tree()
+                collection_map = self._mapped('collection')
+
+            committed: List[int] = []
+            credit = dict(self._credit)
+            with target.lock:
+                try:
+                    for a in assets:
+                        collection_id = collection_map[a['collection_id']]
+                        cur = target.conn.execute(
+                            "INSERT INTO assets (collection_id, type, format, manifest, crc32, size, digest, order_index, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (collection_id, a['type'], a['format'], a['manifest'], a['crc32'], a['size'], a['digest'],
+                             a['order_index'], a['created_at']))
+                        target_id = cur.lastrowid
+                        target.conn.executemany("INSERT INTO metadata (asset_id, key, value) VALUES (?, ?, ?)",
+                                                [(target_id, k, v) for k, v in metadata[a['id']]])
+                        self._map('asset', a['id'], target_id)
+                        preview = previews.get(a['id'])
+                        if preview:
+                            target.conn.execute(
+                                "INSERT INTO asset_previews (asset_id, size, encoding, line_count, truncated, content) VALUES (?, ?, ?, ?, ?, ?)",
+                                (target_id,) + tuple(preview)[1:])
+                        elif a['type'] == 'text':
+                            # The source has not backfilled this one yet; its chunks are already here.
+                            manifest = manifests[a['id']]
+                            try:
+                                head = target._read_preview_head(target.conn, manifest, target_id)
+                            except ChunkIntegrityError as e:
+                                logging.error(f"Replica preview skipped for asset {a['id']}: {e}")
+                            else:
+                                target._store_preview(target.conn, target_id, head, manifest.get('total_size', 0), a['format'])
+                        stats = IngestStats()
+                        for block in manifests[a['id']]['chain']:
+                            stored = credit.pop(block['chunk_hash'], None)
+                            stats.add_chunk(block['size'], stored or 0, stored is not None)
+                        target._record_ingest_stats(collection_id, a['format'], stats)
+                        committed.append(collection_id)
+                    target.conn.executemany("DELETE FROM replica_credit WHERE source_vault = ? AND hash = ?",
+                                            [(self.source_id, h) for h in self._credit.keys() - credit.keys()])
+                    target.conn.execute("INSERT OR REPLACE INTO vault_properties (key, value) VALUES (?, ?)",
+                                        (self._watermark_key(), str(assets[-1]['id'])))
+                    target.conn.commit()
+                except Exception:
+                    target.conn.rollback()
+                    raise
+            watermark = assets[-1]['id']
+            self._credit = credit
+            for collection_id in committed:
+                target.bump_generation(collection_id)
+            self.assets_done += len(assets)
+
+    def _copy_missing_chunks(self, hashes: List[str]) -> None:
+        """Hash-set diff against the target in batches, then copies the missing blobs as stored."""
+        target = self.target
+        pending: List[Tuple[str, bytes]] = []
+        pending_bytes = 0
+
+        def flush() -> None:
+            nonlocal pending, pending_bytes
+            if not pending:
+                return
+            credited: Dict[str, int] = {}
+            with target.lock:
+                try:
+                    for chunk_hash, data in pending:
+                        cur = target.conn.execute("INSERT OR IGNORE INTO chunks (hash, data) VALUES (?, ?)", (chunk_hash, data))
+                        if cur.rowcount == 1:
+                            # The first replicated asset referencing it is credited with storing it.
+                            target.conn.execute("INSERT OR REPLACE INTO replica_credit (source_vault, hash, stored) VALUES (?, ?, ?)",
+                                                (self.source_id, chunk_hash, len(data)))
+                            credited[chunk_hash] = len(data)
+                    target.conn.commit()
+                except Exception:
+                    target.conn.rollback()
+                    raise
+            self._credit.update(credited)
+            pending, pending_bytes = [], 0
+
+        for i in range(0, len(hashes), self.HASH_BATCH):
+            batch = hashes[i:i + self.HASH_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            with target.lock:
+                present = {r[0] for r in target.conn.execute(f"SELECT hash FROM chunks WHERE hash IN ({placeholders})", batch)}
+            missing = [h for h in batch if h not in present]
+            self.chunks_present += len(batch) - len(missing)
+            if not missing:
+                continue
+            with self.source._get_read_conn() as conn:
+                placeholders = ','.join('?' * len(missing))
+                for row in conn.execute(f"SELECT hash, data FROM chunks WHERE hash IN ({placeholders})", missing):
+                    pending.append((row['hash'], row['data']))
+                    pending_bytes += len(row['data'])
+                    self.chunks_copied += 1
+                    self.bytes_copied += len(row['data'])
+                    if pending_bytes >= self.CHUNK_COMMIT_BYTES:
+                        flush()
+        flush()
+
 
 # endregion
 
@@ -2128,9 +6209,9 @@ HTML_SELECTOR_TEMPLATE = """
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ db: selectedDb, password: password })
-                }).then(res => {
+                }).then(async res => {
                     if (res.ok) {
-                        location.reload();
+                        location.href = (await res.json()).url;
                     } else {
                         alert('Invalid password');
                     }
@@ -2157,9 +6238,9 @@ HTML_SELECTOR_TEMPLATE = """
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ db: name + '.vault', password: password })
-                }).then(res => {
+                }).then(async res => {
                     if (res.ok) {
-                        location.reload();
+                        location.href = (await res.json()).url;
                     } else {
                         alert('Failed to create vault');
                     }
@@ -2185,29 +6266,275 @@ button:hover { background-color: #1ca0d3; }
 """
 
 
+MAX_BYTE_RANGES = 64
+
+def parse_range_header(range_header: str, total_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parses an RFC 7233 `bytes=` Range header into inclusive (start, end) pairs.
+    Returns None when the header should be ignored (bad syntax, other units,
+    too many ranges) and an empty list when no range is satisfiable.
+    Overlapping and adjacent ranges are coalesced.
+    """
+    units, _, spec = range_header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges: List[Tuple[int, int]] = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        m = re.fullmatch(r'(\d*)-(\d*)', part)
+        if not m or not (m.group(1) or m.group(2)):
+            return None
+        first, last = m.group(1), m.group(2)
+        if first:
+            start = int(first)
+            end = int(last) if last else total_size - 1
+            if last and end < start:
+                return None
+            if start >= total_size:
+                continue
+            end = min(end, total_size - 1)
+        else:
+            suffix = int(last)
+            if suffix == 0 or total_size == 0:
+                continue
+            start = max(0, total_size - suffix)
+            end = total_size - 1
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_BYTE_RANGES:
+        return None
+    if len(ranges) <= 1:
+        return ranges
+
+    # Coalescing keeps a client from asking for the same bytes many times over.
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+
+class HostedVault:
+    """One vault in a VaultRegistry: unlocked for this server, open only while in use."""
+
+    __slots__ = ('name', 'manager', 'users', 'last_used', 'opened', 'open_lock')
+
+    def __init__(self, name: str, manager: Optional[CompactVaultManager]) -> None:
+        self.name = name
+        self.manager = manager
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.opened = 1 if manager else 0
+        self.open_lock = threading.Lock()
+
+    def busy(self) -> bool:
+        """Work that must not be cut short by an idle close."""
+        m = self.manager
+        return bool(m.ingest_pending or m.active_exports
+                    or (m.scrubber.thread is not None and m.scrubber.thread.is_alive())
+                    or (m.replication is not None and m.replication.state == 'running')
+                    or any(b['state'] == 'running' for b in m.backfills.values()))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'url': f'/v/{quote(self.name, safe="")}/', 'open': self.manager is not None,
+                'requests': self.users, 'idle_seconds': round(time.monotonic() - self.last_used, 1), 'opened': self.opened}
+
+
+class VaultRegistry:
+    """
+    The vaults this server has unlocked, by name. Requests are scoped with a
+    /v/<name>/ path prefix; unscoped requests go to the vault unlocked last.
+    A vault's manager is opened on the first request that needs it and
+    closed (ingest drained, WAL checkpointed) after idle_seconds without
+    requests or background work. The vault stays unlocked and reopens on
+    demand. All managers share one IngestPool.
+    """
+
+    def __init__(self, idle_seconds: float = VAULT_IDLE_SECONDS, pool: IngestPool = INGEST_POOL) -> None:
+        self.idle_seconds = idle_seconds
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.vaults: Dict[str, HostedVault] = {}
+        self.default: Optional[str] = None
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name='vault-idle-close', daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(max(1.0, min(60.0, self.idle_seconds / 4))):
+            self.close_idle()
+
+    @staticmethod
+    def valid_name(name: Any) -> bool:
+        return isinstance(name, str) and name.endswith('.vault') and len(name) > len('.vault')
+
+    def split_path(self, path: str) -> Tuple[Optional[str], str]:
+        """'/v/<name>/rest' -> (name, '/rest'); any other path belongs to the default vault."""
+        if path.startswith('/v/'):
+            name, sep, rest = path[3:].partition('/')
+            return unquote(name), sep + rest
+        return self.default, path
+
+    def open(self, name: str) -> CompactVaultManager:
+        return CompactVaultManager(name, self.pool)
+
+    def unlock(self, name: str, password: str, create: bool = False) -> bool:
+        """Registers a vault once its password checks out (or, with create, once it is set) and makes it the default."""
+        manager = self.acquire(name)
+        fresh = manager is None
+        if fresh:
+            manager = self.open(name)
+        try:
+            if create:
+                manager.set_password(password)
+            elif not manager.check_password(password):
+                if fresh:
+                    manager.close()
+                return False
+        except Exception:
+            if fresh:
+                manager.close()
+            raise
+        finally:
+            if not fresh:
+                self.release(name)
+        with self.lock:
+            if fresh:
+                if name in self.vaults:
+                    # Another request registered it meanwhile; keep theirs.
+                    manager.close()
+                else:
+                    self.vaults[name] = HostedVault(name, manager)
+            self.default = name
+        return True
+
+    def acquire(self, name: Optional[str]) -> Optional[CompactVaultManager]:
+        """The open manager for an unlocked vault (opening it if needed), or None. Pair with release()."""
+        with self.lock:
+            entry = self.vaults.get(name) if name else None
+            if entry is None:
+                return None
+            entry.users += 1
+            entry.last_used = time.monotonic()
+        try:
+            with entry.open_lock:
+                if entry.manager is None:
+                    logging.info(f"Opening vault {name}")
+                    entry.manager = self.open(name)
+                    entry.opened += 1
+                return entry.manager
+        except Exception:
+            self.release(name)
+            raise
+
+    def release(self, name: str) -> None:
+        with self.lock:
+            entry = self.vaults[name]
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+
+    def close_idle(self) -> int:
+        closed = 0
+        now = time.monotonic()
+        for entry in list(self.vaults.values()):
+            if entry.manager is None or now - entry.last_used < self.idle_seconds or not entry.open_lock.acquire(blocking=False):
+                continue
+            try:
+                with self.lock:
+                    # Requests take users under self.lock before waiting on open_lock, so this check is final.
+                    if entry.users or entry.manager is None or entry.busy():
+                        continue
+                    manager, entry.manager = entry.manager, None
+                logging.info(f"Closing idle vault {entry.name}")
+                manager.close()
+                closed += 1
+            finally:
+                entry.open_lock.release()
+        return closed
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(v.to_dict(), default=v.name == self.default) for v in self.vaults.values()]
+
+    def replicating_into(self, name: str) -> bool:
+        """Whether a hosted vault is syncing into name, which must then not be opened as a second writer."""
+        with self.lock:
+            managers = [v.manager for v in self.vaults.values() if v.manager is not None]
+        return any(m.replication is not None and m.replication.state == 'running'
+                   and os.path.abspath(m.replication.target_path) == os.path.abspath(name) for m in managers)
+
+    def close_all(self) -> None:
+        self.stop_event.set()
+        for entry in list(self.vaults.values()):
+            with entry.open_lock:
+                manager, entry.manager = entry.manager, None
+            if manager:
+                manager.close()
+
 
 class RequestHandler(http.server.BaseHTTPRequestHandler):
     routes: Dict[str, List[Tuple[str, str]]] = {
         'GET': [
             (r'^/favicon.ico$', 'handle_favicon'),
+            (r'^/vaults$', 'show_db_selector'),
+            (r'^/api/vaults$', 'api_list_vaults'),
             (r'^/api/projects$', 'api_get_all_projects'),
             (r'^/api/projects/(\d+)$', 'api_get_project'),
             (r'^/api/projects/(\d+)/collections$', 'api_get_project_collections'),
             (r'^/api/collections/(\d+)/assets$', 'api_get_collection_assets'),
             (r'^/api/collections/(\d+)$', 'api_get_collection'),
             (r'^/api/assets/(\d+)/preview$', 'handle_asset_preview'),
+            (r'^/api/assets/(\d+)/proof$', 'api_asset_proof'),
+            (r'^/api/assets/lookup$', 'api_asset_lookup'),
             (r'^/api/assets/(\d+)$', 'handle_asset_download'),
             (r'^/api/projects/(\d+)/download$', 'api_download_project'),
             (r'^/api/collections/(\d+)/download$', 'api_download_collection'),
+            (r'^/api/exports$', 'api_get_exports'),
+            (r'^/api/stats$', 'api_get_stats'),
+            (r'^/api/replication$', 'api_replication_status'),
+            (r'^/api/jobs$', 'api_get_jobs'),
+            (r'^/api/upload/sessions/([A-Za-z0-9_.-]+)$', 'api_upload_session_status'),
+            (r'^/api/jobs/(\d+)$', 'api_get_job'),
+            (r'^/metrics$', 'api_metrics'),
+            (r'^/api/traces$', 'api_get_traces'),
+            (r'^/api/traces/chrome$', 'api_export_traces'),
+            (r'^/api/traces/(\d+)/chrome$', 'api_export_traces'),
+            (r'^/api/maintenance/scrub$', 'api_scrub_status'),
+            (r'^/api/maintenance/space$', 'api_space_status'),
+            (r'^/api/maintenance/wal$', 'api_wal_status'),
+            (r'^/api/maintenance/verify$', 'api_verify_status'),
+            (r'^/api/maintenance/scrub/report$', 'api_scrub_report'),
         ],
         'POST': [
             (r'^/api/create_vault$', 'api_create_vault'),
             (r'^/api/unlock_vault$', 'api_unlock_vault'),
             (r'^/api/projects$', 'api_create_project'),
             (r'^/api/collections$', 'api_create_collection'),
+            (r'^/api/upload/sessions$', 'api_open_upload_session'),
             (r'^/api/upload/chunk$', 'api_upload_chunk'),
+            (r'^/api/upload/batch$', 'api_upload_batch'),
             (r'^/api/upload/complete$', 'api_complete_upload'),
+            (r'^/api/assets/clone$', 'api_clone_asset'),
+            (r'^/api/traces/config$', 'api_configure_tracing'),
+            (r'^/api/replication/sync$', 'api_replication_sync'),
             (r'^/api/maintenance/vacuum$', 'api_vacuum'),
+            (r'^/api/maintenance/space/reclaim$', 'api_space_reclaim'),
+            (r'^/api/maintenance/space/convert$', 'api_space_convert'),
+            (r'^/api/maintenance/scrub/start$', 'api_scrub_start'),
+            (r'^/api/maintenance/scrub/pause$', 'api_scrub_pause'),
+            (r'^/api/maintenance/scrub/resume$', 'api_scrub_resume'),
+            (r'^/api/maintenance/verify/config$', 'api_configure_verify'),
             (r'^/api/collections/(\d+)/assets/download$', 'handle_bulk_download'),
         ],
     }
@@ -2231,34 +6558,77 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             if not self.parse_request():
                 return
 
-            # New authentication flow
-            if self.command != 'OPTIONS':
-                # Allow access to the main page and unlock/create vault endpoints
-                if self.path not in ('/', '/api/unlock_vault', '/api/create_vault'):
-                    if not self.server.app_state.get("manager"):
-                        self.send_error(401, "Unauthorized: No vault unlocked")
-                        return
-
-            mname = 'do_' + self.command
-            if hasattr(self, mname):
-                getattr(self, mname)()
-            self.wfile.flush()
+            # Requests address a vault with a /v/<name>/ prefix, or the default vault without one.
+            vaults = self.server.app_state["vaults"]
+            self.vault_name, path = vaults.split_path(self.path)
+            if not path:
+                # Relative URLs in the UI need the trailing slash.
+                self.send_response(301)
+                self.send_header('Location', self.path + '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.path = path
+            self.manager = vaults.acquire(self.vault_name)
+            try:
+                # New authentication flow
+                if self.command != 'OPTIONS':
+                    # Allow access to the main page and unlock/create vault endpoints
+                    if self.path not in ('/', '/vaults', '/api/vaults', '/api/unlock_vault', '/api/create_vault'):
+                        if not self.manager:
+                            self.send_error(401, "Unauthorized: No vault unlocked")
+                            return
+
+                mname = 'do_' + self.command
+                if hasattr(self, mname):
+                    getattr(self, mname)()
+                self.wfile.flush()
+            finally:
+                if self.manager is not None:
+                    vaults.release(self.vault_name)
         except socket.timeout as e:
             self.log_error("Request timed out: %r", e)
 
     def _send_json(self, obj: Any, code: int = 200) -> None:
-        data = json.dumps(obj, default=str).encode('utf-8')
+        with trace_span('json.encode'):
+            data = json.dumps(obj, default=str).encode('utf-8')
         headers = {'Content-Type':'application/json'}
         self._send_compressed(data, code, headers)
 
+    def _send_refusal(self, refusal: Tuple[int, int, str]) -> None:
+        """429/503 from ingest admission control, with the Retry-After the client should honour."""
+        status, retry_after, message = refusal
+        INGEST_REFUSED.inc(labels=(status,))
+        data = json.dumps({'message': message, 'retry_after': retry_after}).encode('utf-8')
+        self._send_compressed(data, status, {'Content-Type': 'application/json', 'Retry-After': str(retry_after)})
+
     def _send_raw(self, data: bytes, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
         headers = headers or {}
         self._send_compressed(data, status, headers)
 
-    def _send_compressed(self, data: bytes, code: int, headers: Dict[str, str]) -> None:
+    def _send_cached_json(self, key: Tuple[Any, ...], producer: Any) -> None:
+        """
+        Sends a JSON body from the manager's response cache, building it on a
+        miss. Producers raise on failure, so an error is never cached.
+        """
+        cache = self.manager.response_cache
+        entry = cache.get(key)
+        if entry is None:
+            try:
+                obj = producer()
+            except (sqlite3.Error, json.JSONDecodeError) as e:
+                self._send_json({'message': f'Query failed: {e}'}, 500)
+                return
+            with trace_span('json.encode'):
+                entry = CachedResponse(json.dumps(obj, default=str).encode('utf-8'))
+            cache.put(key, entry)
+        self._send_compressed(entry.data, 200, {'Content-Type': 'application/json'}, cached=entry)
+
+    def _send_compressed(self, data: bytes, code: int, headers: Dict[str, str], cached: Optional[CachedResponse] = None) -> None:
         accept = self.headers.get('Accept-Encoding', '').lower()
         if 'gzip' in accept and len(data) > 200:
-            data = gzip.compress(data, compresslevel=6)
+            with trace_span('gzip'):
+                data = cached.gzipped if cached is not None else gzip.compress(data, compresslevel=6)
             headers['Content-Encoding'] = 'gzip'
             headers['Vary'] = 'Accept-Encoding'
         headers['Content-Length'] = str(len(data))
@@ -2279,23 +6649,41 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         self.end_headers()
 
     def require_manager(self) -> bool:
-        if not self.server.app_state.get("manager"):
+        if not self.manager:
             self._send_json({"message": "No database selected"}, 400)
             return False
         return True
 
+    def setup(self) -> None:
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def send_response(self, code: int, message: Optional[str] = None) -> None:
+        self.response_status = code
+        super().send_response(code, message)
+
     def route_request(self, method: str) -> None:
         for pattern, handler_name in self.routes.get(method, []):
             m = re.match(pattern, self.path.split('?')[0])
             if m:
                 handler = getattr(self, handler_name)
-                handler(*m.groups())
+                route = pattern.strip('^$')
+                self.response_status = 0
+                written = self.wfile.written
+                trace = TRACER.begin(method, self.path)
+                try:
+                    with Span(trace, 'handler'):
+                        handler(*m.groups())
+                finally:
+                    TRACER.end(trace, self.response_status, keep=self.headers.get('X-Trace') == '1')
+                    HTTP_REQUEST_SECONDS.observe(trace.duration, (method, route, self.response_status))
+                    HTTP_RESPONSE_BYTES.inc(self.wfile.written - written, (method, route))
                 return
         self.send_error(404)
 
     def do_GET(self) -> None:
         if self.path == '/':
-            if not self.server.app_state["manager"]:
+            if not self.manager:
                 self.show_db_selector()
                 return
             self.send_response(200)
@@ -2314,19 +6702,23 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
 
     def show_db_selector(self) -> None:
         files = [f for f in os.listdir('.') if f.endswith('.vault')]
-        file_links = ' '.join(f'<a href="#" onclick="selectDb(\'{f}\')">{f}</a>' for f in files)
+        unlocked = {v['name']: v['url'] for v in self.server.app_state["vaults"].list()}
+        file_links = ' '.join(f'<a href="{unlocked[f]}">{f} (unlocked)</a>' if f in unlocked else
+                              f'<a href="#" onclick="selectDb(\'{f}\')">{f}</a>' for f in files)
         html = HTML_SELECTOR_TEMPLATE.replace('{css}', CSS_SELECTOR_STYLES).replace('{file_links}', file_links)
         self._send_raw(html.encode('utf-8'), headers={'Content-Type': 'text/html'})
 
     def api_get_all_projects(self) -> None:
         if not self.require_manager(): return
-        self._send_json(self.server.app_state["manager"].get_all_projects())
+        manager = self.manager
+        generation, _ = manager.get_generation()
+        self._send_cached_json(('projects', generation), manager.get_all_projects)
 
     def api_get_project(self, project_id_str: str) -> None:
         if not self.require_manager(): return
         try:
             project_id = int(project_id_str)
-            project = self.server.app_state["manager"].get_project(project_id)
+            project = self.manager.get_project(project_id)
             if project:
                 self._send_json(project)
             else:
@@ -2345,7 +6737,7 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             if not name:
                 self._send_json({'message': 'Name is required'}, 400)
                 return
-            pid = self.server.app_state["manager"].create_project(name, type, description)
+            pid = self.manager.create_project(name, type, description)
             self._send_json({'id': pid, 'name': name, 'type': type, 'description': description}, 201)
         except Exception as e:
             self._send_json({'message': f'Create failed: {e}'}, 500)
@@ -2354,7 +6746,10 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         if not self.require_manager(): return
         try:
             project_id = int(project_id_str)
-            self._send_json(self.server.app_state["manager"].get_collections_for_project(project_id))
+            manager = self.manager
+            generation, _ = manager.get_generation()
+            self._send_cached_json(('project_collections', project_id, generation),
+                                   lambda: manager.get_collections_for_project(project_id))
         except ValueError:
             self._send_json({'message': 'Invalid project ID'}, 400)
 
@@ -2362,7 +6757,7 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         if not self.require_manager(): return
         try:
             collection_id = int(collection_id_str)
-            collection = self.server.app_state["manager"].get_collection(collection_id)
+            collection = self.manager.get_collection(collection_id)
             if collection:
                 self._send_json(collection)
             else:
@@ -2382,7 +6777,7 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             if not (project_id and name):
                 self._send_json({'message': 'Project ID and name required'}, 400)
                 return
-            cid = self.server.app_state["manager"].create_collection(project_id, name, type, parent_id)
+            cid = self.manager.create_collection(project_id, name, type, parent_id)
             self._send_json({'id': cid, 'name': name, 'type': type, 'parent_id': parent_id}, 201)
         except Exception as e:
             self._send_json({'message': f'Create failed: {e}'}, 500)
@@ -2399,7 +6794,10 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             filter_by_type = qs.get('filter_by_type', [None])[0]
             sort_by = qs.get('sort_by', ['filename'])[0]
             sort_order = qs.get('sort_order', ['asc'])[0]
-            self._send_json(self.server.app_state["manager"].get_assets_for_collection(collection_id, offset, limit, tag, query, filter_by_type, sort_by, sort_order))
+            manager = self.manager
+            _, generation = manager.get_generation(collection_id)
+            key = ('collection_assets', collection_id, offset, limit, tag, query, filter_by_type, sort_by, sort_order, generation)
+            self._send_cached_json(key, lambda: manager.get_assets_for_collection(collection_id, offset, limit, tag, query, filter_by_type, sort_by, sort_order))
         except ValueError:
             self._send_json({'message': 'Invalid collection ID'}, 400)
 
@@ -2407,67 +6805,236 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
         if not self.require_manager(): return
         try:
             asset_id = int(asset_id_str)
-            preview_data = self.server.app_state["manager"].get_asset_preview(asset_id)
+            preview_data = self.manager.get_asset_preview(asset_id)
             if preview_data:
                 self._send_json(preview_data)
             else:
                 self._send_json({'message': 'Asset not found'}, 404)
         except ValueError:
             self._send_json({'message': 'Invalid asset ID'}, 400)
+        except ChunkIntegrityError as e:
+            self._entity_failed('Preview', e)
 
-    def handle_asset_download(self, asset_id_str: str) -> None:
+    def api_asset_proof(self, asset_id_str: str) -> None:
+        """?start=&end= (inclusive byte offsets, default the whole asset)."""
         if not self.require_manager(): return
+        qs = parse_qs(urlparse(self.path).query)
         try:
-            asset_id = int(asset_id_str)
+            start = int(qs.get('start', ['0'])[0])
+            end = int(qs['end'][0]) if 'end' in qs else None
+            if start < 0 or (end is not None and end < start):
+                raise ValueError('invalid range')
+            proof = self.manager.get_range_proof(int(asset_id_str), start, end)
+        except ValueError as e:
+            self._send_json({'message': f'Invalid request: {e}'}, 400)
+            return
+        if proof is None:
+            self._send_json({'message': 'Asset not found'}, 404)
+            return
+        self._send_json(proof)
 
-            meta = self.server.app_state["manager"].get_asset_metadata(asset_id)
-            if not meta:
-                self.send_error(404)
+    @staticmethod
+    def _parse_digest(digest: Any, size: Any) -> Tuple[str, int]:
+        """Validates a whole-file SHA-256 (64 hex digits) and size; raises ValueError."""
+        if not isinstance(digest, str) or not re.fullmatch(r'[0-9a-fA-F]{64}', digest):
+            raise ValueError('digest must be a hex SHA-256')
+        size = int(size)
+        if size <= 0:
+            raise ValueError('size must be positive')
+        return digest.lower(), size
+
+    def api_asset_lookup(self) -> None:
+        """
+        ?digest=<sha256>&size=<bytes>: whether the vault already holds this
+        exact file. With size alone: whether it holds any file of that size,
+        so a client can skip hashing files that cannot match.
+        """
+        if not self.require_manager(): return
+        qs = parse_qs(urlparse(self.path).query)
+        try:
+            if 'digest' not in qs:
+                size = int(qs.get('size', [None])[0])
+                if size <= 0:
+                    raise ValueError('size must be positive')
+                found = self.manager.has_asset_of_size(size)
+                self._send_json({'found': found, 'size': size}, 200 if found else 404)
                 return
+            digest, size = self._parse_digest(qs.get('digest', [None])[0], qs.get('size', [None])[0])
+        except (TypeError, ValueError) as e:
+            self._send_json({'message': f'Invalid request: {e}'}, 400)
+            return
+        found = self.manager.find_asset_by_digest(digest, size)
+        if found is None:
+            self._send_json({'found': False, 'digest': digest, 'size': size}, 404)
+            return
+        self._send_json(dict(found, found=True))
+
+    def api_clone_asset(self) -> None:
+        """Stores a file the vault already holds (same SHA-256 and size) without uploading it."""
+        if not self.require_manager(): return
+        try:
+            length = int(self.headers.get('content-length', 0))
+            body = json.loads(self.rfile.read(length)) if length else {}
+            digest, size = self._parse_digest(body.get('digest'), body.get('size'))
+            collection_id = int(body.get('collection_id'))
+            filename = body.get('filename')
+            path_prefix = body.get('path_prefix') or ''
+            if not isinstance(filename, str) or not filename or '/' in filename:
+                raise ValueError('filename is required')
+            if not isinstance(path_prefix, str):
+                raise ValueError('path_prefix must be a string')
+        except (AttributeError, TypeError, ValueError, json.JSONDecodeError) as e:
+            self._send_json({'message': f'Invalid request: {e}'}, 400)
+            return
+        try:
+            asset_id = self.manager.clone_asset(collection_id, path_prefix, filename, digest, size)
+        except sqlite3.Error as e:
+            logging.error(f"Clone of {filename} failed: {e}")
+            self._send_json({'message': f'Clone failed: {e}'}, 500)
+            return
+        if asset_id is None:
+            self._send_json({'message': 'No asset with this digest and size; upload the file instead'}, 404)
+            return
+        self._send_json({'asset_id': asset_id, 'cloned': True}, 201)
+
+    def _if_range_matches(self, meta: Dict[str, Any]) -> bool:
+        """Evaluates If-Range; a failed validator means the full entity is sent."""
+        if_range = self.headers.get('If-Range')
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            # Weak validators never match for range requests.
+            return if_range == meta['etag']
+        return meta['last_modified'] is not None and if_range == meta['last_modified']
+
+    def _send_ranged_entity(self, meta: Dict[str, Any], total_size: int, content_type: str,
+                            stream_full: Any, stream_range: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Sends a fixed-length entity honouring Range and If-Range.
+        stream_full() yields the whole body; stream_range(start, end) yields
+        an inclusive byte range of it.
+        """
+        headers = headers or {}
+        range_header = self.headers.get('Range')
+        ranges = None
+        # The first piece is read before the status line, so a chunk that
+        # fails right away still gets a proper error response.
+        full, ranged = stream_full, stream_range
+        stream_full = lambda: self._primed(full())
+        stream_range = lambda start, end: self._primed(ranged(start, end))
+        if range_header and self._if_range_matches(meta):
+            ranges = parse_range_header(range_header, total_size)
+
+        if ranges is not None and not ranges:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{total_size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
 
-            total_size = meta['size']
-            range_header = self.headers.get('Range')
+        if ranges is None:
+            body = stream_full()
+            self.send_response(200)
+            self._send_entity_headers(meta)
+            for k, v in headers.items(): self.send_header(k, v)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(total_size))
+            self.end_headers()
 
-            if range_header:
-                range_match = re.match(r'bytes=(\d+)-(\d*)', range_header)
-                if not range_match:
-                    self.send_error(416, "Invalid Range header")
-                    return
+            for data_chunk in body:
+                self.wfile.write(data_chunk)
+            return
 
-                start_byte = int(range_match.group(1))
-                end_byte_str = range_match.group(2)
-                end_byte = int(end_byte_str) if end_byte_str else total_size - 1
+        if len(ranges) == 1:
+            start_byte, end_byte = ranges[0]
+            body = stream_range(start_byte, end_byte)
+            self.send_response(206)
+            self._send_entity_headers(meta)
+            for k, v in headers.items(): self.send_header(k, v)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Range', f'bytes {start_byte}-{end_byte}/{total_size}')
+            self.send_header('Content-Length', str(end_byte - start_byte + 1))
+            self.end_headers()
 
-                if start_byte >= total_size or end_byte >= total_size or start_byte > end_byte:
-                    self.send_error(416, "Range not satisfiable")
-                    return
+            for data_chunk in body:
+                self.wfile.write(data_chunk)
+            return
 
-                self.send_response(206)
-                self.send_header('Content-Type', meta['mime'])
-                self.send_header('Accept-Ranges', 'bytes')
-                self.send_header('Content-Range', f'bytes {start_byte}-{end_byte}/{total_size}')
+        # multipart/byteranges: part headers are known up front, so the
+        # exact Content-Length can be advertised before streaming.
+        boundary = 'cvrange' + os.urandom(12).hex()
+        part_headers = [
+            (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+             f'Content-Range: bytes {start}-{end}/{total_size}\r\n\r\n').encode('latin-1')
+            for start, end in ranges
+        ]
+        closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+        content_length = sum(len(h) for h in part_headers) + sum(end - start + 1 for start, end in ranges) + len(closing)
+
+        first_part = stream_range(*ranges[0])
+        self.send_response(206)
+        self._send_entity_headers(meta)
+        for k, v in headers.items(): self.send_header(k, v)
+        self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+        self.send_header('Content-Length', str(content_length))
+        self.end_headers()
 
-                content_length = end_byte - start_byte + 1
-                self.send_header('Content-Length', str(content_length))
-                self.end_headers()
+        for i, ((start_byte, end_byte), header) in enumerate(zip(ranges, part_headers)):
+            self.wfile.write(header)
+            for data_chunk in (first_part if i == 0 else stream_range(start_byte, end_byte)):
+                self.wfile.write(data_chunk)
+        self.wfile.write(closing)
 
-                for data_chunk in self.server.app_state["manager"].stream_asset_range(asset_id, start_byte, end_byte):
-                    self.wfile.write(data_chunk)
-            else:
-                self.send_response(200)
-                self.send_header('Content-Type', meta['mime'])
-                self.send_header('Accept-Ranges', 'bytes')
-                self.send_header('Content-Length', str(total_size))
-                self.end_headers()
+    @staticmethod
+    def _primed(stream: Iterator[bytes]) -> Iterator[bytes]:
+        """Pulls the first piece of a body generator now, so its errors surface before headers are sent."""
+        stream = iter(stream)
+        first = next(stream, None)
+        return iter(()) if first is None else itertools.chain((first,), stream)
+
+    def _entity_failed(self, what: str, e: Exception) -> None:
+        """
+        Reports a body that could not be produced. Before the status line
+        that is a 500; once headers (and a Content-Length) are out, the only
+        honest signal left is to cut the connection short.
+        """
+        logging.error(f"{what} error: {e}")
+        if self.response_status:
+            self.close_connection = True
+        elif isinstance(e, ChunkIntegrityError):
+            self._send_json({"message": str(e)}, 500)
+        else:
+            self.send_error(500)
+
+    def handle_asset_download(self, asset_id_str: str) -> None:
+        if not self.require_manager(): return
+        try:
+            asset_id = int(asset_id_str)
+            manager = self.manager
+
+            meta = manager.get_asset_metadata(asset_id)
+            if not meta:
+                self.send_error(404)
+                return
 
-                for data_chunk in self.server.app_state["manager"].stream_asset_data(asset_id):
-                    self.wfile.write(data_chunk)
+            manifest = meta['manifest']
+            offsets = manager.chunk_offsets(manifest)
+            self._send_ranged_entity(
+                meta, meta['size'], meta['mime'],
+                lambda: manager.stream_asset_data(asset_id),
+                lambda start, end: manager.stream_asset_range(asset_id, start, end, manifest, offsets))
 
         except ValueError:
             self.send_error(400)
         except Exception as e:
-            logging.error(f"Download error: {e}")
-            self.send_error(500)
+            self._entity_failed('Download', e)
+
+    def _send_entity_headers(self, meta: Dict[str, Any]) -> None:
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', meta['etag'])
+        if meta['last_modified']:
+            self.send_header('Last-Modified', meta['last_modified'])
 
     def handle_bulk_download(self, collection_id_str: str) -> None:
         if not self.require_manager(): return
@@ -2478,19 +7045,21 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             if not ids:
                 self.send_error(400)
                 return
+            fmt = self._requested_export_format(body.get('format'))
+            if fmt is None: return
+            manager = self.manager
+            entries = manager.resolve_export_entries_for_ids(ids)
+            label = f"selection of collection {collection_id_str}"
+            if fmt != 'zip':
+                self._send_tar(entries, 'selected_assets', fmt, label)
+                return
             self.send_response(200)
             self.send_header('Content-Type', 'application/zip')
             self.send_header('Content-Disposition', 'attachment; filename="selected_assets.zip"')
             self.end_headers()
-            with zipfile.ZipFile(self.wfile, 'w', compression=zipfile.ZIP_STORED) as zf:
-                for aid in ids:
-                    meta = self.server.app_state["manager"].get_asset_metadata(aid)
-                    if meta:
-                        path_in_zip = meta['filename']
-                        self.server.app_state["manager"].write_asset_to_zip(aid, zf, path_in_zip)
+            ExportPipeline(manager, entries, label=label).write_zip(self.wfile)
         except Exception as e:
-            logging.error(f"Bulk download error: {e}")
-            self.send_error(500)
+            self._entity_failed('Bulk download', e)
 
     def api_unlock_vault(self) -> None:
         try:
@@ -2499,16 +7068,19 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             db_name = body.get('db')
             password = body.get('password')
 
-            if not db_name or not password or not db_name.endswith('.vault'):
+            vaults = self.server.app_state["vaults"]
+            if not password or not vaults.valid_name(db_name):
                 self._send_json({'message': 'Invalid request'}, 400)
                 return
+            if not os.path.exists(db_name):
+                self._send_json({'message': 'Vault not found'}, 404)
+                return
+            if vaults.replicating_into(db_name):
+                self._send_json({'message': f'{db_name} is the target of a running replication'}, 409)
+                return
 
-            manager = CompactVaultManager(db_name)
-            if manager.check_password(password):
-                self.server.app_state["db_path"] = db_name
-                self.server.app_state["manager"] = manager
-                self.server.app_state["rendered_html"] = HTML_TEMPLATE.replace('{css}', CSS_STYLES).replace('{js}', JAVASCRIPT_CODE).encode('utf-8')
-                self._send_json({'message': f'Unlocked {db_name}'})
+            if vaults.unlock(db_name, password):
+                self._send_json({'message': f'Unlocked {db_name}', 'url': f'/v/{quote(db_name, safe="")}/'})
             else:
                 self._send_json({'message': 'Invalid password'}, 401)
 
@@ -2522,7 +7094,8 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             db_name = body.get('db')
             password = body.get('password')
 
-            if not db_name or not password or not db_name.endswith('.vault'):
+            vaults = self.server.app_state["vaults"]
+            if not password or not vaults.valid_name(db_name):
                 self._send_json({'message': 'Invalid request'}, 400)
                 return
 
@@ -2530,52 +7103,319 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
                 self._send_json({'message': 'Vault already exists'}, 400)
                 return
 
-            manager = CompactVaultManager(db_name)
-            manager.set_password(password)
-            self._send_json({'message': f'Created and unlocked {db_name}'}, 201)
-
             # Automatically unlock the new vault
-            self.server.app_state["db_path"] = db_name
-            self.server.app_state["manager"] = manager
-            self.server.app_state["rendered_html"] = HTML_TEMPLATE.replace('{css}', CSS_STYLES).replace('{js}', JAVASCRIPT_CODE).encode('utf-8')
+            vaults.unlock(db_name, password, create=True)
+            self._send_json({'message': f'Created and unlocked {db_name}', 'url': f'/v/{quote(db_name, safe="")}/'}, 201)
 
         except Exception as e:
             self._send_json({'message': f'Vault creation failed: {e}'}, 500)
 
+    def api_list_vaults(self) -> None:
+        self._send_json({'vaults': self.server.app_state["vaults"].list()})
+
+    def api_metrics(self) -> None:
+        if not self.require_manager(): return
+        body = METRICS.render(self.manager.metric_samples()).encode('utf-8')
+        self._send_raw(body, headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    def api_get_traces(self) -> None:
+        if not self.require_manager(): return
+        self._send_json({'slow_request_ms': TRACER.slow_seconds * 1000,
+                         'traces': [t.summary() for t in reversed(TRACER.traces())]})
+
+    def api_export_traces(self, trace_id_str: Optional[str] = None) -> None:
+        """Retained traces as Chrome trace JSON, loadable in chrome://tracing or Perfetto."""
+        if not self.require_manager(): return
+        if trace_id_str is None:
+            traces = TRACER.traces()
+        else:
+            trace = TRACER.get(int(trace_id_str))
+            if trace is None:
+                self._send_json({'message': 'Trace not found'}, 404)
+                return
+            traces = [trace]
+        events = [event for trace in traces for event in trace.chrome_events()]
+        self._send_json({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+    def api_configure_tracing(self) -> None:
+        if not self.require_manager(): return
+        try:
+            length = int(self.headers.get('content-length', 0))
+            body = json.loads(self.rfile.read(length)) if length else {}
+            slow_ms = float(body['slow_request_ms'])
+            if slow_ms < 0:
+                raise ValueError(slow_ms)
+        except (KeyError, TypeError, ValueError, json.JSONDecodeError):
+            self._send_json({'message': 'slow_request_ms must be a non-negative number'}, 400)
+            return
+        TRACER.slow_seconds = slow_ms / 1000.0
+        self._send_json({'slow_request_ms': slow_ms})
+
+    def api_get_stats(self) -> None:
+        if not self.require_manager(): return
+        self._send_json(self.manager.get_stats())
+
+    def api_replication_sync(self) -> None:
+        if not self.require_manager(): return
+        manager = self.manager
+        try:
+            length = int(self.headers.get('content-length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+        except (ValueError, json.JSONDecodeError):
+            body = {}
+        target = body.get('target')
+        password = body.get('password')
+        vaults = self.server.app_state["vaults"]
+        # Targets are vault files beside the hosted ones, like the names /api/create_vault accepts.
+        if not password or not vaults.valid_name(target) or os.path.basename(target) != target:
+            self._send_json({'message': 'target (a .vault file name in the vault directory) and password are required'}, 400)
+            return
+        if os.path.abspath(target) == os.path.abspath(manager.db_path):
+            self._send_json({'message': 'Cannot replicate a vault into itself'}, 400)
+            return
+        if target in vaults.vaults or vaults.replicating_into(target):
+            self._send_json({'message': f'{target} is in use by this server'}, 409)
+            return
+        if not manager.check_password(password):
+            self._send_json({'message': 'Invalid password'}, 401)
+            return
+        if not manager.start_replication(target, password):
+            self._send_json({'message': 'Replication already running'}, 409)
+            return
+        self._send_json({'message': f'Replicating to {target}'}, 202)
+
+    def api_replication_status(self) -> None:
+        if not self.require_manager(): return
+        replication = self.manager.replication
+        self._send_json(replication.status() if replication else {'state': 'idle'})
+
+    def api_get_jobs(self) -> None:
+        if not self.require_manager(): return
+        qs = parse_qs(urlparse(self.path).query)
+        try:
+            ids = [int(i) for i in qs.get('ids', [''])[0].split(',') if i]
+            limit = min(int(qs.get('limit', ['100'])[0]), 1000)
+        except ValueError:
+            self._send_json({'message': 'ids and limit must be integers'}, 400)
+            return
+        jobs = self.manager.jobs
+        self._send_json({'jobs': jobs.list(qs.get('state', [None])[0], ids, max(limit, len(ids))), **jobs.summary()})
+
+    def api_get_job(self, job_id: str) -> None:
+        if not self.require_manager(): return
+        job = self.manager.jobs.get(int(job_id))
+        if job is None:
+            self._send_json({'message': 'Job not found'}, 404)
+            return
+        self._send_json(job)
+
+    def api_get_exports(self) -> None:
+        if not self.require_manager(): return
+        exports = list(self.manager.active_exports.values())
+        self._send_json([e.progress() for e in exports])
+
     def api_vacuum(self) -> None:
         if not self.require_manager(): return
-        self.server.app_state["manager"].vacuum()
+        self.manager.vacuum()
         self._send_json({'message': 'VACUUM complete'})
 
+    def api_wal_status(self) -> None:
+        if not self.require_manager(): return
+        self._send_json(self.manager.checkpointer.metrics())
+
+    def api_verify_status(self) -> None:
+        if not self.require_manager(): return
+        self._send_json(self.manager.verify_status())
+
+    def api_configure_verify(self) -> None:
+        if not self.require_manager(): return
+        manager = self.manager
+        try:
+            length = int(self.headers.get('content-length', 0))
+            body = json.loads(self.rfile.read(length)) if length else {}
+            enabled = body.get('enabled')
+            entries = body.get('cache_entries')
+            if enabled is not None and not isinstance(enabled, bool):
+                raise ValueError(enabled)
+            if entries is not None and (isinstance(entries, bool) or int(entries) < 0):
+                raise ValueError(entries)
+        except (AttributeError, TypeError, ValueError, json.JSONDecodeError):
+            self._send_json({'message': 'enabled must be a boolean and cache_entries a non-negative integer'}, 400)
+            return
+        if enabled is not None:
+            manager.verify_reads = enabled
+        if entries is not None:
+            manager.verified_chunks.resize(int(entries))
+        self._send_json(manager.verify_status())
+
+    def api_space_status(self) -> None:
+        if not self.require_manager(): return
+        self._send_json(self.manager.space_reclaimer.estimate())
+
+    def api_space_reclaim(self) -> None:
+        if not self.require_manager(): return
+        reclaimer = self.manager.space_reclaimer
+        freed = reclaimer.reclaim(force=True)
+        self._send_json({'pages_freed': freed, 'space': reclaimer.estimate()})
+
+    def api_space_convert(self) -> None:
+        if not self.require_manager(): return
+        if not self.manager.space_reclaimer.convert_online():
+            self._send_json({'message': 'Vault already uses incremental auto_vacuum or a conversion is running'}, 409)
+            return
+        self._send_json({'message': 'Conversion started'}, 202)
+
+    def api_scrub_status(self) -> None:
+        if not self.require_manager(): return
+        self._send_json(self.manager.scrubber.status())
+
+    def api_scrub_report(self) -> None:
+        if not self.require_manager(): return
+        qs = parse_qs(urlparse(self.path).query)
+        try:
+            limit = int(qs.get('limit', [100])[0])
+        except ValueError:
+            self._send_json({'message': 'Invalid limit'}, 400)
+            return
+        self._send_json(self.manager.scrubber.report(limit))
+
+    def api_scrub_start(self) -> None:
+        if not self.require_manager(): return
+        try:
+            length = int(self.headers.get('content-length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            started = self.manager.scrubber.start(
+                incremental=bool(body.get('incremental', False)),
+                io_limit_mb=float(body.get('io_limit_mb', 0)),
+                cpu_fraction=float(body.get('cpu_fraction', 0.5)),
+                workers=int(body['workers']) if body.get('workers') else None)
+            if not started:
+                self._send_json({'message': 'Scrub already running'}, 409)
+                return
+            self._send_json({'message': 'Scrub started'}, 202)
+        except (ValueError, TypeError) as e:
+            self._send_json({'message': f'Invalid scrub options: {e}'}, 400)
+
+    def api_scrub_pause(self) -> None:
+        if not self.require_manager(): return
+        self.manager.scrubber.stop()
+        self._send_json(self.manager.scrubber.status())
+
+    def api_scrub_resume(self) -> None:
+        if not self.require_manager(): return
+        if not self.manager.scrubber.resume():
+            self._send_json({'message': 'No paused scrub to resume'}, 409)
+            return
+        self._send_json({'message': 'Scrub resumed'}, 202)
+
+    def api_open_upload_session(self) -> None:
+        if not self.require_manager(): return
+        try:
+            length = int(self.headers.get('content-length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            upload_id = body.get('upload_id')
+            size = int(body['size']) if body.get('size') is not None else None
+            chunk_size = int(body['chunk_size']) if body.get('chunk_size') is not None else None
+            collection_id = int(body['collection_id']) if body.get('collection_id') is not None else None
+        except (ValueError, TypeError, json.JSONDecodeError):
+            self._send_json({'message': 'size, chunk_size and collection_id must be integers'}, 400)
+            return
+        if not UploadSessions.valid_id(upload_id) or (size is not None and size < 0) or (chunk_size is not None and chunk_size <= 0):
+            self._send_json({'message': 'Invalid upload session'}, 400)
+            return
+        session = self.manager.uploads.open(
+            upload_id, body.get('filename'), collection_id, body.get('path_prefix', ''), size, chunk_size)
+        self._send_json(session)
+
+    def api_upload_session_status(self, upload_id: str) -> None:
+        if not self.require_manager(): return
+        with_parts = parse_qs(urlparse(self.path).query).get('parts', ['0'])[0] == '1'
+        session = self.manager.uploads.status(upload_id, with_parts)
+        if session is None:
+            self._send_json({'message': 'Upload session not found'}, 404)
+            return
+        self._send_json(session)
+
     def api_upload_chunk(self) -> None:
+        if not self.require_manager(): return
         try:
             qs = parse_qs(urlparse(self.path).query)
             upload_id = qs.get('upload_id', [None])[0]
             chunk_index = int(qs.get('chunk_index', [-1])[0])
             logging.info(f"Received chunk {chunk_index} for upload {upload_id}")
-            if not upload_id or chunk_index < 0:
-                self._send_json({'message': 'Missing upload_id or chunk_index'}, 400)
+            if not UploadSessions.valid_id(upload_id) or chunk_index < 0:
+                self._send_json({'message': 'Missing or invalid upload_id or chunk_index'}, 400)
                 return
 
-            upload_dir = os.path.join(UPLOAD_TEMP_DIR, upload_id)
+            length = int(self.headers.get('content-length'))
+            manager = self.manager
+            refusal = manager.jobs.admit(length, new_job=False)
+            if refusal:
+                self._send_refusal(refusal)
+                return
+
+            upload_dir = manager.uploads.dir(upload_id)
             os.makedirs(upload_dir, exist_ok=True)
             chunk_path = os.path.join(upload_dir, str(chunk_index))
 
-            length = int(self.headers.get('content-length'))
-            with open(chunk_path, 'wb') as f:
+            # Written aside and renamed into place, so a dropped connection never leaves a short part behind.
+            digest = hashlib.sha256()
+            partial_path = chunk_path + '.partial'
+            with open(partial_path, 'wb') as f:
                 remaining = length
                 while remaining > 0:
-                    buf = self.rfile.read(min(remaining, 4096))
+                    buf = self.rfile.read(min(remaining, 1048576))
                     if not buf:
                         raise EOFError("Unexpected end of stream")
+                    digest.update(buf)
                     f.write(buf)
                     remaining -= len(buf)
+            sha256 = digest.hexdigest()
+            expected = self.headers.get('X-Content-SHA256')
+            if expected and expected.lower() != sha256:
+                os.remove(partial_path)
+                self._send_json({'message': f'Checksum mismatch for chunk {chunk_index}', 'sha256': sha256}, 422)
+                return
+            with open(chunk_path + '.sha256', 'w') as f:
+                f.write(sha256)
+            manager.uploads.store_part(upload_id, chunk_index, partial_path)
 
-            self._send_json({'message': 'Chunk received'})
+            self._send_json({'message': 'Chunk received', 'sha256': sha256})
         except Exception as e:
             logging.error(f"Chunk upload failed: {e}")
             self._send_json({'message': f'Chunk upload failed: {e}'}, 500)
 
+    def api_upload_batch(self) -> None:
+        if not self.require_manager(): return
+        manager = self.manager
+        try:
+            collection_id = int(parse_qs(urlparse(self.path).query).get('collection_id', [''])[0])
+            length = int(self.headers.get('content-length'))
+        except (TypeError, ValueError):
+            self._send_json({'message': 'collection_id and Content-Length are required'}, 400)
+            return
+        if length > BATCH_MAX_BYTES:
+            self._send_json({'message': f'Batch larger than {BATCH_MAX_BYTES} bytes'}, 413)
+            return
+        refusal = manager.jobs.admit(length, new_job=False)
+        if refusal:
+            self._send_refusal(refusal)
+            return
+        try:
+            with trace_span('batch.encode'):
+                files = [EncodedFile(path, name, data) for path, name, data in read_upload_batch(self.rfile, length)]
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json({'message': f'Invalid batch: {e}'}, 400)
+            return
+        try:
+            asset_ids = manager.create_assets_from_buffers(collection_id, files)
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Batch upload failed: {e}")
+            self._send_json({'message': f'Batch upload failed: {e}'}, 500)
+            return
+        self._send_json({'files': len(files), 'bytes': sum(f.size for f in files),
+                         'assets': [{'path': f.path_prefix, 'name': f.filename, 'asset_id': a} for f, a in zip(files, asset_ids)]}, 201)
+
     def api_complete_upload(self) -> None:
         if not self.require_manager(): return
         try:
@@ -2585,80 +7425,143 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             filename = body.get('filename')
             collection_id = int(body.get('collection_id'))
             path_prefix = body.get('path_prefix', '')
+            expand = bool(body.get('expand'))
             logging.info(f"Completing upload for {filename} (upload_id: {upload_id}) in collection {collection_id}")
 
             if not all([upload_id, filename, collection_id is not None]):
                 self._send_json({'message': 'Missing required fields'}, 400)
                 return
 
-            upload_dir = os.path.join(UPLOAD_TEMP_DIR, upload_id)
-            if not os.path.isdir(upload_dir):
+            if expand and archive_root_name(filename) is None:
+                self._send_json({'message': f"Cannot expand {filename}; supported archives: {', '.join(ARCHIVE_SUFFIXES)}"}, 400)
+                return
+
+            manager = self.manager
+            upload_dir = manager.uploads.dir(upload_id) if UploadSessions.valid_id(upload_id) else None
+            if not upload_dir or not os.path.isdir(upload_dir):
                 self._send_json({'message': 'Invalid upload_id'}, 400)
                 return
 
-            chunk_files = sorted(os.listdir(upload_dir), key=int)
+            session = manager.uploads.status(upload_id)
+            if session and session['state'] == 'ingesting':
+                # A retried completion: the first one already queued the ingest.
+                self._send_json({'message': 'Upload accepted, processing in background', 'job_id': session['job_id']}, 202)
+                return
+            refusal = manager.jobs.admit()
+            if refusal:
+                self._send_refusal(refusal)
+                return
+
+            chunk_files = sorted((f for f in os.listdir(upload_dir) if f.isdigit()), key=int)
+            missing = manager.uploads.missing_parts(upload_id, chunk_files)
+            if missing:
+                self._send_json({'message': f'{len(missing)} chunks missing', 'missing': missing[:1000]}, 409)
+                return
             chunk_paths = [os.path.join(upload_dir, cf) for cf in chunk_files]
+            total_bytes = sum(os.path.getsize(p) for p in chunk_paths)
+            job = manager.jobs.create(collection_id, filename, total_bytes, upload_id, expand)
+            manager.uploads.mark_ingesting(upload_id, job.id, total_bytes)
 
             # The worker will resolve the path to ensure atomicity
             # Add task to the queue with the unresolved path
-            task = (collection_id, path_prefix, chunk_paths, filename)
-            self.server.app_state["manager"].asset_creation_queue.put(task)
+            task = (job, collection_id, path_prefix, chunk_paths, filename)
+            manager.submit_ingest(task)
 
-            self._send_json({'message': 'Upload accepted, processing in background'})
+            self._send_json({'message': 'Upload accepted, processing in background', 'job_id': job.id}, 202)
         except Exception as e:
             self._send_json({'message': f'Upload completion failed: {e}'}, 500)
 
+    def _requested_export_format(self, default: Optional[str] = None) -> Optional[str]:
+        """Reads ?format= (zip, tar or a TAR_CODECS key); sends 400 and returns None if unsupported."""
+        qs = parse_qs(urlparse(self.path).query)
+        fmt = (qs.get('format', [default or 'zip'])[0] or 'zip').lower()
+        if fmt in ('zip', 'tar') or fmt in TAR_CODECS:
+            return fmt
+        self._send_json({'message': f'Unsupported export format: {fmt}',
+                         'formats': ['zip', 'tar'] + sorted(TAR_CODECS)}, 400)
+        return None
+
+    def _send_tar(self, entries: List[Tuple[int, str, int]], name: str, fmt: str, label: str) -> None:
+        codec = fmt if fmt in TAR_CODECS else None
+        content_type, extension = (TAR_CODECS[codec][0], TAR_CODECS[codec][1]) if codec else ('application/x-tar', 'tar')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Disposition', f'attachment; filename="{name}.{extension}"')
+        self.end_headers()
+        ExportPipeline(self.manager, entries, label=label).write_tar(self.wfile, codec)
+
+    def _send_streamed_zip(self, entries: List[Tuple[int, str, int]], zip_filename: str, label: str) -> None:
+        """A zip with data descriptors, for scopes whose CRCs are still being backfilled: no length, no ranges."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', f'attachment; filename="{zip_filename}"')
+        self.end_headers()
+        ExportPipeline(self.manager, entries, label=label).write_zip(self.wfile)
+
+    def _send_zip_layout(self, layout: ZipLayout, zip_filename: str, label: str) -> None:
+        manager = self.manager
+        meta = {'etag': layout.etag, 'last_modified': None}
+        self._send_ranged_entity(
+            meta, layout.total_size, 'application/zip',
+            lambda: layout.iter_full(manager, label),
+            lambda start, end: layout.iter_range(manager, start, end),
+            {'Content-Disposition': f'attachment; filename="{zip_filename}"'})
+
     def api_download_project(self, project_id_str: str) -> None:
         if not self.require_manager(): return
         try:
             project_id = int(project_id_str)
-            proj = self.server.app_state["manager"].get_project(project_id)
+            manager = self.manager
+            proj = manager.get_project(project_id)
             if not proj:
                 self.send_error(404)
                 return
 
-            zip_filename = f"{proj['name']}.zip"
-
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/zip')
-            self.send_header('Content-Disposition', f'attachment; filename="{zip_filename}"')
-            self.end_headers()
+            fmt = self._requested_export_format()
+            if fmt is None: return
+            if fmt != 'zip':
+                entries = manager.resolve_export_entries_for_project(project_id)
+                self._send_tar(entries, proj['name'], fmt, f"project {project_id}")
+                return
 
-            with zipfile.ZipFile(self.wfile, 'w', compression=zipfile.ZIP_STORED) as zf:
-                asset_paths = self.server.app_state["manager"].get_asset_ids_with_paths_for_project(project_id)
-                for aid, path_in_zip in asset_paths:
-                    self.server.app_state["manager"].write_asset_to_zip(aid, zf, path_in_zip)
+            layout = manager.get_zip_layout('project', project_id)
+            if layout is None:
+                entries = manager.resolve_export_entries_for_project(project_id)
+                self._send_streamed_zip(entries, f"{proj['name']}.zip", f"project {project_id}")
+                return
+            self._send_zip_layout(layout, f"{proj['name']}.zip", f"project {project_id}")
         except ValueError:
             self.send_error(400)
         except Exception as e:
-            logging.error(f"Project download error: {e}")
-            self.send_error(500)
+            self._entity_failed('Project download', e)
 
     def api_download_collection(self, collection_id_str: str) -> None:
         if not self.require_manager(): return
         try:
             collection_id = int(collection_id_str)
-            coll = self.server.app_state["manager"].get_collection(collection_id)
+            manager = self.manager
+            coll = manager.get_collection(collection_id)
             if not coll:
                 self.send_error(404)
                 return
 
-            zip_filename = f"{coll['name']}.zip"
-
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/zip')
-            self.send_header('Content-Disposition', f'attachment; filename="{zip_filename}"')
-            self.end_headers()
+            fmt = self._requested_export_format()
+            if fmt is None: return
+            if fmt != 'zip':
+                entries = manager.resolve_export_entries_for_collection(collection_id)
+                self._send_tar(entries, coll['name'], fmt, f"collection {collection_id}")
+                return
 
-            with zipfile.ZipFile(self.wfile, 'w', compression=zipfile.ZIP_STORED) as zf:
-                asset_paths = self.server.app_state["manager"].get_asset_ids_with_paths_for_collection(collection_id)
-                for aid, path_in_zip in asset_paths:
-                    self.server.app_state["manager"].write_asset_to_zip(aid, zf, path_in_zip)
+            layout = manager.get_zip_layout('collection', collection_id)
+            if layout is None:
+                entries = manager.resolve_export_entries_for_collection(collection_id)
+                self._send_streamed_zip(entries, f"{coll['name']}.zip", f"collection {collection_id}")
+                return
+            self._send_zip_layout(layout, f"{coll['name']}.zip", f"collection {collection_id}")
         except ValueError:
             self.send_error(400)
         except Exception as e:
-            logging.error(f"Collection download error: {e}")
-            self.send_error(500)
+            self._entity_failed('Collection download', e)
 
 def run(server_class: type = ThreadedHTTPServer, handler_class: type = RequestHandler, port: int = 8000) -> None:
     # Find a free port first
@@ -2675,10 +7578,11 @@ def run(server_class: type = ThreadedHTTPServer, handler_class: type = RequestHa
                 raise
 
     # Setup server state
+    vaults = VaultRegistry()
+    vaults.start()
     server.app_state = {
-        "db_path": None,
-        "manager": None,
-        "rendered_html": None,
+        "vaults": vaults,
+        "rendered_html": HTML_TEMPLATE.replace('{css}', CSS_STYLES).replace('{js}', JAVASCRIPT_CODE).encode('utf-8'),
         "password": None
     }
 
@@ -2686,29 +7590,10 @@ def run(server_class: type = ThreadedHTTPServer, handler_class: type = RequestHa
     def signal_handler(sig: int, frame: Any) -> None:
         logging.info('Shutdown signal received. Starting graceful shutdown...')
 
-        manager = server.app_state.get("manager")
-        if manager:
-            # 1. Signal all worker threads to stop by sending a sentinel value.
-            logging.info(f"Signaling {len(manager.workers)} worker threads to terminate...")
-            for _ in manager.workers:
-                manager.asset_creation_queue.put(None)
-
-            # 2. Wait for all worker threads to complete their current tasks.
-            for t in manager.workers:
-                t.join()
-            logging.info("All worker threads have completed.")
-
-            # 3. Now that no threads are using the connection, safely checkpoint and close.
-            try:
-                logging.info("Running final database checkpoint...")
-                # TRUNCATE is more aggressive than FULL and ideal for shutdown.
-                manager.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-                manager.conn.close()
-                logging.info("Database connection closed.")
-            except Exception as e:
-                logging.error(f"Error during final DB cleanup: {e}")
+        # Drains and checkpoints every open vault.
+        vaults.close_all()
         
-        # 4. Finally, stop the server loop.
+        # Finally, stop the server loop.
         # This must be called from a separate thread to unblock `serve_forever`.
         logging.info("Stopping HTTP server...")
         threading.Thread(target=server.shutdown).start()
@@ -2723,5 +7608,102 @@ def run(server_class: type = ThreadedHTTPServer, handler_class: type = RequestHa
     server.serve_forever()
     logging.info("Server has been shut down gracefully.")
 
+def import_main(argv: List[str]) -> int:
+    """`python server.py import <vault> <dir>`: bulk import a local tree without the web UI."""
+    parser = argparse.ArgumentParser(prog='server.py import', description='Import a directory tree into a vault.')
+    parser.add_argument('vault', help='vault file; created if it does not exist')
+    parser.add_argument('source', help='directory to import; sub-directories become nested collections')
+    parser.add_argument('--project', required=True, help='project name (created if missing)')
+    parser.add_argument('--collection', help='top-level collection name (default: the source directory name)')
+    parser.add_argument('--password', help='vault password (default: $COMPACTVAULT_PASSWORD or a prompt)')
+    parser.add_argument('--workers', type=int, help='chunking threads')
+    parser.add_argument('--batch-files', type=int, default=500, help='files per transaction')
+    parser.add_argument('--batch-mb', type=int, default=256, help='megabytes per transaction')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source):
+        parser.error(f'{args.source} is not a directory')
+    password = args.password or os.environ.get('COMPACTVAULT_PASSWORD') or getpass.getpass(f'Password for {args.vault}: ')
+    logging.getLogger().setLevel(logging.WARNING)
+
+    is_new = not os.path.exists(args.vault)
+    manager = CompactVaultManager(args.vault)
+    try:
+        if is_new:
+            manager.set_password(password)
+        elif not manager.check_password(password):
+            print('Invalid password', file=sys.stderr)
+            return 1
+
+        collection_name = args.collection or os.path.basename(os.path.abspath(args.source))
+        with manager._get_read_conn() as conn:
+            row = conn.execute("SELECT id FROM projects WHERE name = ? ORDER BY id LIMIT 1", (args.project,)).fetchone()
+        project_id = row['id'] if row else manager.create_project(args.project, 'project', '')
+        with manager._get_read_conn() as conn:
+            row = conn.execute("SELECT id FROM collections WHERE project_id = ? AND parent_id IS NULL AND name = ? ORDER BY id LIMIT 1",
+                               (project_id, collection_name)).fetchone()
+        collection_id = row['id'] if row else manager.create_collection(project_id, collection_name, 'collection', None)
+
+        importer = BulkImporter(manager, args.source, collection_id, workers=args.workers,
+                                batch_files=args.batch_files, batch_bytes=args.batch_mb * 1048576)
+        result = importer.run()
+        print(f"Imported {result['files']} files ({result['bytes'] / 1e9:.2f} GB) in {result['seconds']:.1f}s; "
+              f"{result['skipped']} unchanged files skipped; {result['unchanged']} with only a new mtime re-recorded; "
+              f"{result['cloned']} stored as copies of existing assets; "
+              f"{result['errors']} errors", file=sys.stderr)
+        for path, error in importer.errors[:20]:
+            print(f'  {path}: {error}', file=sys.stderr)
+        return 1 if importer.errors else 0
+    finally:
+        manager.close()
+
+
+def sync_main(argv: List[str]) -> int:
+    """`python server.py sync <source> <target>`: copy what the target is missing from the source."""
+    parser = argparse.ArgumentParser(prog='server.py sync', description='Incrementally replicate one vault into another.')
+    parser.add_argument('source', help='vault to copy from')
+    parser.add_argument('target', help='replica vault; created if it does not exist')
+    parser.add_argument('--password', help='vault password (default: $COMPACTVAULT_PASSWORD or a prompt)')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        parser.error(f'{args.source} does not exist')
+    if os.path.abspath(args.source) == os.path.abspath(args.target):
+        parser.error('source and target are the same vault')
+    password = args.password or os.environ.get('COMPACTVAULT_PASSWORD') or getpass.getpass(f'Password for {args.source}: ')
+    logging.getLogger().setLevel(logging.WARNING)
+
+    source = CompactVaultManager(args.source)
+    try:
+        if not source.check_password(password):
+            print('Invalid password', file=sys.stderr)
+            return 1
+        replicator = VaultReplicator(source, args.target, password)
+        done = threading.Event()
+
+        def report() -> None:
+            while not done.wait(2.0):
+                st = replicator.status()
+                print(f"  {st['assets_done']}/{st['assets_total']} assets, {st['chunks_copied']} chunks "
+                      f"({st['bytes_copied'] / 1048576:.1f} MB) copied", file=sys.stderr)
+
+        threading.Thread(target=report, daemon=True).start()
+        result = replicator.run()
+        done.set()
+        if result['state'] != 'done':
+            print(f"Sync failed: {result['error']}", file=sys.stderr)
+            return 1
+        print(f"Synced {result['assets_done']} assets in {result['elapsed']:.1f}s: {result['chunks_copied']} chunks "
+              f"({result['bytes_copied'] / 1048576:.1f} MB) copied, {result['chunks_already_present']} already present",
+              file=sys.stderr)
+        return 0
+    finally:
+        source.close()
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        sys.exit(import_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'sync':
+        sys.exit(sync_main(sys.argv[2:]))
     run()
@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in a scratch directory, since vaults and upload parts live relative to the cwd."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def manager(workdir):
+    m = server.CompactVaultManager('test.vault')
+    m.set_password('pw')
+    yield m
+    m.close()
+
+
+@pytest.fixture
+def hosted(workdir):
+    """An HTTP server with test.vault unlocked; yields (base URL of the vault, registry)."""
+    registry = server.VaultRegistry()
+    registry.unlock('test.vault', 'pw', create=True)
+    httpd = server.ThreadedHTTPServer(('127.0.0.1', 0), server.RequestHandler)
+    httpd.daemon_threads = True
+    httpd.app_state = {'vaults': registry, 'rendered_html': b'', 'password': None}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/v/test.vault', registry
+    httpd.shutdown()
+    httpd.server_close()
+    registry.close_all()
+
+
+def request(url, body=None, headers=None, method=None):
+    """Returns (status, headers, body bytes); JSON-encodes dict bodies."""
+    headers = dict(headers or {})
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+        headers.setdefault('Content-Type', 'application/json')
+    req = urllib.request.Request(url, data=body, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def add_file(manager, collection_id, filename, data, path_prefix=''):
+    """Ingests data the way a completed upload does and returns the asset id."""
+    upload_dir = os.path.join(server.UPLOAD_TEMP_DIR, 'test-' + os.urandom(4).hex())
+    os.makedirs(upload_dir)
+    paths = []
+    for offset in range(0, max(len(data), 1), server.UPLOAD_PIECE_SIZE):
+        path = os.path.join(upload_dir, str(len(paths)))
+        with open(path, 'wb') as f:
+            f.write(data[offset:offset + server.UPLOAD_PIECE_SIZE])
+        paths.append(path)
+    return manager.create_asset_from_chunks(collection_id, path_prefix, paths, filename)
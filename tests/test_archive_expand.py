@@ -0,0 +1,153 @@
+import io
+import json
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+import server
+from conftest import request
+
+
+def _wait_for_job(manager, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = manager.jobs.get(job_id)
+        if job['state'] in ('done', 'failed'):
+            return job
+        assert time.monotonic() < deadline, 'ingest did not finish'
+        time.sleep(0.02)
+
+
+def _expand(base, manager, filename, data):
+    """Uploads data as one part, completes it with expand and returns (job, {member path: content})."""
+    project_id = manager.create_project('P', 'project', '')
+    collection_id = manager.create_collection(project_id, 'C', 'collection', None)
+    upload_id = 'up-' + filename.replace('.', '-')
+    status, _, _ = request(base + '/api/upload/sessions', {'upload_id': upload_id, 'filename': filename, 'size': len(data),
+                                                          'chunk_size': 5 * 1024 * 1024, 'collection_id': collection_id})
+    assert status == 200
+    status, _, _ = request(f'{base}/api/upload/chunk?upload_id={upload_id}&chunk_index=0', data,
+                           {'Content-Type': 'application/octet-stream'})
+    assert status == 200
+    status, _, body = request(base + '/api/upload/complete', {'upload_id': upload_id, 'filename': filename,
+                                                               'collection_id': collection_id, 'expand': True})
+    assert status == 202
+    job = _wait_for_job(manager, json.loads(body)['job_id'])
+    with manager._get_read_conn() as conn:
+        entries = manager._resolve_export_entries(conn, "SELECT ?", (collection_id,), "")
+    # Paths start with the seed collection's own name.
+    return job, {path.split('/', 1)[1]: b''.join(manager.stream_asset_data(asset_id)) for asset_id, path, _ in entries}
+
+
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def _tar(members, mode='w'):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tf:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _set_encrypted_flag(archive, name):
+    """Marks one member of a stored zip as encrypted, in its local header and central directory entry."""
+    raw = bytearray(archive)
+    encoded = name.encode()
+    for signature, flag_offset, name_offset in ((b'PK\x03\x04', 6, 30), (b'PK\x01\x02', 8, 46)):
+        pos = raw.find(signature)
+        while pos != -1:
+            if raw[pos + name_offset:pos + name_offset + len(encoded)] == encoded:
+                raw[pos + flag_offset] |= 1
+            pos = raw.find(signature, pos + 4)
+    return bytes(raw)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('a.txt', ('', 'a.txt')),
+    ('dir/sub/a.txt', ('dir/sub', 'a.txt')),
+    ('../../etc/passwd', ('etc', 'passwd')),
+    ('/abs/./x.txt', ('abs', 'x.txt')),
+    ('dir\\win\\y.txt', ('dir/win', 'y.txt')),
+    ('../', ('', '')),
+])
+def test_safe_member_path_drops_traversal(name, expected):
+    assert server.safe_member_path(name) == expected
+
+
+MEMBERS = [('top.txt', b'top'), ('../../escape.txt', b'escape'), ('/abs/x.bin', b'x' * 3000), ('d/./e/f.txt', b'f')]
+EXPECTED = {'archive/top.txt': b'top', 'archive/escape.txt': b'escape', 'archive/abs/x.bin': b'x' * 3000,
+            'archive/d/e/f.txt': b'f'}
+
+
+@pytest.mark.parametrize('filename, build', [('archive.zip', _zip), ('archive.tar', _tar),
+                                             ('archive.tar.gz', lambda m: _tar(m, 'w:gz'))])
+def test_traversing_members_stay_inside_the_archive_collection(hosted, filename, build):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    job, files = _expand(base, manager, filename, build(MEMBERS))
+    assert job['state'] == 'done'
+    assert job['assets'] == 4
+    assert not job['error']
+    assert files == EXPECTED
+    with manager._get_read_conn() as conn:
+        names = {r[0] for r in conn.execute("SELECT name FROM collections")}
+    assert '..' not in names and '' not in names
+
+
+def test_encrypted_member_is_reported_and_the_rest_stored(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    archive = _set_encrypted_flag(_zip([('plain.txt', b'plain'), ('secret.txt', b'secret'), ('after.txt', b'after')]), 'secret.txt')
+    assert [info.flag_bits & 1 for info in zipfile.ZipFile(io.BytesIO(archive)).infolist()] == [0, 1, 0]
+
+    job, files = _expand(base, manager, 'archive.zip', archive)
+    assert job['state'] == 'done'
+    assert job['assets'] == 2
+    assert 'secret.txt' in job['error'] and 'encrypted' in job['error']
+    assert files == {'archive/plain.txt': b'plain', 'archive/after.txt': b'after'}
+
+
+def test_member_failing_its_crc_is_rolled_back_alone(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    archive = bytearray(_zip([('good.txt', b'good'), ('bad.bin', b'B' * 5000), ('last.txt', b'last')]))
+    archive[archive.find(b'B' * 5000) + 2500] ^= 0xff
+
+    job, files = _expand(base, manager, 'archive.zip', bytes(archive))
+    assert job['assets'] == 2
+    assert 'bad.bin' in job['error'] and 'CRC' in job['error']
+    assert files == {'archive/good.txt': b'good', 'archive/last.txt': b'last'}
+    with manager._get_read_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM metadata WHERE key = 'filename' AND value = 'bad.bin'").fetchone()[0] == 0
+
+
+def test_truncated_tar_keeps_the_members_before_the_damage(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    members = [('one.txt', b'1' * 2000), ('two.txt', b'2' * 2000), ('three.bin', bytes(range(256)) * 200)]
+    archive = _tar(members, 'w:gz')
+    job, files = _expand(base, manager, 'archive.tar.gz', archive[:len(archive) * 2 // 3])
+    assert job['error'] and 'archive.tar.gz' in job['error']
+    assert set(files) < {'archive/one.txt', 'archive/two.txt', 'archive/three.bin'}
+    for path, data in files.items():
+        assert data == dict(members)[path.split('/', 1)[1]]
+
+
+def test_truncated_zip_fails_the_job(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    archive = _zip([('a.txt', b'a' * 1000)])
+    job, files = _expand(base, manager, 'archive.zip', archive[:-30])
+    assert job['state'] == 'failed'
+    assert job['error']
+    assert files == {}
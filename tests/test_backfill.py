@@ -0,0 +1,165 @@
+import time
+
+import server
+from conftest import add_file
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'backfill did not finish'
+        time.sleep(0.02)
+
+
+def _collection(manager):
+    project_id = manager.create_project('P', 'project', '')
+    return manager.create_collection(project_id, 'C', 'collection', None)
+
+
+def _forget_stats(manager):
+    """Makes the vault look like one written before ingest statistics existed."""
+    with manager.lock:
+        manager.conn.execute("DELETE FROM vault_stats")
+        manager.conn.execute("DELETE FROM chunk_size_stats")
+        manager.conn.execute("DELETE FROM vault_properties WHERE key IN ('stats_version', 'stats_backfill_to')")
+        manager.conn.commit()
+
+
+def test_stats_backfill_resumes_against_the_first_high_water(workdir, monkeypatch):
+    m = server.CompactVaultManager('test.vault')
+    m.set_password('pw')
+    collection_id = _collection(m)
+    add_file(m, collection_id, 'a.bin', b'a' * 5000)
+    add_file(m, collection_id, 'b.bin', b'b' * 7000)
+    _forget_stats(m)
+    m.close()
+
+    # Reopen with the backfill "interrupted" before it folds anything in,
+    # then ingest another asset, which is counted by the ingest path.
+    with monkeypatch.context() as patched:
+        patched.setattr(server.CompactVaultManager, '_backfill_stats', lambda self, high_water: None)
+        m = server.CompactVaultManager('test.vault')
+        add_file(m, collection_id, 'c.bin', b'c' * 3000)
+        m.close()
+
+    m = server.CompactVaultManager('test.vault')
+    try:
+        _wait_for(lambda: m.backfills['stats']['state'] != 'running')
+        assert m.backfills['stats']['state'] == 'done'
+        totals = m.get_stats()['totals']
+        assert totals['assets'] == 3
+        assert totals['logical_bytes'] == 5000 + 7000 + 3000
+        with m._get_read_conn() as conn:
+            keys = {r[0] for r in conn.execute("SELECT key FROM vault_properties WHERE key LIKE 'stats_%'")}
+        assert keys == {'stats_version'}
+    finally:
+        m.close()
+
+
+STATS_KEYS = ('assets', 'logical_bytes', 'chunk_refs', 'unique_chunks', 'unique_bytes', 'stored_bytes', 'reused_chunks', 'reused_bytes')
+
+
+def test_stats_backfill_commits_batches_and_resumes_after_a_pause(workdir, monkeypatch):
+    m = server.CompactVaultManager('test.vault')
+    m.set_password('pw')
+    collection_id = _collection(m)
+    shared = bytes(range(256)) * 40
+    for i in range(5):
+        add_file(m, collection_id, f'{i}.bin', shared + bytes([i]) * 3000)
+    expected = {k: m.get_stats()['totals'][k] for k in STATS_KEYS}
+    _forget_stats(m)
+    m.close()
+
+    replay = server.CompactVaultManager._record_ingest_stats
+
+    def slow_record(self, *args, **kwargs):
+        time.sleep(0.05)
+        return replay(self, *args, **kwargs)
+
+    with monkeypatch.context() as patched:
+        patched.setattr(server.CompactVaultManager, 'BACKFILL_BATCH', 1)
+        patched.setattr(server.CompactVaultManager, '_record_ingest_stats', slow_record)
+        m = server.CompactVaultManager('test.vault')
+        _wait_for(lambda: m.backfills['stats'].get('assets_done', 0) >= 2)
+        m.close()
+    assert m.backfills['stats']['state'] == 'paused'
+
+    m = server.CompactVaultManager('test.vault', background=False)
+    try:
+        with m._get_read_conn() as conn:
+            done = int(conn.execute("SELECT value FROM vault_properties WHERE key = 'stats_backfilled_to'").fetchone()[0])
+            credited = conn.execute("SELECT COUNT(*) FROM stats_backfill_chunks").fetchone()[0]
+        assert 2 <= done < 5
+        assert credited > 0
+        assert m.get_stats()['totals']['assets'] == done
+    finally:
+        m.close()
+
+    m = server.CompactVaultManager('test.vault')
+    try:
+        _wait_for(lambda: m.backfills['stats']['state'] != 'running')
+        assert m.backfills['stats']['state'] == 'done'
+        assert {k: m.get_stats()['totals'][k] for k in STATS_KEYS} == expected
+        with m._get_read_conn() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM stats_backfill_chunks").fetchone()[0] == 0
+            keys = {r[0] for r in conn.execute("SELECT key FROM vault_properties WHERE key LIKE 'stats_%'")}
+        assert keys == {'stats_version'}
+    finally:
+        m.close()
+
+
+def test_fresh_vault_needs_no_stats_backfill(manager):
+    assert manager._stats_backfill_high_water() == 0
+    assert manager.backfills['stats']['state'] == 'done'
+
+
+def _forget_checksums(manager):
+    """Makes the vault look like one written before whole-file digests and CRC32s existed."""
+    with manager.lock:
+        manager.conn.execute("UPDATE assets SET size = NULL, digest = NULL, crc32 = NULL")
+        manager.conn.execute("DELETE FROM vault_properties WHERE key IN ('checksums_version', 'checksums_backfilled_to')")
+        manager.conn.commit()
+
+
+def test_close_pauses_the_checksum_backfill_and_reopen_finishes_it(workdir, monkeypatch):
+    m = server.CompactVaultManager('test.vault')
+    m.set_password('pw')
+    collection_id = _collection(m)
+    blobs = [bytes([i]) * (1000 + i) for i in range(6)]
+    for i, data in enumerate(blobs):
+        add_file(m, collection_id, f'{i}.bin', data)
+    _forget_checksums(m)
+    m.close()
+
+    read_chunk = server.CompactVaultManager.read_chunk
+    reads = []
+
+    def slow_read_chunk(self, *args, **kwargs):
+        reads.append(args[1])
+        time.sleep(0.05)
+        return read_chunk(self, *args, **kwargs)
+
+    with monkeypatch.context() as patched:
+        patched.setattr(server.CompactVaultManager, 'BACKFILL_BATCH', 1)
+        patched.setattr(server.CompactVaultManager, 'read_chunk', slow_read_chunk)
+        m = server.CompactVaultManager('test.vault')
+        assert server.HostedVault('test.vault', m).busy()
+        m.close()
+        assert not any(t.is_alive() for t in m.backfill_threads)
+        assert m.backfills['checksums']['state'] == 'paused'
+
+    paused_reads = len(reads)
+    monkeypatch.setattr(server.CompactVaultManager, 'read_chunk', slow_read_chunk)
+    m = server.CompactVaultManager('test.vault')
+    try:
+        _wait_for(lambda: m.backfills['checksums']['state'] != 'running')
+        assert m.backfills['checksums']['state'] == 'done'
+        assert not server.HostedVault('test.vault', m).busy()
+        with m._get_read_conn() as conn:
+            rows = conn.execute("SELECT size, digest, crc32 FROM assets ORDER BY id").fetchall()
+        assert [tuple(r) for r in rows] == [(len(d), server.hashlib.sha256(d).hexdigest(), server.zlib.crc32(d)) for d in blobs]
+        # One pass computes both checksums: every chunk is read once, across the pause.
+        assert sorted(reads) == sorted(set(reads)) and len(reads) == len(blobs)
+        assert paused_reads < len(blobs)
+    finally:
+        m.close()
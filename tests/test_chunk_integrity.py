@@ -0,0 +1,165 @@
+import http.client
+import json
+import os
+import urllib.parse
+import zlib
+
+import pytest
+
+import server
+from conftest import add_file, request
+
+
+def _collection(manager):
+    project_id = manager.create_project('P', 'project', '')
+    return manager.create_collection(project_id, 'C', 'collection', None)
+
+
+def _text_asset(manager, collection_id=None, filename='notes.txt', data=b'line one\nline two\n' * 50):
+    return add_file(manager, collection_id or _collection(manager), filename, data)
+
+
+def _first_chunk(manager, asset_id):
+    with manager._get_read_conn() as conn:
+        manifest = json.loads(conn.execute("SELECT manifest FROM assets WHERE id = ?", (asset_id,)).fetchone()[0])
+    return manifest['chain'][0]
+
+
+def _corrupt(manager, asset_id, blob):
+    with manager.lock:
+        manager.conn.execute("UPDATE chunks SET data = ? WHERE hash = ?", (blob, _first_chunk(manager, asset_id)['chunk_hash']))
+        manager.conn.execute("DELETE FROM asset_previews WHERE asset_id = ?", (asset_id,))
+        manager.conn.commit()
+
+
+def test_preview_of_a_damaged_asset_fails_instead_of_showing_garbage(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    asset_id = _text_asset(manager)
+    _corrupt(manager, asset_id, zlib.compress(b'garbage'))
+
+    with pytest.raises(server.ChunkIntegrityError):
+        manager.get_asset_preview(asset_id)
+    status, _, body = request(f'{base}/api/assets/{asset_id}/preview')
+    assert status == 500
+    assert 'holds 7 bytes' in json.loads(body)['message']
+
+
+def test_preview_backfill_skips_damaged_assets(manager):
+    collection_id = _collection(manager)
+    good = _text_asset(manager, collection_id)
+    bad = _text_asset(manager, collection_id, 'other.txt', b'other text\n' * 40)
+    _corrupt(manager, bad, zlib.compress(b'garbage'))
+    with manager.lock:
+        manager.conn.execute("DELETE FROM asset_previews")
+        manager.conn.execute("DELETE FROM vault_properties WHERE key = 'previews_version'")
+        manager.conn.commit()
+
+    manager._backfill_previews(manager._preview_backfill_high_water())
+    assert manager.backfills['previews']['state'] == 'done'
+    with manager._get_read_conn() as conn:
+        assert [r[0] for r in conn.execute("SELECT asset_id FROM asset_previews")] == [good]
+    assert manager.get_asset_preview(good)['line_count'] == 100
+
+
+def _chain(manager, asset_id):
+    with manager._get_read_conn() as conn:
+        return json.loads(conn.execute("SELECT manifest FROM assets WHERE id = ?", (asset_id,)).fetchone()[0])['chain']
+
+
+def _set_chunk(manager, chunk_hash, blob):
+    with manager.lock:
+        if blob is None:
+            manager.conn.execute("DELETE FROM chunks WHERE hash = ?", (chunk_hash,))
+        else:
+            manager.conn.execute("UPDATE chunks SET data = ? WHERE hash = ?", (blob, chunk_hash))
+        manager.conn.commit()
+
+
+def _read_all(manager, asset_id):
+    return b''.join(manager.stream_asset_data(asset_id))
+
+
+def test_missing_undecodable_and_short_chunks_raise(manager):
+    collection_id = _collection(manager)
+    data = b'0123456789' * 300
+    for kind, blob, message in (('missing', None, 'is missing'), ('corrupt', b'not zlib at all', 'does not decompress'),
+                                ('size', zlib.compress(b'short'), 'holds 5 bytes')):
+        asset_id = add_file(manager, collection_id, f'{kind}.bin', data + kind.encode())
+        assert _read_all(manager, asset_id) == data + kind.encode()
+        _set_chunk(manager, _chain(manager, asset_id)[0]['chunk_hash'], blob)
+        before = server.CHUNK_READ_ERRORS.values.get((kind,), 0)
+        with pytest.raises(server.ChunkIntegrityError, match=message):
+            _read_all(manager, asset_id)
+        assert server.CHUNK_READ_ERRORS.values[(kind,)] == before + 1
+
+
+def test_verify_on_read_catches_same_size_substitution_and_caches_hits(manager):
+    collection_id = _collection(manager)
+    good = add_file(manager, collection_id, 'good.bin', b'g' * 4000)
+    bad = add_file(manager, collection_id, 'bad.bin', b'b' * 4000)
+    bad_chunk = _chain(manager, bad)[0]
+    _set_chunk(manager, bad_chunk['chunk_hash'], zlib.compress(b'x' * bad_chunk['size']))
+
+    # Without verification the substitution is only caught by size, which matches.
+    assert _read_all(manager, bad) == b'x' * 4000
+
+    manager.verify_reads = True
+    with pytest.raises(server.ChunkIntegrityError, match='fails verification'):
+        _read_all(manager, bad)
+    assert bad_chunk['chunk_hash'] not in manager.verified_chunks.entries
+
+    hashed = server.CHUNK_VERIFY.values.get(('hashed',), 0)
+    cached = server.CHUNK_VERIFY.values.get(('cached',), 0)
+    assert _read_all(manager, good) == b'g' * 4000
+    assert _read_all(manager, good) == b'g' * 4000
+    chunks = len(_chain(manager, good))
+    assert server.CHUNK_VERIFY.values[('hashed',)] == hashed + chunks
+    assert server.CHUNK_VERIFY.values[('cached',)] == cached + chunks
+    assert manager.verify_status()['cache']['entries'] == chunks
+
+
+def test_verified_chunk_cache_is_a_bounded_lru():
+    cache = server.VerifiedChunks(2)
+    cache.add('a')
+    cache.add('b')
+    assert cache.check('a')
+    cache.add('c')
+    assert not cache.check('b')
+    assert cache.check('a') and cache.check('c')
+    cache.resize(1)
+    assert list(cache.entries) == ['c']
+    assert cache.status()['hits'] == 3 and cache.status()['misses'] == 1
+
+
+def _get(base, path):
+    url = urllib.parse.urlparse(base + path)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    conn.request('GET', url.path)
+    return conn, conn.getresponse()
+
+
+def test_download_fails_with_json_before_headers_and_cuts_the_connection_after(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    collection_id = _collection(manager)
+    data = os.urandom(3 * 1048576)
+
+    first = add_file(manager, collection_id, 'first.bin', data)
+    _set_chunk(manager, _chain(manager, first)[0]['chunk_hash'], None)
+    status, _, body = request(f'{base}/api/assets/{first}')
+    assert status == 500
+    assert 'is missing' in json.loads(body)['message']
+
+    later = add_file(manager, collection_id, 'later.bin', data[::-1])
+    chain = _chain(manager, later)
+    assert len(chain) > 2
+    _set_chunk(manager, chain[-1]['chunk_hash'], zlib.compress(b'short'))
+    conn, response = _get(base, f'/api/assets/{later}')
+    try:
+        assert response.status == 200
+        assert int(response.headers['Content-Length']) == len(data)
+        with pytest.raises(http.client.IncompleteRead):
+            response.read()
+    finally:
+        conn.close()
@@ -0,0 +1,43 @@
+import hashlib
+import json
+
+from conftest import add_file, request
+
+DATA = b'clone me\n' * 500
+
+
+def _collection(manager):
+    project_id = manager.create_project('P', 'project', '')
+    return manager.create_collection(project_id, 'C', 'collection', None)
+
+
+def test_size_lookup_tells_the_client_whether_hashing_can_pay_off(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    status, _, _ = request(f'{base}/api/assets/lookup?size={len(DATA)}')
+    assert status == 404
+    add_file(manager, _collection(manager), 'a.txt', DATA)
+    status, _, body = request(f'{base}/api/assets/lookup?size={len(DATA)}')
+    assert status == 200
+    assert json.loads(body) == {'found': True, 'size': len(DATA)}
+    assert request(f'{base}/api/assets/lookup?size={len(DATA) + 1}')[0] == 404
+    assert request(f'{base}/api/assets/lookup?size=x')[0] == 400
+
+
+def test_clone_validates_the_request_and_stores_a_copy(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    collection_id = _collection(manager)
+    add_file(manager, collection_id, 'a.txt', DATA)
+    clone = {'digest': hashlib.sha256(DATA).hexdigest(), 'size': len(DATA), 'collection_id': collection_id, 'filename': 'b.txt'}
+
+    for bad in ({'path_prefix': 5}, {'path_prefix': ['x']}, {'filename': 'x/y'}, {'digest': 'nothex'}):
+        status, _, body = request(base + '/api/assets/clone', dict(clone, **bad))
+        assert status == 400, bad
+        assert json.loads(body)['message'].startswith('Invalid request')
+
+    status, _, body = request(base + '/api/assets/clone', dict(clone, path_prefix='copies'))
+    assert status == 201
+    asset_id = json.loads(body)['asset_id']
+    assert b''.join(manager.stream_asset_data(asset_id)) == DATA
+    assert request(base + '/api/assets/clone', dict(clone, size=len(DATA) + 1))[0] == 404
@@ -0,0 +1,73 @@
+import io
+import os
+import time
+
+import server
+
+
+def _tree(root):
+    os.makedirs(root / 'sub')
+    (root / 'a.bin').write_bytes(os.urandom(50000))
+    (root / 'sub' / 'b.bin').write_bytes(b'b' * 30000)
+
+
+def _import(manager, root, collection_id, **kwargs):
+    return server.BulkImporter(manager, str(root), collection_id, workers=2, progress=io.StringIO(), **kwargs).run()
+
+
+def _asset_count(manager):
+    with manager._get_read_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+
+def _collection(manager):
+    project_id = manager.create_project('P', 'project', '')
+    return manager.create_collection(project_id, 'C', 'collection', None)
+
+
+def test_reimport_skips_unchanged_and_rerecords_touched_files(manager, workdir):
+    root = workdir / 'src'
+    _tree(root)
+    collection_id = _collection(manager)
+    result = _import(manager, root, collection_id)
+    assert (result['files'], result['cloned'], result['errors']) == (2, 0, 0)
+    assert _asset_count(manager) == 2
+
+    result = _import(manager, root, collection_id)
+    assert (result['files'], result['skipped']) == (0, 2)
+
+    stat = os.stat(root / 'a.bin')
+    os.utime(root / 'a.bin', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    result = _import(manager, root, collection_id)
+    assert (result['files'], result['unchanged'], result['cloned']) == (1, 1, 0)
+    assert _asset_count(manager) == 2
+    with manager._get_read_conn() as conn:
+        row = conn.execute("SELECT mtime_ns FROM import_journal WHERE path = 'a.bin'").fetchone()
+    assert row[0] == stat.st_mtime_ns + 10**9
+    assert _import(manager, root, collection_id)['skipped'] == 2
+
+    (root / 'a.bin').write_bytes(b'changed' * 1000)
+    result = _import(manager, root, collection_id)
+    assert (result['files'], result['unchanged']) == (1, 0)
+    assert _asset_count(manager) == 3
+
+
+def test_workers_can_take_the_write_lock_while_the_writer_waits_on_them(manager, workdir, monkeypatch):
+    root = workdir / 'src'
+    _tree(root)
+    collection_id = _collection(manager)
+    acquired = []
+    encode = server.PreparedFile.encode
+
+    def encode_after_taking_the_lock(self, *args):
+        time.sleep(0.1)
+        got = manager.lock.acquire(timeout=1)
+        if got:
+            manager.lock.release()
+        acquired.append(got)
+        encode(self, *args)
+
+    monkeypatch.setattr(server.PreparedFile, 'encode', encode_after_taking_the_lock)
+    result = _import(manager, root, collection_id)
+    assert result['errors'] == 0
+    assert acquired == [True, True]
@@ -0,0 +1,96 @@
+import json
+
+import server
+from conftest import request
+
+
+def _upload_one_part(base, upload_id, data):
+    status, _, _ = request(base + '/api/upload/sessions', {'upload_id': upload_id, 'filename': 'a.bin', 'size': len(data),
+                                                          'chunk_size': 5 * 1024 * 1024, 'collection_id': 1})
+    assert status == 200
+    status, _, _ = request(f'{base}/api/upload/chunk?upload_id={upload_id}&chunk_index=0', data,
+                           {'Content-Type': 'application/octet-stream'})
+    assert status == 200
+
+
+def test_admit_accepts_when_there_is_room(manager):
+    assert manager.jobs.admit() is None
+
+
+def test_admit_refuses_a_full_queue_with_retry_after(manager):
+    manager.jobs.max_queued = 0
+    status, retry_after, message = manager.jobs.admit()
+    assert status == 429
+    assert 1 <= retry_after <= 60
+    assert 'queued' in message
+
+
+def test_admit_refuses_bytes_beyond_the_pending_limit(manager):
+    manager.jobs.max_pending_bytes = 10
+    status, retry_after, _ = manager.jobs.admit(incoming_bytes=11, new_job=False)
+    assert status == 503
+    assert retry_after >= 1
+
+
+def test_complete_answers_429_when_the_queue_is_full(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    project_id = manager.create_project('P', 'project', '')
+    collection_id = manager.create_collection(project_id, 'C', 'collection', None)
+    _upload_one_part(base, 'up-full-queue', b'x' * 1000)
+
+    manager.jobs.max_queued = 0
+    status, headers, body = request(base + '/api/upload/complete', {'upload_id': 'up-full-queue', 'filename': 'a.bin',
+                                                                     'collection_id': collection_id})
+    assert status == 429
+    assert int(headers['Retry-After']) >= 1
+    assert 'queued' in json.loads(body)['message']
+
+    manager.jobs.max_queued = 10
+    status, _, body = request(base + '/api/upload/complete', {'upload_id': 'up-full-queue', 'filename': 'a.bin',
+                                                               'collection_id': collection_id})
+    assert status == 202
+    assert json.loads(body)['job_id']
+
+
+def test_parts_of_uncompleted_uploads_count_against_the_pending_limit(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    manager.jobs.max_pending_bytes = 2500
+    _upload_one_part(base, 'up-a', b'a' * 1000)
+    _upload_one_part(base, 'up-a', b'a' * 1000)
+    _upload_one_part(base, 'up-b', b'b' * 1000)
+    assert manager.uploads.part_bytes == 2000
+    assert manager.jobs.summary()['pending_bytes'] == 2000
+
+    status, headers, _ = request(f'{base}/api/upload/chunk?upload_id=up-c&chunk_index=0', b'c' * 1000,
+                                 {'Content-Type': 'application/octet-stream'})
+    assert status == 503
+    assert int(headers['Retry-After']) >= 1
+
+    # Expiry gives the room back.
+    with manager.lock:
+        manager.uploads._discard('up-a')
+        manager.conn.commit()
+    assert manager.uploads.part_bytes == 1000
+    _upload_one_part(base, 'up-c', b'c' * 1000)
+
+
+def test_completion_hands_part_bytes_to_the_job_and_restart_recounts_them(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    project_id = manager.create_project('P', 'project', '')
+    collection_id = manager.create_collection(project_id, 'C', 'collection', None)
+    _upload_one_part(base, 'up-done', b'd' * 1000)
+    _upload_one_part(base, 'up-open', b'o' * 700)
+    status, _, body = request(base + '/api/upload/complete', {'upload_id': 'up-done', 'filename': 'a.bin',
+                                                               'collection_id': collection_id})
+    assert status == 202
+    assert manager.uploads.part_bytes == 700
+
+    registry.close_all()
+    reopened = server.CompactVaultManager('test.vault', background=False)
+    try:
+        assert reopened.uploads.part_bytes == 700
+    finally:
+        reopened.close()
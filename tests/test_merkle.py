@@ -0,0 +1,50 @@
+import hashlib
+
+import pytest
+
+import server
+
+
+def _leaves(n):
+    return [server.merkle_leaf(hashlib.sha256(str(i).encode()).hexdigest(), 1000 + i) for i in range(n)]
+
+
+def test_root_matches_a_recursive_rfc6962_tree():
+    def reference(leaves):
+        if len(leaves) == 1:
+            return leaves[0]
+        k = server._merkle_split(len(leaves))
+        return server._merkle_node(reference(leaves[:k]), reference(leaves[k:]))
+
+    for n in range(1, 20):
+        assert server.merkle_root(_leaves(n)) == reference(_leaves(n)), n
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 8, 13])
+def test_every_range_proof_rebuilds_the_root(count):
+    leaves = _leaves(count)
+    root = server.merkle_root(leaves)
+    for lo in range(count):
+        for hi in range(lo + 1, count + 1):
+            proof = server.merkle_range_proof(leaves, lo, hi)
+            assert len(proof) <= 2 * max(1, (count - 1).bit_length())
+            assert server.merkle_root_from_range(count, lo, hi, leaves[lo:hi], proof) == root
+
+
+def test_tampered_leaves_or_proofs_do_not_rebuild_the_root():
+    leaves = _leaves(11)
+    root = server.merkle_root(leaves)
+    proof = server.merkle_range_proof(leaves, 3, 7)
+    forged = list(leaves[3:7])
+    forged[1] = server.merkle_leaf('00' * 32, 1)
+    assert server.merkle_root_from_range(11, 3, 7, forged, proof) != root
+    assert server.merkle_root_from_range(11, 3, 7, leaves[3:7], proof[::-1]) != root
+
+    with pytest.raises(ValueError):
+        server.merkle_root_from_range(11, 3, 7, leaves[3:7], proof[:-1])
+    with pytest.raises(ValueError):
+        server.merkle_root_from_range(11, 3, 7, leaves[3:7], proof + [root])
+    with pytest.raises(ValueError):
+        server.merkle_root_from_range(11, 3, 7, leaves[3:6], proof)
+    with pytest.raises(ValueError):
+        server.merkle_root_from_range(11, 7, 3, [], proof)
@@ -0,0 +1,35 @@
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=100-', [(100, 999)]),
+    ('bytes=-200', [(800, 999)]),
+    ('bytes=-5000', [(0, 999)]),
+    ('bytes=900-5000', [(900, 999)]),
+    ('BYTES = 0-0', [(0, 0)]),
+    ('bytes=0-9, 20-29', [(0, 9), (20, 29)]),
+    ('bytes=20-29,0-9', [(0, 9), (20, 29)]),
+    ('bytes=0-9,5-19,20-29', [(0, 29)]),
+    ('bytes=0-9,,20-29', [(0, 9), (20, 29)]),
+])
+def test_satisfiable_ranges(header, expected):
+    assert server.parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', ['items=0-9', 'bytes=', 'bytes=-', 'bytes=a-b', 'bytes=9-0', 'bytes=0-9;x'])
+def test_malformed_headers_are_ignored(header):
+    assert server.parse_range_header(header, 1000) is None
+
+
+def test_unsatisfiable_ranges_give_an_empty_list():
+    assert server.parse_range_header('bytes=1000-', 1000) == []
+    assert server.parse_range_header('bytes=-0', 1000) == []
+    assert server.parse_range_header('bytes=-10', 0) == []
+
+
+def test_too_many_ranges_are_ignored():
+    spec = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(server.MAX_BYTE_RANGES + 1))
+    assert server.parse_range_header('bytes=' + spec, 10 ** 6) is None
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+
+import server
+from conftest import add_file, request
+
+
+def _fill(manager):
+    project_id = manager.create_project('P', 'project', '')
+    collection_id = manager.create_collection(project_id, 'C', 'collection', None)
+    for i in range(3):
+        add_file(manager, collection_id, f'{i}.bin', os.urandom(20000) * 2)
+    return collection_id
+
+
+def _totals(path):
+    m = server.CompactVaultManager(path)
+    try:
+        return m.get_stats()['totals']
+    finally:
+        m.close()
+
+
+def test_sync_opens_the_target_without_background_threads(manager, monkeypatch):
+    _fill(manager)
+    opened = []
+    real_init = server.CompactVaultManager.__init__
+
+    def spy_init(self, *args, **kwargs):
+        real_init(self, *args, **kwargs)
+        opened.append((self, threading.active_count()))
+
+    before = threading.active_count()
+    with monkeypatch.context() as patched:
+        patched.setattr(server.CompactVaultManager, '__init__', spy_init)
+        result = server.VaultReplicator(manager, 'replica.vault', 'pw').run()
+    assert result['state'] == 'done'
+    assert [count for _, count in opened] == [before]
+    assert _totals('replica.vault')['assets'] == 3
+
+
+def test_resumed_sync_still_credits_chunks_copied_before_the_interruption(manager, monkeypatch):
+    _fill(manager)
+    copy = server.VaultReplicator._copy_missing_chunks
+
+    def copy_then_fail(self, hashes):
+        copy(self, hashes)
+        raise RuntimeError('connection lost')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(server.VaultReplicator, '_copy_missing_chunks', copy_then_fail)
+        result = server.VaultReplicator(manager, 'replica.vault', 'pw').run()
+    assert result['state'] == 'failed'
+    assert result['chunks_copied'] > 0
+
+    result = server.VaultReplicator(manager, 'replica.vault', 'pw').run()
+    assert result['state'] == 'done'
+    assert result['chunks_copied'] == 0
+
+    source = manager.get_stats()['totals']
+    replica = _totals('replica.vault')
+    for key in ('assets', 'logical_bytes', 'unique_chunks', 'unique_bytes', 'stored_bytes'):
+        assert replica[key] == source[key], key
+
+
+def test_sync_refuses_targets_outside_the_vault_directory_or_in_use(hosted, workdir):
+    base, registry = hosted
+    registry.unlock('other.vault', 'pw', create=True)
+
+    for target in ('../elsewhere.vault', str(workdir / 'abs.vault'), 'sub/dir.vault', 'plain.db'):
+        status, _, body = request(base + '/api/replication/sync', {'target': target, 'password': 'pw'})
+        assert status == 400, target
+
+    status, _, body = request(base + '/api/replication/sync', {'target': 'other.vault', 'password': 'pw'})
+    assert status == 409
+    assert 'in use' in json.loads(body)['message']
+
+    status, _, _ = request(base + '/api/replication/sync', {'target': 'replica.vault', 'password': 'pw'})
+    assert status == 202
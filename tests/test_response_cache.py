@@ -0,0 +1,41 @@
+import json
+import sqlite3
+
+from conftest import request
+
+
+def test_listing_errors_are_not_cached(hosted, monkeypatch):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    manager.create_project('P', 'project', '')
+
+    def failing():
+        raise sqlite3.OperationalError('database is locked')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(manager, 'get_all_projects', failing)
+        status, _, body = request(base + '/api/projects')
+        assert status == 500
+        assert 'locked' in json.loads(body)['message']
+    assert not manager.response_cache.entries
+
+    status, _, body = request(base + '/api/projects')
+    assert status == 200
+    assert [p['name'] for p in json.loads(body)] == ['P']
+    assert len(manager.response_cache.entries) == 1
+
+
+def test_listings_are_served_from_the_cache_until_a_write(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    manager.create_project('P', 'project', '')
+
+    request(base + '/api/projects')
+    hits = manager.response_cache.hits
+    request(base + '/api/projects')
+    assert manager.response_cache.hits == hits + 1
+
+    manager.create_project('Q', 'project', '')
+    status, _, body = request(base + '/api/projects')
+    assert status == 200
+    assert [p['name'] for p in json.loads(body)] == ['P', 'Q']
@@ -0,0 +1,161 @@
+import json
+import os
+import time
+import zlib
+
+import server
+from conftest import add_file
+
+
+def _collection(manager):
+    project_id = manager.create_project('P', 'project', '')
+    return manager.create_collection(project_id, 'C', 'collection', None)
+
+
+def _fill(manager, collection_id, count, size=30000, tag=''):
+    return [add_file(manager, collection_id, f'{tag}{i}.bin', os.urandom(size)) for i in range(count)]
+
+
+def _chain(manager, asset_id):
+    with manager._get_read_conn() as conn:
+        return json.loads(conn.execute("SELECT manifest FROM assets WHERE id = ?", (asset_id,)).fetchone()[0])['chain']
+
+
+def _chunk_count(manager):
+    with manager._get_read_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def _scrub(manager, **kwargs):
+    assert manager.scrubber.start(cpu_fraction=1.0, **kwargs)
+    manager.scrubber.thread.join(10)
+    return manager.scrubber.status()
+
+
+def test_full_scrub_reports_damaged_chunks_and_manifests(manager):
+    collection_id = _collection(manager)
+    assets = _fill(manager, collection_id, 4)
+    rehashed, undecodable = _chain(manager, assets[0])[0]['chunk_hash'], _chain(manager, assets[1])[0]['chunk_hash']
+    removed = _chain(manager, assets[2])[0]['chunk_hash']
+    manager.verified_chunks.add(rehashed)
+    with manager.lock:
+        manager.conn.execute("UPDATE chunks SET data = ? WHERE hash = ?", (zlib.compress(b'other content'), rehashed))
+        manager.conn.execute("UPDATE chunks SET data = ? WHERE hash = ?", (b'not zlib', undecodable))
+        manager.conn.execute("DELETE FROM chunks WHERE hash = ?", (removed,))
+        manifest = json.loads(manager.conn.execute("SELECT manifest FROM assets WHERE id = ?", (assets[3],)).fetchone()[0])
+        manifest['merkle_root'] = '00' * 32
+        manager.conn.execute("UPDATE assets SET manifest = ? WHERE id = ?", (json.dumps(manifest), assets[3]))
+        manager.conn.commit()
+
+    status = _scrub(manager)
+    assert status['state'] == 'completed'
+    assert status['chunks_checked'] == _chunk_count(manager)
+    assert status['assets_checked'] == 4
+    failures = {(f['kind'], f['ref']): f['error'] for f in manager.scrubber.report()['failures']}
+    assert failures[('chunk', rehashed)] == 'hash mismatch'
+    assert failures[('chunk', undecodable)].startswith('decompress failed')
+    assert failures[('manifest', f'asset {assets[2]}')] == '1 referenced chunk(s) missing'
+    assert failures[('manifest', f'asset {assets[3]}')] == 'merkle root mismatch'
+    assert len(failures) == 4 and status['failures'] == 4
+    assert rehashed not in manager.verified_chunks.entries
+
+
+def test_incremental_scrub_covers_only_what_was_ingested_since(manager):
+    collection_id = _collection(manager)
+    old = _fill(manager, collection_id, 3, tag='old')
+    first = _scrub(manager)
+    assert first['state'] == 'completed' and first['failures'] == 0
+    high_water = first['last_completed']
+    assert high_water['chunk_high_water'] == _chunk_count(manager)
+
+    old_chunk = _chain(manager, old[0])[0]['chunk_hash']
+    with manager.lock:
+        manager.conn.execute("UPDATE chunks SET data = ? WHERE hash = ?", (b'not zlib', old_chunk))
+        manager.conn.commit()
+    chunks_before = _chunk_count(manager)
+    _fill(manager, collection_id, 2, tag='new')
+
+    status = _scrub(manager, incremental=True)
+    assert status['mode'] == 'incremental' and status['state'] == 'completed'
+    assert status['chunks_checked'] == _chunk_count(manager) - chunks_before
+    assert status['assets_checked'] == 2
+    assert status['failures'] == 0
+    assert status['last_completed']['asset_high_water'] == high_water['asset_high_water'] + 2
+
+    # A full pass still finds the damage the incremental one was not asked to look at.
+    assert _scrub(manager)['failures'] == 1
+
+
+def _slow_scrub(monkeypatch):
+    verify = server.IntegrityScrubber._verify_chunks
+
+    def slow_verify(rows):
+        time.sleep(0.03)
+        return verify(rows)
+
+    monkeypatch.setattr(server.IntegrityScrubber, 'BATCH_ROWS', 1)
+    monkeypatch.setattr(server.IntegrityScrubber, 'CHECKPOINT_INTERVAL', 0.0)
+    monkeypatch.setattr(server.IntegrityScrubber, '_verify_chunks', staticmethod(slow_verify))
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'scrub did not get there'
+        time.sleep(0.01)
+
+
+def test_paused_scrub_resumes_from_its_checkpointed_cursor(workdir, monkeypatch):
+    m = server.CompactVaultManager('test.vault')
+    m.set_password('pw')
+    _fill(m, _collection(m), 6)
+    total = _chunk_count(m)
+    _slow_scrub(monkeypatch)
+
+    assert m.scrubber.start(cpu_fraction=1.0, workers=1)
+    _wait_for(lambda: m.scrubber.state['chunks_checked'] >= 3)
+    m.close()
+    paused = m.scrubber.status()
+    assert paused['state'] == 'paused'
+    assert 3 <= paused['chunks_checked'] < total
+
+    m = server.CompactVaultManager('test.vault')
+    try:
+        saved = m.scrubber.status()
+        assert (saved['state'], saved['chunk_cursor'], saved['chunks_checked']) == \
+            ('paused', paused['chunk_cursor'], paused['chunks_checked'])
+        assert not saved['active']
+        assert m.scrubber.resume()
+        m.scrubber.thread.join(10)
+        done = m.scrubber.status()
+        assert done['state'] == 'completed'
+        assert done['chunks_checked'] == total
+        assert done['assets_checked'] == 6
+    finally:
+        m.close()
+
+
+def test_scrub_interrupted_by_a_restart_resumes_on_open(workdir, monkeypatch):
+    m = server.CompactVaultManager('test.vault')
+    m.set_password('pw')
+    _fill(m, _collection(m), 4)
+    total = _chunk_count(m)
+    _slow_scrub(monkeypatch)
+    assert m.scrubber.start(cpu_fraction=1.0, workers=1)
+    _wait_for(lambda: m.scrubber.state['chunks_checked'] >= 2)
+    m.close()
+
+    # As if the process had died mid-run: the checkpoint still says running.
+    state = dict(m.scrubber.state, state='running')
+    with server.sqlite3.connect('test.vault') as conn:
+        conn.execute("UPDATE vault_properties SET value = ? WHERE key = ?", (json.dumps(state), server.IntegrityScrubber.STATE_KEY))
+
+    m = server.CompactVaultManager('test.vault')
+    try:
+        assert m.scrubber.thread is not None
+        m.scrubber.thread.join(10)
+        done = m.scrubber.status()
+        assert done['state'] == 'completed'
+        assert done['chunks_checked'] == total
+    finally:
+        m.close()
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import server
+
+
+def test_drain_lets_new_readers_in_while_it_waits():
+    gate = server.ReadGate()
+    gate.acquire()
+    result = []
+    drainer = threading.Thread(target=lambda: result.append(gate.drain(0.5)))
+    drainer.start()
+    time.sleep(0.05)
+
+    t0 = time.monotonic()
+    gate.acquire()
+    assert time.monotonic() - t0 < 0.2
+    drainer.join()
+    assert result == [False]
+    assert not gate.closed
+
+    gate.release()
+    gate.release()
+    assert gate.drain(0.1)
+    assert gate.closed
+    gate.reopen()
+
+
+def _snapshot(manager):
+    tmp = manager.db_path.with_name(manager.db_path.name + '.converting')
+    with manager.lock:
+        changes = manager.conn.total_changes
+    src = manager._get_read_conn()
+    try:
+        src.execute("VACUUM INTO ?", (str(tmp),))
+    finally:
+        src.close()
+    return tmp, changes
+
+
+def test_swap_backs_off_without_blocking_readers(manager):
+    manager.create_project('P', 'project', '')
+    tmp, changes = _snapshot(manager)
+    reader = manager._get_read_conn()
+    try:
+        result = []
+        swapper = threading.Thread(target=lambda: result.append(manager.space_reclaimer._swap(tmp, changes, 0.5)))
+        swapper.start()
+        time.sleep(0.05)
+        t0 = time.monotonic()
+        with manager._get_read_conn() as conn:
+            assert conn.execute("SELECT name FROM projects").fetchone()[0] == 'P'
+        assert time.monotonic() - t0 < 0.2
+        swapper.join()
+        assert result == [False]
+    finally:
+        reader.close()
+
+
+def test_swap_replaces_the_file_once_readers_are_gone(manager):
+    manager.create_project('P', 'project', '')
+    tmp, changes = _snapshot(manager)
+    assert manager.space_reclaimer._swap(tmp, changes, 0.5)
+    assert not manager.read_gate.closed
+    assert manager.space_reclaimer.mode() == 'incremental'
+    assert [p['name'] for p in manager.get_all_projects()] == ['P']
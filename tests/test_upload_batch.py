@@ -0,0 +1,52 @@
+import json
+
+from conftest import request
+
+
+def _frame(header, data=b''):
+    raw = header if isinstance(header, bytes) else json.dumps(header).encode()
+    return len(raw).to_bytes(4, 'big') + raw + data
+
+
+def _post(base, collection_id, body):
+    status, _, payload = request(f'{base}/api/upload/batch?collection_id={collection_id}', body,
+                                 {'Content-Type': 'application/octet-stream'})
+    return status, json.loads(payload)
+
+
+def _collection(manager):
+    project_id = manager.create_project('P', 'project', '')
+    return manager.create_collection(project_id, 'C', 'collection', None)
+
+
+def test_batch_stores_each_file_under_its_path(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    collection_id = _collection(manager)
+    body = _frame({'name': 'a.txt', 'path': '', 'size': 3}, b'abc') + _frame({'name': 'b.txt', 'path': 'x/y', 'size': 2}, b'hi')
+    status, result = _post(base, collection_id, body)
+    assert status == 201
+    assert [(a['path'], a['name']) for a in result['assets']] == [('', 'a.txt'), ('x/y', 'b.txt')]
+    assert b''.join(manager.stream_asset_data(result['assets'][1]['asset_id'])) == b'hi'
+
+
+def test_malformed_headers_are_refused_with_400(hosted):
+    base, registry = hosted
+    collection_id = _collection(registry.vaults['test.vault'].manager)
+    for header in (b'["list"]', b'"text"', {'name': 'a', 'path': 5, 'size': 1}, {'name': 'a', 'path': ['x'], 'size': 1},
+                   {'name': 'a/b', 'size': 1}, {'name': 'a', 'size': -1}, {'name': 'a', 'size': True}, b'{not json'):
+        status, result = _post(base, collection_id, _frame(header, b'x'))
+        assert status == 400, header
+        assert result['message'].startswith('Invalid batch')
+
+
+def test_traversal_in_paths_is_dropped(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    collection_id = _collection(manager)
+    status, result = _post(base, collection_id, _frame({'name': 'f.txt', 'path': '../../etc/./x', 'size': 1}, b'f'))
+    assert status == 201
+    assert result['assets'][0]['path'] == 'etc/x'
+    with manager._get_read_conn() as conn:
+        names = {r[0] for r in conn.execute("SELECT name FROM collections")}
+    assert names == {'C', 'etc', 'x'}
@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+import server
+from conftest import request
+
+
+def _wait_for_job(manager, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = manager.jobs.get(job_id)
+        if job['state'] in ('done', 'failed'):
+            return job
+        assert time.monotonic() < deadline, 'ingest did not finish'
+        time.sleep(0.02)
+
+
+def _upload(base, manager, upload_id, data):
+    project_id = manager.create_project('P', 'project', '')
+    collection_id = manager.create_collection(project_id, 'C', 'collection', None)
+    status, _, _ = request(base + '/api/upload/sessions', {'upload_id': upload_id, 'filename': 'f.bin', 'size': len(data),
+                                                          'chunk_size': 5 * 1024 * 1024, 'collection_id': collection_id})
+    assert status == 200
+    status, _, _ = request(f'{base}/api/upload/chunk?upload_id={upload_id}&chunk_index=0', data,
+                           {'Content-Type': 'application/octet-stream'})
+    assert status == 200
+    return collection_id
+
+
+def test_the_same_upload_id_in_two_vaults_keeps_separate_parts(hosted):
+    base, registry = hosted
+    registry.unlock('other.vault', 'pw', create=True)
+    other_base = base.replace('test.vault', 'other.vault')
+    vaults = {'test.vault': (base, b'a' * 3000), 'other.vault': (other_base, b'b' * 7000)}
+
+    collections = {}
+    for name, (url, data) in vaults.items():
+        collections[name] = _upload(url, registry.vaults[name].manager, 'up-same', data)
+    for name, (_, data) in vaults.items():
+        uploads = registry.vaults[name].manager.uploads
+        assert uploads.dir('up-same') == os.path.join(server.UPLOAD_TEMP_DIR, name, 'up-same')
+        assert uploads.status('up-same')['received_bytes'] == len(data)
+
+    for name, (url, data) in vaults.items():
+        manager = registry.vaults[name].manager
+        status, _, body = request(url + '/api/upload/complete', {'upload_id': 'up-same', 'filename': 'f.bin',
+                                                                 'collection_id': collections[name]})
+        assert status == 202
+        job = _wait_for_job(manager, json.loads(body)['job_id'])
+        assert job['state'] == 'done'
+        assert b''.join(manager.stream_asset_data(job['asset_id'])) == data
+
+
+def test_expiry_sweeps_this_vaults_parts_and_legacy_ones_only(manager):
+    stale = time.time() - 2 * manager.uploads.ttl
+    dirs = [manager.uploads.dir('up-old'), os.path.join(server.UPLOAD_TEMP_DIR, 'up-legacy'),
+            os.path.join(server.UPLOAD_TEMP_DIR, 'other.vault', 'up-old')]
+    for d in dirs:
+        os.makedirs(d)
+        with open(os.path.join(d, '0'), 'wb') as f:
+            f.write(b'x')
+        os.utime(os.path.join(d, '0'), (stale, stale))
+        os.utime(d, (stale, stale))
+
+    assert manager.uploads.expire() == 2
+    assert [os.path.exists(d) for d in dirs] == [False, False, True]
@@ -0,0 +1,81 @@
+import io
+import os
+import zipfile
+import zlib
+
+import server
+from conftest import add_file, request
+
+FILES = {
+    'a.txt': b'hello world\n' * 100,
+    'empty.bin': b'',
+    'café.bin': os.urandom(70000),
+}
+
+
+def _collection_with_files(manager):
+    project_id = manager.create_project('P', 'project', '')
+    collection_id = manager.create_collection(project_id, 'C', 'collection', None)
+    for name, data in FILES.items():
+        add_file(manager, collection_id, name, data)
+    add_file(manager, collection_id, 'nested.bin', b'n' * 5000, path_prefix='sub/dir')
+    return collection_id
+
+
+def _check_archive(body):
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert zf.testzip() is None
+        contents = {info.filename: zf.read(info) for info in zf.infolist()}
+    expected = {f'C/{name}': data for name, data in FILES.items()}
+    expected['C/sub/dir/nested.bin'] = b'n' * 5000
+    assert contents == expected
+
+
+def test_layout_matches_its_entries():
+    entries = [(1, 'x.bin', 3, zlib.crc32(b'abc'), server.ZipLayout.dos_datetime('2024-05-06 07:08:09'))]
+    layout = server.ZipLayout(entries)
+    assert layout.total_size == len(layout.local_headers[0]) + 3 + len(layout.tail)
+    assert layout.etag == server.ZipLayout(entries).etag
+    assert server.ZipLayout.dos_datetime('not a date') == server.ZipLayout.dos_datetime('1970-01-01 00:00:00')
+
+
+def test_collection_zip_round_trips_and_serves_ranges(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    collection_id = _collection_with_files(manager)
+
+    status, headers, body = request(f'{base}/api/collections/{collection_id}/download')
+    assert status == 200
+    assert int(headers['Content-Length']) == len(body)
+    assert headers['ETag']
+    _check_archive(body)
+
+    status, headers, part = request(f'{base}/api/collections/{collection_id}/download', headers={'Range': 'bytes=100-70099'})
+    assert status == 206
+    assert part == body[100:70100]
+
+
+def test_assets_without_crc_export_as_a_streamed_zip_until_backfilled(hosted):
+    base, registry = hosted
+    manager = registry.vaults['test.vault'].manager
+    collection_id = _collection_with_files(manager)
+    with manager.lock:
+        manager.conn.execute("UPDATE assets SET crc32 = NULL WHERE id = (SELECT MIN(id) FROM assets)")
+        manager.conn.execute("DELETE FROM vault_properties WHERE key = 'checksums_version'")
+        manager.conn.commit()
+
+    assert manager.get_zip_layout('collection', collection_id) is None
+    status, headers, body = request(f'{base}/api/collections/{collection_id}/download')
+    assert status == 200
+    assert 'Content-Length' not in headers
+    _check_archive(body)
+
+    manager._backfill_checksums(manager._checksum_backfill_high_water())
+    assert manager.backfills['checksums']['state'] == 'done'
+    assert manager.get_zip_layout('collection', collection_id) is not None
+    with manager._get_read_conn() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM assets WHERE crc32 IS NULL").fetchone()[0] == 0
+        assert conn.execute("SELECT value FROM vault_properties WHERE key = 'checksums_version'").fetchone()[0] == '1'
+    status, headers, body = request(f'{base}/api/collections/{collection_id}/download')
+    assert int(headers['Content-Length']) == len(body)
+    _check_archive(body)